@@ -13,14 +13,15 @@ import random
 import asyncio
 import logging
 import aiohttp
-import aiofiles
-import subprocess
+import shutil
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 from tqdm import tqdm
 from playwright.async_api import async_playwright, Browser, Page, BrowserContext
 import config
+import fmp4_muxer
 
 # 初始化日志配置
 logging.basicConfig(
@@ -31,44 +32,668 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# DASH视频流编码：playurl 接口的 codecid 字段及 codecs 字符串前缀
+VIDEO_CODEC_IDS = {7: 'avc', 12: 'hevc', 13: 'av1'}
+VIDEO_CODEC_PREFIXES = {'avc1': 'avc', 'hev1': 'hevc', 'hvc1': 'hevc', 'av01': 'av1'}
+
+
+class UrlExpiredError(Exception):
+    """播放地址签名过期或被拒绝（403/410），需要重新获取播放地址"""
+
+
+# CDN返回这些状态码时视为签名地址失效
+EXPIRED_URL_STATUSES = (403, 410)
+
+# 纯音频输出的文件类型，校验时不要求包含视频流
+AUDIO_ONLY_SUFFIXES = {'.m4a', '.mka', '.flac', '.mp3', '.opus', '.ogg', '.aac'}
+
+# 内置fMP4合并器能直接输出的容器及其 ftyp 主品牌
+FMP4_MUX_BRANDS = {'.mp4': b'isom', '.m4a': b'M4A '}
+
+
+class ConnectionPoolStats:
+    """连接池统计：通过 aiohttp TraceConfig 记录请求数、新建/复用连接、建连耗时和DNS缓存命中"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.connector = None
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.connect_time = 0.0
+        self.dns_hits = 0
+        self.dns_misses = 0
+    
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+        return trace_config
+    
+    async def _on_request_start(self, session, context, params):
+        self.requests += 1
+    
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_started = time.monotonic()
+    
+    async def _on_connection_create_end(self, session, context, params):
+        # 包含DNS解析、TCP握手和TLS握手的耗时
+        self.new_connections += 1
+        self.connect_time += time.monotonic() - getattr(context, 'connect_started', time.monotonic())
+    
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.reused_connections += 1
+    
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_hits += 1
+    
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.dns_misses += 1
+    
+    def open_connections(self):
+        """当前连接池中的连接数（使用中 + 空闲保活）"""
+        if not self.connector or self.connector.closed:
+            return 0
+        # aiohttp 没有公开的连接计数接口，读取连接器内部状态
+        idle = sum(len(conns) for conns in getattr(self.connector, '_conns', {}).values())
+        return idle + len(getattr(self.connector, '_acquired', ()))
+    
+    def snapshot(self):
+        connections = self.new_connections + self.reused_connections
+        return {
+            'requests': self.requests,
+            'open_connections': self.open_connections(),
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+            'reuse_ratio': self.reused_connections / connections if connections else 0.0,
+            'avg_connect_time': self.connect_time / self.new_connections if self.new_connections else 0.0,
+            'dns_cache_hits': self.dns_hits,
+            'dns_cache_misses': self.dns_misses
+        }
+    
+    def summary(self):
+        stats = self.snapshot()
+        return (f"{self.name}: 请求 {stats['requests']} 次，打开连接 {stats['open_connections']} 个，"
+                f"新建 {stats['new_connections']} / 复用 {stats['reused_connections']} "
+                f"(复用率 {stats['reuse_ratio']:.0%})，平均建连 {stats['avg_connect_time'] * 1000:.0f} ms，"
+                f"DNS缓存命中 {stats['dns_cache_hits']}/{stats['dns_cache_hits'] + stats['dns_cache_misses']}")
+
+
+class BufferedFileWriter:
+    """流下载的写盘器：网络数据先聚合到大缓冲区，再整块定位写入文件
+    
+    每次写盘只需要一次线程池往返，避免逐个小数据块调用异步文件接口
+    """
+    
+    def __init__(self, path, buffer_size):
+        self.fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        self.buffer_size = buffer_size
+        # 不支持 os.pwrite 的平台（Windows）用 lseek + write，需要加锁
+        self.seek_lock = None if hasattr(os, 'pwrite') else threading.Lock()
+    
+    @staticmethod
+    def preallocate(path, size):
+        """创建并预分配文件：支持 posix_fallocate 时真正分配磁盘块，否则退化为 truncate"""
+        with open(path, 'wb') as f:
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                    return
+                except OSError as e:
+                    logger.debug(f"posix_fallocate 不可用，使用 truncate: {e}")
+            f.truncate(size)
+    
+    def _write_at(self, data, offset):
+        view = memoryview(data)
+        if self.seek_lock is None:
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self.seek_lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    written = os.write(self.fd, view)
+                    view = view[written:]
+    
+    async def write_at(self, data, offset):
+        """在线程池中把一整块数据写到文件的指定偏移"""
+        await asyncio.get_running_loop().run_in_executor(None, self._write_at, data, offset)
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class TokenBucket:
+    """令牌桶：按 rate（字节/秒）补充令牌，最多积攒 burst 个；rate 为 0 表示不限速
+    
+    consume 先扣除令牌（允许欠账），再等待欠账被补齐，因此单次可以消费超过 burst 的字节数
+    """
+    
+    def __init__(self, rate=0, burst=None):
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+    
+    def set_rate(self, rate, burst=None):
+        """运行时调整速率，正在等待的传输会在下一次检查时按新速率继续"""
+        self._refill()
+        self.rate = max(0, rate or 0)
+        self.burst = burst if burst is not None else self.rate
+        self.tokens = min(self.tokens, self.burst)
+    
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def consume(self, amount):
+        """消费 amount 字节的令牌，返回等待的秒数"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        self.tokens -= amount
+        waited = 0.0
+        while self.rate and self.tokens < 0:
+            # 分小段等待，速率在等待期间被调整时能及时生效
+            delay = min(-self.tokens / self.rate, 0.25)
+            await asyncio.sleep(delay)
+            waited += delay
+            self._refill()
+        return waited
+
+
+class BandwidthLimiter:
+    """进程内共享的带宽限制器：一个全局令牌桶加上每个下载任务各自的令牌桶
+    
+    所有并发的视频流和封面下载都经过同一个实例，总速率不超过全局上限
+    """
+    
+    def __init__(self, global_limit=0, job_limit=0, burst_seconds=1.0):
+        self.burst_seconds = burst_seconds
+        self.job_limit = job_limit
+        self.global_bucket = TokenBucket(global_limit, self._burst(global_limit))
+        self.job_buckets = {}
+    
+    def _burst(self, rate):
+        return int((rate or 0) * self.burst_seconds)
+    
+    def set_global_limit(self, rate):
+        """运行时调整全局上限（字节/秒，0 表示不限速）"""
+        self.global_bucket.set_rate(rate, self._burst(rate))
+    
+    def set_job_limit(self, rate, job=None):
+        """运行时调整单个任务的上限；不指定 job 时修改默认值并应用到所有进行中的任务"""
+        jobs = [job] if job is not None else list(self.job_buckets)
+        if job is None:
+            self.job_limit = rate
+        for name in jobs:
+            self.get_job_bucket(name).set_rate(rate, self._burst(rate))
+    
+    def get_job_bucket(self, job):
+        if job not in self.job_buckets:
+            self.job_buckets[job] = TokenBucket(self.job_limit, self._burst(self.job_limit))
+        return self.job_buckets[job]
+    
+    def release_job(self, job):
+        """任务结束后移除其令牌桶"""
+        self.job_buckets.pop(job, None)
+    
+    async def consume(self, amount, job=None):
+        """传输 amount 字节前（或后）调用，返回因限速等待的秒数"""
+        waited = 0.0
+        if job is not None:
+            waited += await self.get_job_bucket(job).consume(amount)
+        waited += await self.global_bucket.consume(amount)
+        return waited
+
+
+class ApiResponseCache:
+    """接口响应的磁盘缓存：每个条目一个JSON文件（cache_dir/命名空间/键.json），带过期时间"""
+    
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+    
+    def _path(self, namespace, key):
+        safe_key = re.sub(r'[^0-9A-Za-z_.-]', '_', str(key))
+        return self.cache_dir / namespace / f"{safe_key}.json"
+    
+    def get(self, namespace, key):
+        """返回未过期的缓存数据，不存在或已过期时返回 None"""
+        path = self._path(namespace, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if entry.get('expires_at', 0) <= time.time():
+            self.delete(namespace, key)
+            return None
+        return entry.get('data')
+    
+    def set(self, namespace, key, data, expires_at):
+        path = self._path(namespace, key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'data': data}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"写入接口缓存失败: {path} - {e}")
+    
+    def delete(self, namespace, key):
+        try:
+            self._path(namespace, key).unlink()
+        except OSError:
+            pass
+
+
+class CompletedDownloadIndex:
+    """已完成下载的索引（JSON文件）：按BV号记录输出文件，多P视频另按cid记录各分P
+    
+    以BV号而不是文件名为键，视频改标题后仍能识别已下载的文件。文件路径相对索引文件所在目录保存，
+    与运行时的工作目录无关；修改先记在内存中，每隔 save_interval 秒或关闭时写回磁盘
+    """
+    
+    def __init__(self, path, save_interval=30):
+        self.path = Path(path)
+        self.base_dir = self.path.parent.resolve()
+        self.save_interval = save_interval
+        self.entries = {}
+        self.dirty = False
+        self.last_save = time.monotonic()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def save(self):
+        """把未保存的修改写回索引文件（先写临时文件再替换）"""
+        if not self.dirty:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        except OSError as e:
+            logger.warning(f"保存下载索引失败: {e}")
+    
+    def to_stored(self, path):
+        path = Path(path).resolve()
+        try:
+            return Path(os.path.relpath(path, self.base_dir)).as_posix()
+        except ValueError:
+            # Windows 下不在同一个盘符时无法使用相对路径
+            return str(path)
+    
+    def from_stored(self, path):
+        return self.base_dir / path
+    
+    def get_video(self, bvid):
+        """返回视频的全部输出文件；未完成或文件已被删除/隔离时返回 None"""
+        files = [self.from_stored(path) for path in self.entries.get(bvid, {}).get('files', [])]
+        if files and all(path.exists() for path in files):
+            return files
+        return None
+    
+    def get_page(self, bvid, cid):
+        path = self.entries.get(bvid, {}).get('pages', {}).get(str(cid))
+        if path and self.from_stored(path).exists():
+            return self.from_stored(path)
+        return None
+    
+    def mark_page(self, bvid, cid, path):
+        self.entries.setdefault(bvid, {}).setdefault('pages', {})[str(cid)] = self.to_stored(path)
+        self.dirty = True
+    
+    def mark_video(self, bvid, paths):
+        entry = self.entries.setdefault(bvid, {})
+        entry['files'] = [self.to_stored(path) for path in paths]
+        entry['completed_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.dirty = True
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+
+class DiskSpaceBudget:
+    """临时目录和输出目录的磁盘空间预算
+    
+    每个分P下载前按预计大小预留空间：临时流文件记在临时目录所在的磁盘上，合并输出记在
+    输出目录所在的磁盘上（两者可以是不同的磁盘）。预留总量超过配额或任一磁盘剩余空间不足时
+    排队等待，避免并发下载中途把磁盘写满
+    """
+    
+    def __init__(self, quota=0, min_free=0):
+        self.quota = quota
+        self.min_free = min_free
+        # 预留名 -> {'streams': {临时流路径: 预计字节数}, 'temp': 是否写临时文件, 'output': 合并输出路径}
+        self.tickets = {}
+        self.filesystems = {}       # 目录 -> (文件系统标识, 用于查询剩余空间的已存在目录)
+        self.peak_reserved = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self._condition = None
+    
+    @property
+    def condition(self):
+        # 在事件循环中首次使用时再创建
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    def get_filesystem(self, directory):
+        """目录所在的文件系统（目录还不存在时按最近的已存在上级目录判断）"""
+        directory = Path(directory)
+        if directory not in self.filesystems:
+            existing = directory.resolve()
+            while not existing.exists() and existing.parent != existing:
+                existing = existing.parent
+            try:
+                key = os.stat(existing).st_dev
+            except OSError:
+                key = str(existing)
+            self.filesystems[directory] = (key, existing)
+        return self.filesystems[directory]
+    
+    def ticket_parts(self, ticket):
+        """预留的各部分：[(目标路径, 预计字节数, 用来估算已写入量的文件), ...]"""
+        parts = []
+        if ticket['temp']:
+            for path, size in ticket['streams'].items():
+                parts.append((path, size, (path, path.with_name(path.name + '.part'))))
+        if ticket['output']:
+            # 合并输出的大小约等于各个流之和
+            parts.append((ticket['output'], sum(ticket['streams'].values()), (ticket['output'],)))
+        return parts
+    
+    def ticket_size(self, ticket):
+        return int(sum(size for _, size, _ in self.ticket_parts(ticket)))
+    
+    @property
+    def reserved(self):
+        return sum(self.ticket_size(ticket) for ticket in self.tickets.values())
+    
+    def usage_by_filesystem(self, tickets, subtract_written=True):
+        """按文件系统汇总预留量：{文件系统标识: [已存在目录, 字节数]}
+        
+        subtract_written 时只统计已预留但还没写到磁盘上的部分（按各文件及其 .part 的当前大小估算）
+        """
+        usage = {}
+        for ticket in tickets:
+            for path, size, written_paths in self.ticket_parts(ticket):
+                key, directory = self.get_filesystem(path.parent)
+                written = 0
+                if subtract_written:
+                    for candidate in written_paths:
+                        try:
+                            written += candidate.stat().st_size
+                        except OSError:
+                            pass
+                usage.setdefault(key, [directory, 0])[1] += max(0, int(size) - written)
+        return usage
+    
+    def fits(self, ticket):
+        if not self.tickets:
+            # 没有其他下载时总是放行，否则超出配额的单个视频会永远等待
+            return True
+        if self.quota and self.reserved + self.ticket_size(ticket) > self.quota:
+            return False
+        if self.min_free:
+            pending = self.usage_by_filesystem(self.tickets.values())
+            for key, (directory, size) in self.usage_by_filesystem([ticket], subtract_written=False).items():
+                try:
+                    free = shutil.disk_usage(directory).free
+                except OSError:
+                    continue
+                if free - pending.get(key, (None, 0))[1] - size < self.min_free:
+                    return False
+        return True
+    
+    async def acquire(self, name, sizes, output=None, temp=True):
+        """预留临时流文件 sizes（{路径: 预计字节数}）和合并输出 output 所需的空间，空间不足时等待其他下载释放
+        
+        temp 为 False（流式合并）时不写临时文件，只预留输出文件的空间
+        """
+        ticket = {'streams': dict(sizes), 'temp': temp, 'output': Path(output) if output else None}
+        size = self.ticket_size(ticket)
+        started = time.monotonic()
+        async with self.condition:
+            if not self.fits(ticket):
+                self.waits += 1
+                logger.info(f"磁盘空间预算不足，等待其他下载完成: {name} "
+                            f"(需要 {size / 1024 / 1024:.0f} MB，{self.summary()})")
+                while not self.fits(ticket):
+                    try:
+                        # 磁盘剩余空间也可能被其他程序释放，定期重新检查
+                        await asyncio.wait_for(self.condition.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        pass
+                self.wait_time += time.monotonic() - started
+            self.tickets[name] = ticket
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+        return name
+    
+    async def update(self, path, size):
+        """下载拿到 content-length 后用实际大小替换估算值"""
+        for ticket in self.tickets.values():
+            if path in ticket['streams']:
+                ticket['streams'][path] = size
+                async with self.condition:
+                    self.condition.notify_all()
+                return
+    
+    async def release(self, name):
+        if self.tickets.pop(name, None) is not None:
+            async with self.condition:
+                self.condition.notify_all()
+    
+    def snapshot(self):
+        return {
+            'reserved': self.reserved,
+            'quota': self.quota,
+            'active': len(self.tickets),
+            'peak_reserved': self.peak_reserved,
+            'waits': self.waits,
+            'wait_time': self.wait_time
+        }
+    
+    def summary(self):
+        stats = self.snapshot()
+        quota = f"{stats['quota'] / 1024 / 1024:.0f} MB" if stats['quota'] else "不限"
+        return (f"已预留 {stats['reserved'] / 1024 / 1024:.0f} MB / 配额 {quota}，"
+                f"进行中 {stats['active']} 个，峰值 {stats['peak_reserved'] / 1024 / 1024:.0f} MB，"
+                f"等待 {stats['waits']} 次共 {stats['wait_time']:.0f} 秒")
+
+
+# 进程内所有传输共用的带宽限制器，可在运行时通过 set_global_limit / set_job_limit 调整
+bandwidth_limiter = BandwidthLimiter(
+    config.BANDWIDTH_CONFIG.get('global_limit', 0),
+    config.BANDWIDTH_CONFIG.get('job_limit', 0),
+    config.BANDWIDTH_CONFIG.get('burst_seconds', 1.0)
+)
+
+
 class BilibiliVideoDownloader:
     """哔哩哔哩视频下载器"""
     
     def __init__(self):
-        self.session = None
+        # api.bilibili.com 接口与 upos/hdslb CDN 下载使用各自调优的连接池
+        self.api_session = None
+        self.cdn_session = None
+        self.pool_stats = {
+            'api': ConnectionPoolStats('API连接池'),
+            'cdn': ConnectionPoolStats('CDN连接池')
+        }
         self.temp_dir = Path(config.VIDEO_DOWNLOAD_CONFIG['temp_dir'])
         self.output_dir = Path(config.VIDEO_DOWNLOAD_CONFIG['output_dir'])
         self.temp_dir.mkdir(exist_ok=True)
         self.output_dir.mkdir(exist_ok=True)
+        # FFmpeg合并进程池：限制同时运行的合并进程数，合并期间下载可继续进行
+        self.merge_semaphore = asyncio.Semaphore(max(1, int(config.FFMPEG_CONFIG.get('max_workers', 2))))
+        # 流式合并器线程池，首次流式合并时创建
+        self.stream_mux_executor = None
+        # ffprobe路径在首次使用时查找并缓存
+        self.ffprobe_path = None
+        self.ffprobe_resolved = False
+        # ffprobe校验进程池：合并后的完整性检查与批量 --verify 共用
+        self.verify_semaphore = asyncio.Semaphore(max(1, int(config.VERIFY_CONFIG.get('max_workers', 4))))
+        # 分段文件下载完成时按 content-length 确认的字节数，合并前再次核对
+        self.segment_sizes = {}
+        # 已完成下载的索引，在任何延迟和网络请求之前用来跳过已下载的视频
+        self.completed_index = CompletedDownloadIndex(
+            config.VIDEO_DOWNLOAD_CONFIG.get('completed_index', self.output_dir / 'completed_index.json')
+        )
+        # 视频信息和播放地址的磁盘缓存，重新运行时无需再次请求接口
+        self.api_cache = (ApiResponseCache(config.API_CACHE_CONFIG.get('cache_dir', '.api_cache'))
+                          if config.API_CACHE_CONFIG.get('enabled', True) else None)
+        # 临时流文件和合并输出的磁盘空间预算，空间不足时新的下载排队等待
+        self.disk_budget = (DiskSpaceBudget(
+            config.DISK_BUDGET_CONFIG.get('quota', 0),
+            config.DISK_BUDGET_CONFIG.get('min_free_space', 0)
+        ) if config.DISK_BUDGET_CONFIG.get('enabled', True) else None)
+        if config.DISK_BUDGET_CONFIG.get('cleanup_orphans', True):
+            self.cleanup_temp_dir()
+    
+    def cleanup_temp_dir(self):
+        """清理上次崩溃留下的临时文件
+        
+        保留成对的 .part 和 .part.json（可以断点续传）以及较新的 .m4s（合并前中断时可直接复用），
+        删除超过 orphan_max_age 的 .m4s、缺少进度记录的 .part、没有对应 .part 的进度记录和其他残留
+        """
+        max_age = config.DISK_BUDGET_CONFIG.get('orphan_max_age', 24 * 3600)
+        now = time.time()
+        removed = 0
+        freed = 0
+        for path in self.temp_dir.iterdir():
+            if not path.is_file():
+                continue
+            name = path.name
+            if name.endswith('.part'):
+                orphan = not path.with_name(name + '.json').exists()
+            elif name.endswith('.part.json'):
+                orphan = not path.with_name(name[:-len('.json')]).exists()
+            elif name.endswith('.m4s'):
+                orphan = now - path.stat().st_mtime > max_age
+            else:
+                # 中断的拼接列表、写了一半的进度记录等
+                orphan = name.endswith(('.concat.txt', '.tmp'))
+            if not orphan:
+                continue
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                removed += 1
+                freed += size
+            except OSError as e:
+                logger.debug(f"无法删除临时文件 {name}: {e}")
+        if removed:
+            logger.info(f"清理残留临时文件 {removed} 个，释放 {freed / 1024 / 1024:.1f} MB")
         
     async def init_session(self):
-        """初始化HTTP会话"""
-        if not self.session:
-            import random
-            
-            # 随机选择User-Agent和请求头模板
-            user_agent = random.choice(config.VIDEO_DOWNLOAD_CONFIG['user_agents'])
-            headers_template = random.choice(config.VIDEO_DOWNLOAD_CONFIG['headers_templates'])
-            
-            # 构建请求头
-            headers = headers_template.copy()
-            headers['User-Agent'] = user_agent
-            headers['Referer'] = random.choice(config.VIDEO_DOWNLOAD_CONFIG['referers'])
-            
-            timeout = aiohttp.ClientTimeout(total=config.VIDEO_DOWNLOAD_CONFIG['segment_timeout'])
-            self.session = aiohttp.ClientSession(
-                timeout=timeout,
-                headers=headers
+        """初始化HTTP会话：API和CDN各一个连接池，连接和DNS解析结果在并发请求之间复用"""
+        if not self.api_session:
+            self.api_session = self.create_pooled_session(
+                'api', aiohttp.ClientTimeout(total=config.VIDEO_API_CONFIG.get('timeout', 30))
             )
+        if not self.cdn_session:
+            self.cdn_session = self.create_pooled_session(
+                'cdn', aiohttp.ClientTimeout(total=config.VIDEO_DOWNLOAD_CONFIG['segment_timeout']),
+                # 增大响应读取缓冲区，减少大文件下载时的读取次数
+                read_bufsize=config.VIDEO_DOWNLOAD_CONFIG.get('read_bufsize', 2 ** 16)
+            )
+    
+    def create_pooled_session(self, pool, timeout, **kwargs):
+        """按 CONNECTION_POOL_CONFIG[pool] 创建带连接数限制、DNS缓存和keep-alive的会话"""
+        pool_config = config.CONNECTION_POOL_CONFIG.get(pool, {})
+        limit = pool_config.get('limit', 100)
+        limit_per_host = pool_config.get('limit_per_host', 0)
+        if limit_per_host is None:
+            # 未配置时按下载并发计算：所有分段连接都可能落在同一个CDN主机上
+            limit_per_host = self.max_stream_connections()
+            if limit:
+                limit = max(limit, limit_per_host)
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=pool_config.get('ttl_dns_cache', 300),
+            keepalive_timeout=pool_config.get('keepalive_timeout', 30)
+        )
+        stats = self.pool_stats[pool]
+        stats.connector = connector
+        # 请求头不固定在会话上，每个请求通过 build_headers 单独生成
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[stats.trace_config()],
+            **kwargs
+        )
+    
+    def max_stream_connections(self):
+        """同时进行的最大分段连接数：max_concurrent 个视频 × max_concurrent_pages 个分P × 2个流 × connections"""
+        download_config = config.VIDEO_DOWNLOAD_CONFIG
+        return (max(1, int(download_config.get('max_concurrent', 1)))
+                * max(1, int(download_config.get('max_concurrent_pages', 2)))
+                * 2
+                * max(1, int(download_config.get('connections', 1))))
+    
+    def build_headers(self, extra=None):
+        """为单个请求随机组合请求头模板、User-Agent和Referer
+        
+        模板中的 Range 会被去掉，字节范围由下载逻辑按需设置
+        """
+        template = random.choice(config.VIDEO_DOWNLOAD_CONFIG['headers_templates'])
+        headers = {key: value for key, value in template.items() if key.lower() != 'range'}
+        headers['User-Agent'] = random.choice(config.VIDEO_DOWNLOAD_CONFIG['user_agents'])
+        headers['Referer'] = random.choice(config.VIDEO_DOWNLOAD_CONFIG['referers'])
+        if extra:
+            headers.update(extra)
+        return headers
+    
+    def get_pool_stats(self):
+        """返回各连接池的统计数据"""
+        return {pool: stats.snapshot() for pool, stats in self.pool_stats.items()}
     
     async def close_session(self):
         """关闭HTTP会话"""
-        if self.session:
-            await self.session.close()
-            self.session = None
+        for stats in self.pool_stats.values():
+            if stats.requests:
+                logger.info(stats.summary())
+        if self.disk_budget and self.disk_budget.peak_reserved:
+            logger.info(f"磁盘空间预算: {self.disk_budget.summary()}")
+        self.completed_index.save()
+        for attr in ('api_session', 'cdn_session'):
+            session = getattr(self, attr)
+            if session:
+                await session.close()
+                setattr(self, attr, None)
+        if self.stream_mux_executor:
+            self.stream_mux_executor.shutdown(wait=False)
+            self.stream_mux_executor = None
     
     async def get_video_info(self, bvid):
-        """获取视频信息"""
+        """获取视频信息（优先读取磁盘缓存，命中时不做反爬延迟）"""
+        if self.api_cache:
+            cached = self.api_cache.get('view', bvid)
+            if cached:
+                logger.debug(f"使用缓存的视频信息: {bvid}")
+                return cached
+        
         try:
             await self.init_session()
             
@@ -85,20 +710,22 @@ class BilibiliVideoDownloader:
             params = {'bvid': bvid}
             
             # 添加API请求的请求头
-            headers = {
-                'Referer': random.choice(config.VIDEO_DOWNLOAD_CONFIG['referers']),
+            headers = self.build_headers({
                 'Accept': 'application/json, text/plain, */*',
                 'Accept-Language': 'zh-CN,zh;q=0.9',
                 'Origin': 'https://www.bilibili.com'
-            }
+            })
             
             logger.debug(f"请求视频信息: {bvid}, URL: {url}")
             
-            async with self.session.get(url, params=params, headers=headers) as response:
+            async with self.api_session.get(url, params=params, headers=headers) as response:
                 if response.status == 200:
                     data = await response.json()
                     if data.get('code') == 0:
                         logger.debug(f"成功获取视频信息: {bvid}")
+                        if self.api_cache and data.get('data'):
+                            ttl = config.API_CACHE_CONFIG.get('video_info_ttl', 7 * 24 * 3600)
+                            self.api_cache.set('view', bvid, data['data'], time.time() + ttl)
                         return data.get('data')
                     else:
                         error_msg = data.get('message', '未知错误')
@@ -111,8 +738,18 @@ class BilibiliVideoDownloader:
             logger.error(f"获取视频信息异常: {bvid} - {e}")
             return None
     
-    async def get_play_url(self, bvid, cid):
-        """获取视频播放URL"""
+    async def get_play_url(self, bvid, cid, refresh=False):
+        """获取视频播放URL（签名地址过期前使用磁盘缓存，命中时不做反爬延迟）
+        
+        refresh: 忽略缓存重新请求（缓存的地址已被CDN拒绝时使用）
+        """
+        cache_key = f"{bvid}_{cid}_{config.VIDEO_API_CONFIG['required_params'].get('fnval', 0)}"
+        if self.api_cache and not refresh:
+            cached = self.api_cache.get('playurl', cache_key)
+            if cached:
+                logger.debug(f"使用缓存的播放URL: {bvid}, CID: {cid}")
+                return cached
+        
         try:
             await self.init_session()
             
@@ -132,20 +769,22 @@ class BilibiliVideoDownloader:
                 **config.VIDEO_API_CONFIG['required_params']
             }
             
-            # 添加Referer头
-            headers = {
-                'Referer': random.choice(config.VIDEO_DOWNLOAD_CONFIG['referers']),
+            # 添加API请求的请求头
+            headers = self.build_headers({
                 'Accept': 'application/json, text/plain, */*',
                 'Origin': 'https://www.bilibili.com'
-            }
+            })
             
             logger.debug(f"请求播放URL: {bvid}, CID: {cid}")
             
-            async with self.session.get(url, params=params, headers=headers) as response:
+            async with self.api_session.get(url, params=params, headers=headers) as response:
                 if response.status == 200:
                     data = await response.json()
                     if data.get('code') == 0:
                         logger.debug(f"成功获取播放URL: {bvid}")
+                        if self.api_cache and data.get('data'):
+                            self.api_cache.set('playurl', cache_key, data['data'],
+                                               self.get_play_url_expiry(data['data']))
                         return data.get('data')
                     else:
                         error_msg = data.get('message', '未知错误')
@@ -158,8 +797,29 @@ class BilibiliVideoDownloader:
             logger.error(f"获取播放URL异常: {bvid} - {e}")
             return None
     
-    async def download_segment(self, url, output_path, progress_callback=None):
-        """下载视频分段"""
+    def get_play_url_expiry(self, play_data):
+        """播放数据的缓存过期时间：取所有流地址（含杜比全景声和Hi-Res无损音频）中最早的 deadline，
+        并提前 playurl_margin 秒失效"""
+        deadlines = []
+        dash = play_data.get('dash') or {}
+        for stream in (dash.get('video') or []) + self.collect_audio_streams(dash):
+            for url in self.get_stream_urls(stream):
+                deadline = parse_qs(urlparse(url).query).get('deadline')
+                if deadline and deadline[0].isdigit():
+                    deadlines.append(int(deadline[0]))
+        
+        if not deadlines:
+            return time.time() + config.API_CACHE_CONFIG.get('playurl_default_ttl', 1800)
+        return min(deadlines) - config.API_CACHE_CONFIG.get('playurl_margin', 300)
+    
+    async def download_segment(self, urls, output_path, progress_callback=None, job=None, refresh_urls=None):
+        """下载视频分段 - 多连接HTTP Range并行下载，支持 .part 断点续传和CDN镜像切换
+        
+        urls: 单个URL，或按优先级排列的URL列表（baseUrl + backupUrl 镜像）
+        job: 限速任务名（通常为BV号），同一任务的所有流共用一个单任务限速桶
+        refresh_urls: 可选的异步回调，播放地址过期（deadline已过或CDN返回403）时调用，
+                      返回同一个流重新签名后的URL列表，下载从 .part 记录的断点继续
+        """
         try:
             await self.init_session()
             
@@ -169,117 +829,767 @@ class BilibiliVideoDownloader:
             delay = random.uniform(1, 3)  # 下载间隔较短
             await asyncio.sleep(delay)
             
-            headers = {
-                'Referer': random.choice(config.VIDEO_DOWNLOAD_CONFIG['referers']),
-                'User-Agent': random.choice(config.VIDEO_DOWNLOAD_CONFIG['user_agents']),
+            headers = self.build_headers({
                 'Accept': '*/*',
                 'Accept-Encoding': 'identity;q=1, *;q=0'
-            }
+            })
             
-            logger.debug(f"开始下载分段: {output_path.name}")
+            if isinstance(urls, str):
+                urls = [urls]
             
-            async with self.session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    total_size = int(response.headers.get('content-length', 0))
-                    downloaded = 0
-                    
-                    async with aiofiles.open(output_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                            downloaded += len(chunk)
-                            if progress_callback:
-                                progress_callback(downloaded, total_size)
-                    
-                    logger.debug(f"分段下载完成: {output_path.name}")
-                    return True
-                else:
-                    logger.error(f"下载失败: {output_path.name} - 状态码: {response.status}")
-                    return False
+            # 排队太久（或续传时）地址已过期，先重新获取再请求
+            if refresh_urls and urls and all(self.is_url_expired(url) for url in urls):
+                logger.info(f"播放地址已过期，重新获取: {output_path.name}")
+                urls = await refresh_urls() or urls
+            
+            max_refresh = max(0, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_url_refresh', 3)))
+            refresh_count = 0
+            while True:
+                try:
+                    return await self.download_from_mirrors(urls, headers, output_path, progress_callback, job)
+                except UrlExpiredError as e:
+                    if not refresh_urls or refresh_count >= max_refresh:
+                        raise
+                    refresh_count += 1
+                    logger.warning(f"播放地址失效，重新获取后从断点继续 ({refresh_count}/{max_refresh}): "
+                                   f"{output_path.name} - {e}")
+                    new_urls = await refresh_urls()
+                    if not new_urls:
+                        logger.error(f"重新获取播放地址失败: {output_path.name}")
+                        return False
+                    urls = new_urls
         except Exception as e:
             logger.error(f"下载分段异常: {output_path.name} - {e}")
             return False
     
-    def find_ffmpeg_path(self):
-        """查找FFmpeg路径 - 跨平台支持"""
-        import platform
-        import shutil
-        import os
+    def is_url_expired(self, url):
+        """根据播放地址中的 deadline 参数判断签名是否已过期"""
+        deadline = parse_qs(urlparse(url).query).get('deadline')
+        return bool(deadline and deadline[0].isdigit() and int(deadline[0]) <= time.time())
+    
+    async def download_from_mirrors(self, urls, headers, output_path, progress_callback=None, job=None):
+        """探测镜像后选择下载方式：多连接Range、单连接续传或整体下载
         
-        # 1. 优先使用配置文件中的自定义路径
-        if config.FFMPEG_CONFIG.get('custom_path'):
-            custom_path = config.FFMPEG_CONFIG['custom_path']
-            if Path(custom_path).exists():
-                logger.info(f"使用自定义FFmpeg路径: {custom_path}")
-                return custom_path
-            else:
-                logger.warning(f"自定义FFmpeg路径不存在: {custom_path}")
+        地址签名失效时抛出 UrlExpiredError，由 download_segment 重新获取地址
+        """
+        connections = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('connections', 1)))
+        chunk_size = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('chunk_size', 4 * 1024 * 1024)))
         
-        # 2. 检查PATH环境变量
-        system_ffmpeg = shutil.which('ffmpeg')
-        if system_ffmpeg:
-            logger.info(f"在PATH中找到FFmpeg: {system_ffmpeg}")
-            return system_ffmpeg
+        logger.debug(f"开始下载分段: {output_path.name}")
         
-        # 3. 根据平台检查常见路径
-        system = platform.system().lower()
-        if system == 'windows':
-            search_paths = config.FFMPEG_CONFIG['search_paths']['windows']
-        elif system == 'linux':
-            search_paths = config.FFMPEG_CONFIG['search_paths']['linux']
-        elif system == 'darwin':  # macOS
-            search_paths = config.FFMPEG_CONFIG['search_paths']['darwin']
-        else:
-            logger.warning(f"未知系统类型: {system}，使用通用检测")
-            search_paths = ['ffmpeg', './ffmpeg', './bin/ffmpeg']
+        # 用小的Range请求探测各镜像的速度、文件大小以及是否支持Range
+        mirrors = await self.rank_mirrors(urls, headers)
+        if not mirrors:
+            logger.error(f"下载失败: {output_path.name} - 所有镜像均不可用")
+            return False
         
-        # 4. 遍历搜索路径
-        for path in search_paths:
+        best = mirrors[0]
+        if best['status'] == 200:
+            # 服务器忽略了 Range，只能单连接下载完整文件（无法续传）
+            logger.debug(f"服务器不支持Range，使用单连接下载: {output_path.name}")
+            async with self.cdn_session.get(best['url'], headers=headers) as response:
+                if response.status in EXPIRED_URL_STATUSES:
+                    raise UrlExpiredError(f"状态码: {response.status}")
+                if response.status != 200:
+                    logger.error(f"下载失败: {output_path.name} - 状态码: {response.status}")
+                    return False
+                return await self.write_response_to_file(response, best['url'], output_path,
+                                                         progress_callback, job=job)
+        
+        total_size = best['total_size']
+        if total_size and self.disk_budget:
+            await self.disk_budget.update(output_path, total_size)
+        if not total_size:
+            logger.debug(f"无法获取文件大小，使用单连接下载: {output_path.name}")
+            return await self.download_single_connection(best['url'], headers, output_path,
+                                                         progress_callback, job)
+        
+        # 目标文件已完整存在（例如上次在合并前中断）时直接复用
+        if output_path.exists() and output_path.stat().st_size == total_size:
+            logger.debug(f"分段文件已完整存在，跳过下载: {output_path.name}")
+            self.segment_sizes[str(output_path)] = total_size
+            if progress_callback:
+                progress_callback(total_size, total_size)
+            return True
+        
+        # 只保留大小一致且支持Range的镜像，用于下载中途切换
+        mirror_urls = [
+            mirror['url'] for mirror in mirrors
+            if mirror['status'] == 206 and mirror['total_size'] == total_size
+        ]
+        return await self.download_ranges(
+            mirror_urls, headers, output_path, total_size,
+            connections, chunk_size, progress_callback, job
+        )
+    
+    async def rank_mirrors(self, urls, headers):
+        """并行探测CDN镜像，按实测速度从快到慢排序
+        
+        每个镜像请求开头的一小段数据（VIDEO_DOWNLOAD_CONFIG['mirror_probe_size']），
+        返回 [{'url', 'status', 'total_size', 'speed'}, ...]，探测失败的镜像被剔除
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        urls = list(dict.fromkeys(url for url in urls if url))
+        
+        # 只有一个地址时无需测速，1字节的请求即可拿到文件大小
+        probe_size = 1 if len(urls) == 1 else max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('mirror_probe_size', 256 * 1024)))
+        probe_timeout = aiohttp.ClientTimeout(total=config.VIDEO_DOWNLOAD_CONFIG.get('mirror_probe_timeout', 10))
+        
+        async def probe(url):
+            started = time.monotonic()
             try:
-                # 转换为绝对路径进行检查
-                if os.path.isabs(path):
-                    check_path = Path(path)
-                else:
-                    # 相对路径相对于当前工作目录
-                    check_path = Path(os.getcwd()) / path
-                
-                logger.debug(f"检查路径: {check_path}")
-                
-                if check_path.exists() and check_path.is_file():
-                    absolute_path = str(check_path.resolve())
-                    logger.info(f"在搜索路径中找到FFmpeg: {absolute_path}")
-                    return absolute_path
+                probe_headers = dict(headers, Range=f'bytes=0-{probe_size - 1}')
+                async with self.cdn_session.get(url, headers=probe_headers, timeout=probe_timeout) as response:
+                    if response.status in EXPIRED_URL_STATUSES:
+                        logger.debug(f"镜像地址失效 ({response.status}): {urlparse(url).netloc}")
+                        return {'url': url, 'status': response.status}
+                    if response.status not in (200, 206):
+                        logger.debug(f"镜像不可用 ({response.status}): {urlparse(url).netloc}")
+                        return None
+                    
+                    received = 0
+                    while received < probe_size:
+                        data = await response.content.read(probe_size - received)
+                        if not data:
+                            break
+                        received += len(data)
                     
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    return {
+                        'url': url,
+                        'status': response.status,
+                        'total_size': (self.parse_content_range(response.headers.get('Content-Range'))
+                                       if response.status == 206 else None),
+                        'speed': received / elapsed
+                    }
             except Exception as e:
-                logger.debug(f"检查路径 {path} 时出错: {e}")
-                continue
+                logger.debug(f"镜像探测失败: {urlparse(url).netloc} - {e}")
+                return None
         
-        # 5. 所有路径都未找到
-        logger.warning("未找到FFmpeg，已检查的路径:")
-        for path in search_paths:
-            try:
-                if os.path.isabs(path):
-                    check_path = Path(path)
-                else:
-                    check_path = Path(os.getcwd()) / path
-                logger.warning(f"  - {check_path} (存在: {check_path.exists()})")
-            except:
-                logger.warning(f"  - {path} (检查失败)")
+        results = [result for result in await asyncio.gather(*(probe(url) for url in urls)) if result]
+        mirrors = [result for result in results if result['status'] in (200, 206)]
+        if not mirrors and results:
+            # 所有可连接的镜像都拒绝了请求，说明签名地址已失效
+            raise UrlExpiredError(f"所有镜像返回 {sorted({result['status'] for result in results})}")
+        # 支持Range的镜像优先，其次按速度排序
+        mirrors.sort(key=lambda mirror: (mirror['status'] != 206, -mirror['speed']))
+        
+        if len(urls) > 1:
+            for mirror in mirrors:
+                logger.debug(f"镜像测速: {urlparse(mirror['url']).netloc} - {mirror['speed'] / 1024:.0f} KB/s")
         
+        return mirrors
+    
+    def parse_content_range(self, content_range):
+        """解析 Content-Range 响应头，返回文件总大小（未知时返回 None）"""
+        if not content_range:
+            return None
+        match = re.match(r'bytes\s+\d+-\d+/(\d+)', content_range.strip())
+        if match:
+            return int(match.group(1))
         return None
+    
+    def parse_content_range_start(self, content_range):
+        """解析 Content-Range 响应头，返回本次响应的起始字节位置（无法解析时返回 None）"""
+        if not content_range:
+            return None
+        match = re.match(r'bytes\s+(\d+)-\d+/', content_range.strip())
+        if match:
+            return int(match.group(1))
+        return None
+    
+    def get_write_buffer_size(self):
+        """写盘缓冲区大小，限制在 1-8 MB 之间"""
+        buffer_size = int(config.VIDEO_DOWNLOAD_CONFIG.get('write_buffer_size', 4 * 1024 * 1024))
+        return min(max(buffer_size, 1024 * 1024), 8 * 1024 * 1024)
+    
+    def get_part_paths(self, output_path):
+        """获取下载中的 .part 文件及其进度记录文件路径"""
+        part_path = output_path.with_name(output_path.name + '.part')
+        meta_path = output_path.with_name(output_path.name + '.part.json')
+        return part_path, meta_path
+    
+    def load_part_meta(self, meta_path):
+        """读取 .part 进度记录，不存在或损坏时返回 None"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save_part_meta(self, meta_path, meta):
+        """保存 .part 进度记录（先写临时文件再替换，避免中断时写坏）"""
+        tmp_path = meta_path.with_name(meta_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+    
+    def is_same_source(self, meta, urls):
+        """判断进度记录是否对应同一个流
         
-    def show_ffmpeg_install_guide(self):
-        """显示FFmpeg安装指南 - 跨平台支持"""
-        import platform
+        B站的播放地址每次获取都会重新签名（查询参数不同），镜像之间主机名也不同，
+        因此只比较URL路径
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        return bool(meta) and any(meta.get('url_path') == urlparse(url).path for url in urls)
+    
+    def finalize_part(self, part_path, meta_path, output_path, expected_size):
+        """校验 .part 文件大小后重命名为最终文件"""
+        actual_size = part_path.stat().st_size
+        if expected_size and actual_size != expected_size:
+            logger.error(f"下载不完整: {output_path.name} - {actual_size}/{expected_size} 字节")
+            return False
         
-        system = platform.system().lower()
+        os.replace(part_path, output_path)
+        try:
+            meta_path.unlink()
+        except OSError:
+            pass
+        if expected_size:
+            self.segment_sizes[str(output_path)] = expected_size
         
-        print("❌ FFmpeg未找到，无法合并视频")
-        print("📝 FFmpeg 安装指南:")
-        print()
+        logger.debug(f"分段下载完成: {output_path.name}")
+        return True
+    
+    async def download_single_connection(self, url, headers, output_path, progress_callback=None, job=None):
+        """单连接下载（大小未知时），有同源 .part 文件时用 Range: bytes=N- 续传"""
+        part_path, meta_path = self.get_part_paths(output_path)
+        meta = self.load_part_meta(meta_path)
         
-        if system == 'windows':
-            print("👾 Windows 安装方法:")
-            print("  方法1: 包管理器安装 (推荐)")
+        offset = 0
+        if self.is_same_source(meta, url) and meta.get('mode') == 'stream' and part_path.exists():
+            offset = part_path.stat().st_size
+            if offset:
+                logger.info(f"断点续传: {output_path.name} 从 {offset} 字节继续")
+        
+        while True:
+            async with self.cdn_session.get(url, headers=dict(headers, Range=f'bytes={offset}-')) as response:
+                if response.status == 200:
+                    offset = 0  # 服务器返回了完整文件，从头写入
+                elif response.status in EXPIRED_URL_STATUSES:
+                    raise UrlExpiredError(f"状态码: {response.status}")
+                elif response.status != 206:
+                    logger.error(f"下载失败: {output_path.name} - 状态码: {response.status}")
+                    return False
+                else:
+                    # 返回的范围与断点不符时直接写入会弄坏 .part 文件，和返回200一样从头下载
+                    content_range = response.headers.get('Content-Range')
+                    start = self.parse_content_range_start(content_range)
+                    if start is not None and start != offset:
+                        if not offset:
+                            raise Exception(f"Range响应起始位置不符: 请求 0，返回 {content_range}")
+                        logger.warning(f"服务器没有从断点 {offset} 续传（{content_range}），从头下载: {output_path.name}")
+                        offset = 0
+                        if start != 0:
+                            continue
+                return await self.write_response_to_file(response, url, output_path, progress_callback, offset, job)
+    
+    async def write_response_to_file(self, response, url, output_path, progress_callback=None, offset=0, job=None):
+        """将单个响应体顺序写入 .part 文件，完成并校验 content-length 后重命名"""
+        part_path, meta_path = self.get_part_paths(output_path)
+        content_length = response.headers.get('content-length')
+        total_size = offset + int(content_length) if content_length else None
+        downloaded = offset
+        
+        self.save_part_meta(meta_path, {
+            'url': url,
+            'url_path': urlparse(url).path,
+            'mode': 'stream',
+            'total_size': total_size
+        })
+        
+        if not offset:
+            BufferedFileWriter.preallocate(part_path, 0)
+        
+        buffer_size = self.get_write_buffer_size()
+        writer = BufferedFileWriter(part_path, buffer_size)
+        buffer = bytearray()
+        try:
+            async for chunk in response.content.iter_any():
+                await bandwidth_limiter.consume(len(chunk), job)
+                buffer += chunk
+                if len(buffer) >= buffer_size:
+                    await writer.write_at(buffer, downloaded)
+                    downloaded += len(buffer)
+                    buffer = bytearray()
+                    if progress_callback:
+                        progress_callback(downloaded, total_size or 0)
+        finally:
+            # 已收到的数据即使出错也写入，便于下次续传
+            if buffer:
+                await writer.write_at(buffer, downloaded)
+                downloaded += len(buffer)
+            writer.close()
+        
+        if progress_callback:
+            progress_callback(downloaded, total_size or 0)
+        
+        return self.finalize_part(part_path, meta_path, output_path, total_size)
+    
+    async def download_ranges(self, urls, headers, output_path, total_size,
+                              connections, chunk_size, progress_callback=None, job=None):
+        """按字节范围切分文件，用多个连接并行下载并写入预分配 .part 文件的对应偏移
+        
+        每个分段已写入的字节数记录在 .part.json 中，重试或重新运行时
+        只请求各分段剩余的部分（Range: bytes=N-end）。
+        urls 为按速度排好序的镜像列表，当前镜像出错或整个流的速度跌破
+        VIDEO_DOWNLOAD_CONFIG['min_speed'] 时切换镜像，进行中的连接在收到下一个数据块时
+        改用新镜像并从断点继续。因速度切换最多把镜像轮一遍，之后停留在测得最快的镜像上。
+        """
+        part_path, meta_path = self.get_part_paths(output_path)
+        meta = self.load_part_meta(meta_path)
+        
+        if (self.is_same_source(meta, urls)
+                and meta.get('mode') == 'ranges'
+                and meta.get('total_size') == total_size
+                and meta.get('chunk_size') == chunk_size
+                and part_path.exists()
+                and part_path.stat().st_size == total_size):
+            progress = {int(start): written for start, written in meta.get('progress', {}).items()}
+            logger.info(f"断点续传: {output_path.name} 已完成 {sum(progress.values())}/{total_size} 字节")
+        else:
+            progress = {}
+            # 预分配文件，各连接直接写入自己负责的偏移
+            BufferedFileWriter.preallocate(part_path, total_size)
+        
+        meta = {
+            'url': urls[0],
+            'url_path': urlparse(urls[0]).path,
+            'mode': 'ranges',
+            'total_size': total_size,
+            'chunk_size': chunk_size,
+            'progress': progress
+        }
+        self.save_part_meta(meta_path, meta)
+        
+        ranges = [
+            (start, min(start + chunk_size, total_size) - 1)
+            for start in range(0, total_size, chunk_size)
+        ]
+        queue = asyncio.Queue()
+        for start, end in ranges:
+            if progress.get(start, 0) < end - start + 1:
+                queue.put_nowait((start, end))
+        
+        retry_times = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('retry_times', 1)))
+        retry_delays = config.VIDEO_DOWNLOAD_CONFIG.get('retry_delay', [3])
+        buffer_size = self.get_write_buffer_size()
+        min_speed = config.VIDEO_DOWNLOAD_CONFIG.get('min_speed', 0)
+        speed_interval = config.VIDEO_DOWNLOAD_CONFIG.get('speed_check_interval', 5)
+        mirror_state = {'index': 0}
+        expired_mirrors = set()
+        # 整个流（所有连接合计）的吞吐量窗口；速度检测只在有多个镜像可选时进行
+        speed_state = {'start': time.monotonic(), 'bytes': 0, 'throttled': False,
+                       'active': 0, 'checking': bool(min_speed) and len(urls) > 1}
+        mirror_speeds = {}      # 镜像序号 -> 被判定过慢时测得的速度
+        slow_switches = 0
+        downloaded = sum(progress.values())
+        if progress_callback and downloaded:
+            progress_callback(downloaded, total_size)
+        
+        def use_mirror(index, reason):
+            logger.warning(f"切换镜像: {urlparse(urls[mirror_state['index']]).netloc} -> "
+                           f"{urlparse(urls[index]).netloc} ({reason})")
+            mirror_state['index'] = index
+            speed_state.update(start=time.monotonic(), bytes=0, throttled=False)
+        
+        def switch_mirror(failed_index, reason):
+            """当前镜像出错时切换到下一个镜像（跳过地址已失效的镜像）"""
+            if mirror_state['index'] != failed_index:
+                return
+            for step in range(1, len(urls)):
+                index = (failed_index + step) % len(urls)
+                if index not in expired_mirrors:
+                    use_mirror(index, reason)
+                    return
+        
+        def handle_slow_mirror(slow_index, speed):
+            """当前镜像过慢时换到还没测过的镜像；都测过后停留在最快的镜像上，不再检测速度"""
+            nonlocal slow_switches
+            if mirror_state['index'] != slow_index:
+                return
+            mirror_speeds[slow_index] = speed
+            reason = f"速度过低 {speed / 1024:.0f} KB/s"
+            if slow_switches < len(urls) - 1:
+                for step in range(1, len(urls)):
+                    index = (slow_index + step) % len(urls)
+                    if index not in expired_mirrors and index not in mirror_speeds:
+                        slow_switches += 1
+                        use_mirror(index, reason)
+                        return
+            
+            speed_state['checking'] = False
+            usable = [index for index in mirror_speeds if index not in expired_mirrors]
+            best = max(usable, key=mirror_speeds.get, default=slow_index)
+            # 各镜像一样慢时瓶颈多半在本地网络，换来换去没有意义
+            if best != slow_index and mirror_speeds[best] > speed * 1.2:
+                use_mirror(best, f"{reason}，回到测得最快的镜像")
+            else:
+                logger.info(f"所有镜像速度都偏低 ({reason})，继续使用当前镜像: {output_path.name}")
+        
+        def check_speed(mirror_index, size):
+            if not speed_state['checking']:
+                return
+            speed_state['bytes'] += size
+            elapsed = time.monotonic() - speed_state['start']
+            if elapsed < speed_interval:
+                return
+            speed = speed_state['bytes'] / elapsed
+            throttled = speed_state['throttled']
+            speed_state.update(start=time.monotonic(), bytes=0, throttled=False)
+            # 限速生效的窗口不做判断；只剩部分连接在下载时按比例降低阈值
+            threshold = min_speed * min(speed_state['active'], connections) / connections
+            if not throttled and speed < threshold:
+                handle_slow_mirror(mirror_index, speed)
+        
+        async def fetch_range(writer, start, end, mirror_index):
+            nonlocal downloaded
+            offset = start + progress.get(start, 0)
+            range_headers = dict(headers, Range=f'bytes={offset}-{end}')
+            buffer = bytearray()
+            
+            async def flush():
+                # 只有写入磁盘的数据才计入进度，保证 .part.json 记录的断点可靠
+                nonlocal buffer, downloaded
+                if not buffer:
+                    return
+                data, buffer = buffer, bytearray()
+                await writer.write_at(data, start + progress.get(start, 0))
+                progress[start] = progress.get(start, 0) + len(data)
+                downloaded += len(data)
+                if progress_callback:
+                    progress_callback(downloaded, total_size)
+            
+            speed_state['active'] += 1
+            try:
+                async with self.cdn_session.get(urls[mirror_index], headers=range_headers) as response:
+                    if response.status in EXPIRED_URL_STATUSES:
+                        raise UrlExpiredError(f"Range请求被拒绝 bytes={offset}-{end} - 状态码: {response.status}")
+                    if response.status != 206:
+                        raise Exception(f"Range请求失败 bytes={offset}-{end} - 状态码: {response.status}")
+                    if self.parse_content_range(response.headers.get('Content-Range')) not in (None, total_size):
+                        raise Exception(f"文件大小与记录不一致: {response.headers.get('Content-Range')}")
+                    if self.parse_content_range_start(response.headers.get('Content-Range')) not in (None, offset):
+                        raise Exception(f"Range响应起始位置不符: 请求 {offset}，返回 {response.headers.get('Content-Range')}")
+                    
+                    async for chunk in response.content.iter_any():
+                        # 限速等待期间暂停读取，由TCP流控让服务器放慢发送
+                        if await bandwidth_limiter.consume(len(chunk), job):
+                            speed_state['throttled'] = True
+                        buffer += chunk
+                        if len(buffer) >= buffer_size:
+                            await flush()
+                        
+                        check_speed(mirror_index, len(chunk))
+                        if mirror_state['index'] != mirror_index:
+                            # 已切换镜像：交回 worker 在新镜像上从断点继续
+                            return False
+                    
+                    await flush()
+                    if progress.get(start, 0) != end - start + 1:
+                        raise Exception(f"Range数据不完整 bytes={start}-{end} - "
+                                        f"已写入 {progress.get(start, 0)} 字节")
+                    return True
+            finally:
+                # 无论成功、失败还是被取消都落盘已收到的数据和进度，下次从断点继续
+                speed_state['active'] -= 1
+                await flush()
+                self.save_part_meta(meta_path, meta)
+        
+        async def worker():
+            writer = BufferedFileWriter(part_path, buffer_size)
+            try:
+                while True:
+                    try:
+                        start, end = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    
+                    attempt = 0
+                    while True:
+                        mirror_index = mirror_state['index']
+                        try:
+                            if await fetch_range(writer, start, end, mirror_index):
+                                break
+                            # 镜像已切换，立即在新镜像上从断点继续，不计入重试次数
+                        except UrlExpiredError as e:
+                            # 所有镜像的地址都失效后交给上层重新获取播放地址
+                            expired_mirrors.add(mirror_index)
+                            if len(expired_mirrors) >= len(urls):
+                                raise
+                            switch_mirror(mirror_index, e)
+                        except Exception as e:
+                            attempt += 1
+                            if attempt >= retry_times:
+                                raise
+                            switch_mirror(mirror_index, e)
+                            delay = retry_delays[min(attempt - 1, len(retry_delays) - 1)]
+                            logger.warning(f"分段 bytes={start}-{end} 下载失败，{delay}秒后重试: {e}")
+                            await asyncio.sleep(delay)
+            finally:
+                writer.close()
+        
+        worker_count = min(connections, queue.qsize())
+        logger.debug(f"多连接下载: {output_path.name} - {total_size} 字节, "
+                     f"{queue.qsize()}/{len(ranges)} 个待下载分段, {worker_count} 个连接, "
+                     f"{len(urls)} 个镜像")
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(worker_count)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        
+        if sum(progress.values()) != total_size:
+            logger.error(f"下载不完整: {output_path.name} - {sum(progress.values())}/{total_size} 字节")
+            return False
+        
+        return self.finalize_part(part_path, meta_path, output_path, total_size)
+    
+    async def download_to_pipe(self, urls, writer, progress_callback=None, job=None, refresh_urls=None):
+        """把一个流顺序下载并写入管道（流式合并模式），不落盘
+        
+        连接中断或镜像失效时用 Range: bytes=N- 从已写入管道的位置继续，
+        地址过期时通过 refresh_urls 重新获取；无论成功与否都会关闭 writer，让合并器读到流结束
+        """
+        name = urlparse(urls[0] if isinstance(urls, list) else urls).path.rsplit('/', 1)[-1]
+        try:
+            await self.init_session()
+            await asyncio.sleep(random.uniform(1, 3))
+            
+            headers = self.build_headers({
+                'Accept': '*/*',
+                'Accept-Encoding': 'identity;q=1, *;q=0'
+            })
+            if isinstance(urls, str):
+                urls = [urls]
+            if refresh_urls and urls and all(self.is_url_expired(url) for url in urls):
+                logger.info(f"播放地址已过期，重新获取: {name}")
+                urls = await refresh_urls() or urls
+            
+            retry_times = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('retry_times', 1)))
+            retry_delays = config.VIDEO_DOWNLOAD_CONFIG.get('retry_delay', [3])
+            max_refresh = max(0, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_url_refresh', 3)))
+            refresh_count = 0
+            attempt = 0
+            offset = 0
+            total_size = None
+            mirrors = None
+            
+            while True:
+                try:
+                    if mirrors is None:
+                        mirrors = [mirror['url'] for mirror in await self.rank_mirrors(urls, headers)]
+                        if not mirrors:
+                            logger.error(f"下载失败: {name} - 所有镜像均不可用")
+                            return False
+                    url = mirrors[attempt % len(mirrors)]
+                    
+                    async with self.cdn_session.get(url, headers=dict(headers, Range=f'bytes={offset}-')) as response:
+                        if response.status in EXPIRED_URL_STATUSES:
+                            raise UrlExpiredError(f"状态码: {response.status}")
+                        if response.status == 200 and offset:
+                            # 管道中的数据无法回退，忽略 Range 的镜像不能用于续传
+                            raise Exception("镜像不支持Range，无法从断点继续")
+                        if response.status not in (200, 206):
+                            raise Exception(f"状态码: {response.status}")
+                        
+                        if response.status == 206:
+                            if self.parse_content_range_start(response.headers.get('Content-Range')) not in (None, offset):
+                                raise Exception(f"Range响应起始位置不符: 请求 {offset}，"
+                                                f"返回 {response.headers.get('Content-Range')}")
+                            size = self.parse_content_range(response.headers.get('Content-Range'))
+                        else:
+                            content_length = response.headers.get('content-length')
+                            size = int(content_length) if content_length else None
+                        if total_size and size and size != total_size:
+                            raise Exception(f"文件大小与之前不一致: {size}/{total_size}")
+                        total_size = total_size or size
+                        
+                        async for chunk in response.content.iter_any():
+                            await bandwidth_limiter.consume(len(chunk), job)
+                            writer.write(chunk)
+                            # 合并器读得慢时在这里等待，由管道和TCP流控限制内存占用
+                            await writer.drain()
+                            offset += len(chunk)
+                            if progress_callback:
+                                progress_callback(offset, total_size or 0)
+                    
+                    if total_size and offset != total_size:
+                        raise Exception(f"数据不完整: {offset}/{total_size} 字节")
+                    logger.debug(f"流式下载完成: {name} ({offset} 字节)")
+                    return True
+                except (BrokenPipeError, ConnectionResetError):
+                    # 合并器已经停止读取（通常是它先失败了），继续下载没有意义
+                    logger.error(f"合并器已停止读取，放弃下载: {name}")
+                    return False
+                except UrlExpiredError as e:
+                    if not refresh_urls or refresh_count >= max_refresh:
+                        raise
+                    refresh_count += 1
+                    logger.warning(f"播放地址失效，重新获取后从 {offset} 字节继续 ({refresh_count}/{max_refresh}): "
+                                   f"{name} - {e}")
+                    new_urls = await refresh_urls()
+                    if not new_urls:
+                        logger.error(f"重新获取播放地址失败: {name}")
+                        return False
+                    urls, mirrors = new_urls, None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    if attempt >= retry_times:
+                        raise
+                    delay = retry_delays[min(attempt - 1, len(retry_delays) - 1)]
+                    logger.warning(f"流式下载中断，{delay}秒后从 {offset} 字节继续: {name} - {e}")
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"流式下载异常: {name} - {e}")
+            return False
+        finally:
+            writer.close()
+    
+    async def download_streams(self, streams, desc="下载中", job=None, download_func=None):
+        """并行下载多个流，使用一个合并的进度条显示总进度
+        
+        streams: [(url 或镜像URL列表, output_path[, refresh_urls]), ...]，
+                 refresh_urls 为地址过期时重新获取该流地址的异步回调
+        job: 限速任务名，所有流共享该任务的速率上限
+        download_func: 单个流的下载函数，默认 download_segment；流式合并时为 download_to_pipe，
+                       此时 output_path 位置是管道的写入端
+        返回与 streams 顺序一致的成功标志列表；任意一个流失败时取消其余流
+        """
+        download_func = download_func or self.download_segment
+        downloaded_map = {}
+        total_map = {}
+        
+        with tqdm(total=0, desc=desc, unit='B', unit_scale=True,
+                  unit_divisor=1024, leave=False) as pbar:
+            
+            def make_callback(key):
+                def callback(downloaded, total_size):
+                    # 各流的总大小在收到响应头后才知道，动态累加到总进度
+                    if total_map.get(key) != total_size:
+                        total_map[key] = total_size
+                        pbar.total = sum(total_map.values())
+                        pbar.refresh()
+                    pbar.update(downloaded - downloaded_map.get(key, 0))
+                    downloaded_map[key] = downloaded
+                return callback
+            
+            tasks = [
+                asyncio.ensure_future(download_func(
+                    stream[0], stream[1], make_callback(index), job,
+                    stream[2] if len(stream) > 2 else None
+                ))
+                for index, stream in enumerate(streams)
+            ]
+            
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if any(task.result() is not True for task in done):
+                        # 有流失败时，其余流的结果已无意义，直接取消节省带宽
+                        for task in pending:
+                            task.cancel()
+                        await asyncio.gather(*pending, return_exceptions=True)
+                        break
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+        
+        return [task.done() and not task.cancelled() and task.result() is True for task in tasks]
+    
+    def find_ffmpeg_path(self):
+        """查找FFmpeg路径 - 跨平台支持"""
+        import platform
+        import shutil
+        import os
+        
+        # 1. 优先使用配置文件中的自定义路径
+        if config.FFMPEG_CONFIG.get('custom_path'):
+            custom_path = config.FFMPEG_CONFIG['custom_path']
+            if Path(custom_path).exists():
+                logger.info(f"使用自定义FFmpeg路径: {custom_path}")
+                return custom_path
+            else:
+                logger.warning(f"自定义FFmpeg路径不存在: {custom_path}")
+        
+        # 2. 检查PATH环境变量
+        system_ffmpeg = shutil.which('ffmpeg')
+        if system_ffmpeg:
+            logger.info(f"在PATH中找到FFmpeg: {system_ffmpeg}")
+            return system_ffmpeg
+        
+        # 3. 根据平台检查常见路径
+        system = platform.system().lower()
+        if system == 'windows':
+            search_paths = config.FFMPEG_CONFIG['search_paths']['windows']
+        elif system == 'linux':
+            search_paths = config.FFMPEG_CONFIG['search_paths']['linux']
+        elif system == 'darwin':  # macOS
+            search_paths = config.FFMPEG_CONFIG['search_paths']['darwin']
+        else:
+            logger.warning(f"未知系统类型: {system}，使用通用检测")
+            search_paths = ['ffmpeg', './ffmpeg', './bin/ffmpeg']
+        
+        # 4. 遍历搜索路径
+        for path in search_paths:
+            try:
+                # 转换为绝对路径进行检查
+                if os.path.isabs(path):
+                    check_path = Path(path)
+                else:
+                    # 相对路径相对于当前工作目录
+                    check_path = Path(os.getcwd()) / path
+                
+                logger.debug(f"检查路径: {check_path}")
+                
+                if check_path.exists() and check_path.is_file():
+                    absolute_path = str(check_path.resolve())
+                    logger.info(f"在搜索路径中找到FFmpeg: {absolute_path}")
+                    return absolute_path
+                    
+            except Exception as e:
+                logger.debug(f"检查路径 {path} 时出错: {e}")
+                continue
+        
+        # 5. 所有路径都未找到
+        logger.warning("未找到FFmpeg，已检查的路径:")
+        for path in search_paths:
+            try:
+                if os.path.isabs(path):
+                    check_path = Path(path)
+                else:
+                    check_path = Path(os.getcwd()) / path
+                logger.warning(f"  - {check_path} (存在: {check_path.exists()})")
+            except:
+                logger.warning(f"  - {path} (检查失败)")
+        
+        return None
+        
+    def show_ffmpeg_install_guide(self):
+        """显示FFmpeg安装指南 - 跨平台支持"""
+        import platform
+        
+        system = platform.system().lower()
+        
+        print("❌ FFmpeg未找到，无法合并视频")
+        print("📝 FFmpeg 安装指南:")
+        print()
+        
+        if system == 'windows':
+            print("👾 Windows 安装方法:")
+            print("  方法1: 包管理器安装 (推荐)")
             print("    choco install ffmpeg          # Chocolatey")
             print("    scoop install ffmpeg          # Scoop")
             print("    winget install ffmpeg         # Windows Package Manager")
@@ -320,9 +1630,142 @@ class BilibiliVideoDownloader:
         print()
         print("ℹ️  安装后请重新运行程序或运行: python check_ffmpeg.py 验证安装")
     
+    def use_python_muxer(self, output_path):
+        """是否使用内置fMP4合并器：merge_backend 为 auto/python 且输出容器为 mp4/m4a"""
+        backend = config.FFMPEG_CONFIG.get('merge_backend', 'auto')
+        return backend in ('auto', 'python') and output_path.suffix.lower() in FMP4_MUX_BRANDS
+    
+    def requires_ffmpeg(self):
+        """当前配置下合并单个分P是否必须有FFmpeg"""
+        return not self.use_python_muxer(Path('output' + self.get_output_suffix()))
+    
+    async def mux_with_python(self, input_paths, output_path):
+        """用内置fMP4合并器合并DASH音视频流，在线程池中执行，不阻塞事件循环
+        
+        返回是否成功；失败时 auto 模式由调用方改用FFmpeg
+        """
+        cancel_event = threading.Event()
+        major_brand = FMP4_MUX_BRANDS[output_path.suffix.lower()]
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.merge_semaphore:
+                stats = await loop.run_in_executor(
+                    None, fmp4_muxer.mux_fmp4_files,
+                    [str(path) for path in input_paths], str(output_path), major_brand, cancel_event
+                )
+        except asyncio.CancelledError:
+            # 通知工作线程在下一个数据块处停止，由它删除不完整的输出
+            cancel_event.set()
+            raise
+        except (fmp4_muxer.Fmp4MuxError, OSError) as e:
+            logger.warning(f"内置合并器无法处理 {output_path.name}: {e}")
+            self.remove_incomplete_output(output_path)
+            return False
+        
+        logger.info(f"内置合并器合并成功: {output_path} ({stats['fragments']} 个分片)")
+        return True
+    
+    def use_streaming_mux(self, output_path):
+        """是否边下载边合并：需要开启 streaming_mux、输出容器能用内置合并器，并且平台支持异步管道"""
+        if not config.VIDEO_DOWNLOAD_CONFIG.get('streaming_mux', False):
+            return False
+        if os.name == 'nt':
+            # Windows 的事件循环不支持把匿名管道接入 asyncio
+            logger.debug("Windows 不支持流式合并，使用临时文件")
+            return False
+        return self.use_python_muxer(output_path)
+    
+    def get_stream_mux_executor(self):
+        """流式合并器专用线程池，大小为同时下载的分P数上限（max_concurrent × max_concurrent_pages），
+        避免长时间阻塞的合并器线程占满默认线程池"""
+        if self.stream_mux_executor is None:
+            max_workers = (max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_concurrent', 1)))
+                           * max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_concurrent_pages', 2))))
+            self.stream_mux_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stream-mux')
+        return self.stream_mux_executor
+    
+    def open_mux_pipe(self):
+        """创建一个匿名管道，返回 (读取端文件对象, 写入端文件对象)；Linux 上按配置扩大管道缓冲区"""
+        read_fd, write_fd = os.pipe()
+        pipe_size = int(config.VIDEO_DOWNLOAD_CONFIG.get('stream_pipe_size', 0) or 0)
+        if pipe_size:
+            try:
+                import fcntl
+                fcntl.fcntl(write_fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), pipe_size)
+            except (ImportError, OSError) as e:
+                logger.debug(f"无法调整管道缓冲区大小: {e}")
+        return os.fdopen(read_fd, 'rb'), os.fdopen(write_fd, 'wb')
+    
+    def run_stream_muxer(self, readers, output_path, cancel_event):
+        """在工作线程中从管道读取各个流并合并；结束后关闭读取端，让仍在写入的下载立即失败
+        
+        readers: [(管道读取端, 名称), ...]
+        """
+        try:
+            major_brand = FMP4_MUX_BRANDS[output_path.suffix.lower()]
+            return fmp4_muxer.mux_fmp4_files(readers, str(output_path), major_brand, cancel_event)
+        finally:
+            for reader, _ in readers:
+                reader.close()
+    
+    async def stream_mux(self, streams, output_path, desc, job=None):
+        """流式合并：音视频流从网络直接经管道送入内置合并器，只写一次最终文件，不产生临时 .m4s
+        
+        streams 与 download_streams 相同（写入目标被替换为管道）；返回是否成功
+        """
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        readers = []
+        pipe_streams = []
+        mux_future = None
+        try:
+            for stream in streams:
+                reader, write_file = self.open_mux_pipe()
+                readers.append((reader, stream[1].name))
+                transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, write_file)
+                writer = asyncio.StreamWriter(transport, protocol, None, loop)
+                pipe_streams.append((stream[0], writer) + tuple(stream[2:]))
+            
+            # 合并器线程大部分时间阻塞在管道读取上，并发数随下载并发而定，
+            # 不占用 merge_semaphore，以免长时间的网络下载挡住其他视频的FFmpeg合并
+            mux_future = loop.run_in_executor(self.get_stream_mux_executor(), self.run_stream_muxer,
+                                              readers, output_path, cancel_event)
+            results = await self.download_streams(pipe_streams, desc=desc, job=job,
+                                                  download_func=self.download_to_pipe)
+            if not all(results):
+                cancel_event.set()
+            try:
+                stats = await mux_future
+            except (fmp4_muxer.Fmp4MuxError, fmp4_muxer.MuxCancelled, OSError) as e:
+                logger.error(f"流式合并失败: {output_path.name} - {e}")
+                if all(results):
+                    print(f"❌ 流式合并失败: {e}")
+                return False
+            
+            if not all(results):
+                return False
+            logger.info(f"流式合并成功: {output_path} ({stats['fragments']} 个分片, {stats['bytes']} 字节)")
+            return True
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+        finally:
+            for _, writer, *_ in pipe_streams:
+                writer.close()
+            if mux_future is None:
+                for reader, _ in readers:
+                    reader.close()
+    
     async def merge_video_audio(self, video_path, audio_path, output_path):
-        """合并视频和音频 - 使用配置中的FFmpeg路径"""
+        """合并视频和音频 - 优先使用内置fMP4合并器，不可用时使用配置中的FFmpeg路径"""
         try:
+            if self.use_python_muxer(output_path):
+                if await self.mux_with_python([video_path, audio_path], output_path):
+                    return True
+                if config.FFMPEG_CONFIG.get('merge_backend') == 'python':
+                    print(f"❌ 内置合并器合并失败: {output_path.name}")
+                    return False
+            
             # 检查FFmpeg是否启用
             if not config.FFMPEG_CONFIG.get('enabled', True):
                 logger.error("FFmpeg功能已禁用")
@@ -335,160 +1778,1283 @@ class BilibiliVideoDownloader:
                 self.show_ffmpeg_install_guide()
                 return False
             
-            # 构建FFmpeg命令
-            cmd = [
-                ffmpeg_path, '-y',
-                '-i', str(video_path),
-                '-i', str(audio_path),
-                '-c:v', config.FFMPEG_CONFIG.get('video_codec', 'copy'),
-                '-c:a', config.FFMPEG_CONFIG.get('audio_codec', 'aac'),
-                '-preset', config.FFMPEG_CONFIG.get('quality_preset', 'fast')
-            ]
-            
-            # 添加额外参数
-            extra_args = config.FFMPEG_CONFIG.get('extra_args', [])
-            if extra_args:
-                cmd.extend(extra_args)
-            
-            cmd.append(str(output_path))
-            
-            logger.debug(f"FFmpeg命令: {' '.join(cmd)}")
-            
-            # 执行FFmpeg - 修复字符编码问题
+            # 以异步子进程执行FFmpeg，不阻塞事件循环；进程池满时排队等待
             timeout = config.FFMPEG_CONFIG.get('timeout', 300)
-            # 在Windows上明确指定编码为utf-8，避免GBK编码错误
-            result = subprocess.run(cmd, 
-                                   capture_output=True, 
-                                   text=True, 
-                                   timeout=timeout,
-                                   encoding='utf-8',
-                                   errors='ignore')  # 忽略无法解码的字符
-            
-            if result.returncode == 0:
+            async with self.merge_semaphore:
+                # 探测输入编码，输出容器能直接容纳时流复制，避免重新编码
+                video_codec = await self.probe_codec(video_path, 'v')
+                audio_codec = await self.probe_codec(audio_path, 'a')
+                codec_args = self.build_codec_args(video_codec, audio_codec, output_path.suffix.lstrip('.'))
+                
+                # 构建FFmpeg命令
+                cmd = [
+                    ffmpeg_path, '-y',
+                    '-i', str(video_path),
+                    '-i', str(audio_path),
+                    '-map', '0:v:0',
+                    '-map', '1:a:0'
+                ] + codec_args
+                
+                # 添加额外参数
+                extra_args = config.FFMPEG_CONFIG.get('extra_args', [])
+                if extra_args:
+                    cmd.extend(extra_args)
+                
+                cmd.append(str(output_path))
+                
+                logger.debug(f"FFmpeg命令: {' '.join(cmd)}")
+                returncode, stderr = await self.run_ffmpeg(cmd, timeout)
+            
+            if returncode == 0:
                 logger.info(f"合并成功: {output_path}")
                 return True
             else:
-                logger.error(f"FFmpeg合并失败 (返回码: {result.returncode}): {result.stderr}")
-                print(f"❌ FFmpeg错误: {result.stderr[:200]}...")
+                logger.error(f"FFmpeg合并失败 (返回码: {returncode}): {stderr}")
+                print(f"❌ FFmpeg错误: {stderr[:200]}...")
+                self.remove_incomplete_output(output_path)
                 return False
                 
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             logger.error("FFmpeg合并超时")
             print("❌ FFmpeg合并超时，可能文件过大")
+            self.remove_incomplete_output(output_path)
             return False
+        except asyncio.CancelledError:
+            self.remove_incomplete_output(output_path)
+            raise
         except Exception as e:
             logger.error(f"合并视频异常: {e}")
             print(f"❌ 合并异常: {e}")
+            self.remove_incomplete_output(output_path)
+            return False
+    
+    async def remux_audio(self, audio_path, output_path):
+        """把下载的音频流封装到 audio_format 容器（默认m4a），编码兼容时不重新编码"""
+        try:
+            if self.use_python_muxer(output_path):
+                if await self.mux_with_python([audio_path], output_path):
+                    return True
+                if config.FFMPEG_CONFIG.get('merge_backend') == 'python':
+                    print(f"❌ 内置合并器封装失败: {output_path.name}")
+                    return False
+            
+            if not config.FFMPEG_CONFIG.get('enabled', True):
+                logger.error("FFmpeg功能已禁用")
+                print("❌ FFmpeg功能已在配置中禁用")
+                return False
+            
+            ffmpeg_path = self.find_ffmpeg_path()
+            if not ffmpeg_path:
+                self.show_ffmpeg_install_guide()
+                return False
+            
+            timeout = config.FFMPEG_CONFIG.get('timeout', 300)
+            async with self.merge_semaphore:
+                audio_codec = await self.probe_codec(audio_path, 'a')
+                container = output_path.suffix.lstrip('.')
+                copy_codecs = config.FFMPEG_CONFIG.get('copy_codecs', {}).get(container, {}).get('audio', [])
+                if audio_codec is None or audio_codec in copy_codecs:
+                    codec_args = ['-c:a', 'copy']
+                else:
+                    # 容器放不下该编码（例如把杜比音轨放进不支持的容器），只能转码
+                    audio_encoder = config.FFMPEG_CONFIG.get('audio_codec', 'aac')
+                    if audio_encoder == 'copy':
+                        audio_encoder = 'aac'
+                    logger.info(f"音频编码 {audio_codec} 无法直接放入 {container}，转码为 {audio_encoder}")
+                    codec_args = ['-c:a', audio_encoder]
+                
+                cmd = [
+                    ffmpeg_path, '-y',
+                    '-i', str(audio_path),
+                    '-map', '0:a:0',
+                    '-vn'
+                ] + codec_args + config.FFMPEG_CONFIG.get('extra_args', []) + [str(output_path)]
+                
+                logger.debug(f"FFmpeg命令: {' '.join(cmd)}")
+                returncode, stderr = await self.run_ffmpeg(cmd, timeout)
+            
+            if returncode == 0:
+                logger.info(f"音频封装成功: {output_path}")
+                return True
+            logger.error(f"FFmpeg音频封装失败 (返回码: {returncode}): {stderr}")
+            print(f"❌ FFmpeg错误: {stderr[:200]}...")
+            self.remove_incomplete_output(output_path)
+            return False
+        except asyncio.TimeoutError:
+            logger.error("FFmpeg音频封装超时")
+            self.remove_incomplete_output(output_path)
+            return False
+        except asyncio.CancelledError:
+            self.remove_incomplete_output(output_path)
+            raise
+        except Exception as e:
+            logger.error(f"音频封装异常: {e}")
+            print(f"❌ 封装异常: {e}")
+            self.remove_incomplete_output(output_path)
+            return False
+    
+    def find_ffprobe_path(self):
+        """查找ffprobe路径 - 优先使用配置，其次查找PATH，最后与FFmpeg同目录
+        
+        与FFmpeg是否存在无关（内置封装器不需要FFmpeg，但仍可用ffprobe校验）；结果只查找一次
+        """
+        if self.ffprobe_resolved:
+            return self.ffprobe_path
+        
+        ffprobe_path = None
+        custom_path = config.FFMPEG_CONFIG.get('ffprobe_path')
+        if custom_path:
+            if Path(custom_path).exists():
+                ffprobe_path = custom_path
+            else:
+                logger.warning(f"自定义ffprobe路径不存在: {custom_path}")
+        
+        if not ffprobe_path:
+            ffprobe_path = shutil.which('ffprobe')
+        
+        if not ffprobe_path:
+            ffmpeg_path = self.find_ffmpeg_path()
+            if ffmpeg_path:
+                ffmpeg_file = Path(ffmpeg_path)
+                sibling = ffmpeg_file.with_name(ffmpeg_file.name.replace('ffmpeg', 'ffprobe'))
+                if sibling != ffmpeg_file and sibling.exists():
+                    ffprobe_path = str(sibling)
+        
+        if ffprobe_path:
+            logger.info(f"使用ffprobe: {ffprobe_path}")
+        else:
+            logger.warning("未找到ffprobe，跳过输入编码探测和完整性校验")
+        self.ffprobe_path = ffprobe_path
+        self.ffprobe_resolved = True
+        return ffprobe_path
+    
+    async def probe_codec(self, media_path, stream_type):
+        """使用ffprobe获取文件中第一个视频('v')或音频('a')流的编码名称，失败时返回 None"""
+        ffprobe_path = self.find_ffprobe_path()
+        if not ffprobe_path:
+            logger.debug("未找到ffprobe，无法探测输入编码")
+            return None
+        
+        cmd = [
+            ffprobe_path, '-v', 'error',
+            '-select_streams', f'{stream_type}:0',
+            '-show_entries', 'stream=codec_name',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            str(media_path)
+        ]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), timeout=30)
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"ffprobe探测失败: {media_path} - {e}")
+            return None
+        
+        codec = stdout.decode('utf-8', errors='ignore').strip().splitlines()
+        if process.returncode != 0 or not codec:
+            return None
+        logger.debug(f"探测到编码: {Path(media_path).name} -> {codec[0]}")
+        return codec[0].strip().lower()
+    
+    def build_codec_args(self, video_codec, audio_codec, container):
+        """根据输入编码和输出容器生成FFmpeg编码参数
+        
+        两个轨道都能直接放入输出容器时使用 -c copy；否则只对不兼容的轨道重新编码。
+        未能探测到编码时沿用配置中的编码器。
+        """
+        copy_codecs = config.FFMPEG_CONFIG.get('copy_codecs', {}).get(container, {})
+        stream_copy = config.FFMPEG_CONFIG.get('stream_copy', True)
+        
+        def can_copy(codec, kind):
+            return stream_copy and codec is not None and codec in copy_codecs.get(kind, [])
+        
+        video_copy = can_copy(video_codec, 'video')
+        audio_copy = can_copy(audio_codec, 'audio')
+        
+        if video_copy and audio_copy:
+            logger.debug(f"编码兼容 ({video_codec}/{audio_codec})，使用流复制")
+            return ['-c', 'copy']
+        
+        video_encoder = 'copy' if video_copy else config.FFMPEG_CONFIG.get('video_codec', 'copy')
+        if video_codec is not None and not video_copy and video_encoder == 'copy':
+            video_encoder = 'libx264'  # 探测到容器不支持的编码，不能再直接复制
+        audio_encoder = 'copy' if audio_copy else config.FFMPEG_CONFIG.get('audio_codec', 'aac')
+        if audio_codec is not None and not audio_copy and audio_encoder == 'copy':
+            audio_encoder = 'aac'
+        
+        logger.info(f"输入编码 {video_codec}/{audio_codec} 需要转码: -c:v {video_encoder} -c:a {audio_encoder}")
+        args = ['-c:v', video_encoder, '-c:a', audio_encoder]
+        if video_encoder != 'copy':
+            args += ['-preset', config.FFMPEG_CONFIG.get('quality_preset', 'fast')]
+        return args
+    
+    async def run_ffmpeg(self, cmd, timeout):
+        """以异步子进程运行FFmpeg，返回 (返回码, stderr文本)
+        
+        超时或任务被取消时终止FFmpeg子进程并等待其退出，避免残留进程
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except BaseException:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            raise
+        
+        # 明确使用utf-8解码，避免Windows上的GBK编码错误
+        return process.returncode, stderr.decode('utf-8', errors='ignore')
+    
+    def remove_incomplete_output(self, output_path):
+        """删除合并失败留下的不完整输出，避免下次运行被当作已完成而跳过"""
+        try:
+            if output_path.exists():
+                output_path.unlink()
+        except OSError:
+            pass
+    
+    def sanitize_filename(self, filename):
+        """清理文件名"""
+        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+        filename = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', filename)
+        if len(filename) > 100:
+            filename = filename[:100]
+        return filename.strip()
+    
+    async def download_video(self, bvid, title=None, on_streams_ready=None):
+        """下载单个视频（包含多P视频的所有分P）
+        
+        on_streams_ready: 可选回调，所有分P的音视频流下载完成、即将进入合并阶段时调用，
+        调度器据此在当前视频合并期间开始下一个视频的下载
+        """
+        try:
+            print(f"\n📺 开始下载视频: {bvid}")
+            
+            # 已下载的视频直接跳过，不做任何延迟和请求
+            existing = self.find_completed_video(bvid)
+            if existing:
+                print(f"✅ 已下载，跳过: {', '.join(path.name for path in existing)}")
+                if on_streams_ready:
+                    on_streams_ready()
+                return True
+            
+            # 首先检查FFmpeg是否可用（内置合并器能处理输出容器时不强制要求）
+            if self.requires_ffmpeg() and not self.find_ffmpeg_path():
+                self.show_ffmpeg_install_guide()
+                return False
+            
+            # 获取视频信息（所有分P共用这一次的 view 接口结果）
+            video_info = await self.get_video_info(bvid)
+            if not video_info:
+                print(f"⚠️ 无法获取视频信息: {bvid}")
+                return False
+            
+            video_title = title or video_info.get('title', bvid)
+            safe_title = self.sanitize_filename(video_title)
+            pages = video_info.get('pages') or []
+            if not pages:
+                print(f"⚠️ 视频没有可下载的分P: {bvid}")
+                return False
+            
+            # 分P数已知后再按文件名检查一次（没有缓存视频信息时上面的检查会跳过文件名匹配）
+            existing = self.find_completed_video(bvid, pages)
+            if existing:
+                print(f"✅ 已下载，跳过: {', '.join(path.name for path in existing)}")
+                if on_streams_ready:
+                    on_streams_ready()
+                return True
+            
+            print(f"🎥 视频标题: {video_title}")
+            
+            # 单P视频保持原有的文件命名
+            if len(pages) == 1:
+                cid = pages[0]['cid']
+                print(f"🆔 CID: {cid}")
+                output_file = self.output_dir / f"{bvid}_{safe_title}{self.get_output_suffix()}"
+                success = await self.download_page(
+                    bvid, cid, bvid, output_file, on_streams_ready,
+                    expected_duration=video_info.get('duration') or pages[0].get('duration')
+                )
+                if success:
+                    self.completed_index.mark_video(self.get_index_key(bvid), [output_file])
+                return success
+            
+            return await self.download_pages(bvid, safe_title, pages, on_streams_ready,
+                                             total_duration=video_info.get('duration'))
+                
+        except Exception as e:
+            logger.error(f"下载视频异常: {e}")
+            print(f"❌ 下载异常: {bvid} - {e}")
+            return False
+        finally:
+            bandwidth_limiter.release_job(bvid)
+    
+    def get_output_suffix(self):
+        """输出文件扩展名：视频为 format（mp4），纯音频模式为 audio_format（m4a）"""
+        if config.VIDEO_DOWNLOAD_CONFIG.get('audio_only', False):
+            return '.' + config.VIDEO_DOWNLOAD_CONFIG.get('audio_format', 'm4a')
+        return '.' + config.VIDEO_DOWNLOAD_CONFIG.get('format', 'mp4')
+    
+    def get_index_key(self, bvid):
+        """下载索引的键：纯音频和完整视频分别记录，互不影响"""
+        return f"{bvid}@audio" if config.VIDEO_DOWNLOAD_CONFIG.get('audio_only', False) else bvid
+    
+    def find_completed_video(self, bvid, pages=None):
+        """查找已完成的视频，返回输出文件列表或 None（只访问本地文件，不请求网络）
+        
+        先查下载索引；索引中没有时按文件名识别，不依赖标题，因此视频改名后仍能识别：
+        单P视频匹配 {bvid}_*.mp4（纯音频模式为 .m4a），多P视频要求每个分P都有 {bvid}_P{n}_* 文件。
+        旧版本只下载P1并保存为 {bvid}_标题.mp4，因此分P数未知时（未传入 pages 且没有缓存的
+        视频信息）不按文件名判断，由调用方获取视频信息后再检查
+        """
+        index_key = self.get_index_key(bvid)
+        existing = self.completed_index.get_video(index_key)
+        if existing:
+            return existing
+        
+        if pages is None and self.api_cache:
+            pages = (self.api_cache.get('view', bvid) or {}).get('pages')
+        if not pages:
+            return None
+        
+        if len(pages) > 1:
+            if config.VIDEO_DOWNLOAD_CONFIG.get('concat_pages', False):
+                return None
+            page_files = []
+            for index, page in enumerate(pages):
+                page_file = self.find_completed_page(bvid, page['cid'], page.get('page', index + 1))
+                if not page_file:
+                    return None
+                page_files.append(page_file)
+            self.completed_index.mark_video(index_key, page_files)
+            return page_files
+        
+        page_pattern = re.compile(rf'^{re.escape(bvid)}_P\d+_')
+        matches = [
+            path for path in self.output_dir.glob(f"{bvid}_*{self.get_output_suffix()}")
+            if not page_pattern.match(path.name)
+        ]
+        if matches:
+            self.completed_index.mark_video(index_key, matches[:1])
+            return matches[:1]
+        return None
+    
+    def find_completed_page(self, bvid, cid, page_no):
+        """查找多P视频中已完成的分P文件（索引或 {bvid}_P{n}_*.mp4）"""
+        index_key = self.get_index_key(bvid)
+        existing = self.completed_index.get_page(index_key, cid)
+        if existing:
+            return existing
+        
+        matches = list(self.output_dir.glob(f"{bvid}_P{page_no}_*{self.get_output_suffix()}"))
+        if matches:
+            self.completed_index.mark_page(index_key, cid, matches[0])
+            return matches[0]
+        return None
+    
+    async def download_pages(self, bvid, safe_title, pages, on_streams_ready=None, total_duration=None):
+        """并发下载多P视频的所有分P，可选用FFmpeg concat合并为一个文件
+        
+        total_duration: 整个视频的时长（秒），用于校验拼接后的文件
+        """
+        concat = config.VIDEO_DOWNLOAD_CONFIG.get('concat_pages', False)
+        max_pages = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_concurrent_pages', 2)))
+        suffix = self.get_output_suffix()
+        concat_output = self.output_dir / f"{bvid}_{safe_title}{suffix}"
+        
+        print(f"📑 共 {len(pages)} 个分P，并发数: {max_pages}{'，完成后拼接为单个文件' if concat else ''}")
+        
+        if concat and concat_output.exists():
+            print(f"✅ 文件已存在，跳过: {concat_output.name}")
+            self.completed_index.mark_video(self.get_index_key(bvid), [concat_output])
+            return True
+        
+        page_slots = asyncio.Semaphore(max_pages)
+        streams_pending = len(pages)
+        
+        def page_streams_ready():
+            nonlocal streams_pending
+            streams_pending -= 1
+            if streams_pending == 0 and on_streams_ready:
+                on_streams_ready()
+        
+        # 拼接模式下各分P只是中间文件，放在临时目录
+        target_dir = self.temp_dir if concat else self.output_dir
+        page_files = []
+        for index, page in enumerate(pages):
+            page_no = page.get('page', index + 1)
+            # 已完成的分P（按cid或文件名前缀识别）沿用原文件，标题变化也不会重新下载
+            existing = None if concat else self.find_completed_page(bvid, page['cid'], page_no)
+            safe_part = self.sanitize_filename(page.get('part') or safe_title)
+            page_files.append((page_no, existing or target_dir / f"{bvid}_P{page_no}_{safe_part}{suffix}"))
+        
+        async def run_page(page, page_no, output_file):
+            async with page_slots:
+                return await self.download_page(
+                    bvid, page['cid'], f"{bvid}_p{page_no}", output_file,
+                    page_streams_ready, label=f"{bvid} P{page_no}",
+                    expected_duration=page.get('duration')
+                )
+        
+        page_tasks = [
+            asyncio.ensure_future(run_page(page, page_no, output_file))
+            for page, (page_no, output_file) in zip(pages, page_files)
+        ]
+        try:
+            results = await asyncio.gather(*page_tasks, return_exceptions=True)
+        finally:
+            for task in page_tasks:
+                if not task.done():
+                    task.cancel()
+        
+        failed_pages = []
+        for (page_no, _), result in zip(page_files, results):
+            if result is not True:
+                if isinstance(result, BaseException):
+                    logger.error(f"下载分P异常: {bvid} P{page_no} - {result}")
+                failed_pages.append(page_no)
+        
+        if failed_pages:
+            print(f"❌ {bvid} 有 {len(failed_pages)} 个分P下载失败: {failed_pages}")
+            return False
+        
+        if concat:
+            part_files = [output_file for _, output_file in page_files]
+            print(f"🔗 拼接 {len(part_files)} 个分P...")
+            if not await self.concat_videos(part_files, concat_output):
+                print(f"❌ 分P拼接失败: {bvid}")
+                return False
+            if not await self.verify_and_quarantine(concat_output, total_duration):
+                return False
+            for part_file in part_files:
+                try:
+                    part_file.unlink()
+                except OSError:
+                    pass
+            print(f"✅ 拼接完成: {concat_output.name}")
+            self.completed_index.mark_video(self.get_index_key(bvid), [concat_output])
+        else:
+            self.completed_index.mark_video(self.get_index_key(bvid), [output_file for _, output_file in page_files])
+        
+        print(f"✅ {bvid} 全部 {len(pages)} 个分P下载完成")
+        return True
+    
+    async def download_page(self, bvid, cid, temp_prefix, output_file, on_streams_ready=None, label=None,
+                            expected_duration=None):
+        """下载一个分P的音视频流并合并为 output_file
+        
+        expected_duration: 该分P的时长（秒），合并后用于完整性校验
+        """
+        label = label or bvid
+        
+        if output_file.exists():
+            print(f"✅ 文件已存在，跳过: {output_file.name}")
+            if on_streams_ready:
+                on_streams_ready()
+            return True
+        
+        # 获取播放URL
+        play_data = await self.get_play_url(bvid, cid)
+        if not play_data:
+            print(f"⚠️ 无法获取播放URL: {label}")
+            return False
+        
+        dash = play_data.get('dash')
+        if not dash:
+            print(f"⚠️ 不支持DASH格式: {label}")
+            return False
+        
+        # 纯音频模式只下载音频流，并把杜比全景声和Hi-Res无损音轨也列入候选
+        audio_only = config.VIDEO_DOWNLOAD_CONFIG.get('audio_only', False)
+        video_streams = dash.get('video') or []
+        audio_streams = self.collect_audio_streams(dash) if audio_only else dash.get('audio') or []
+        
+        if not audio_streams:
+            print(f"⚠️ 缺少音频流: {label}")
+            return False
+        if not audio_only and not video_streams:
+            print(f"⚠️ 缺少视频或音频流: {label}")
+            return False
+        
+        # 按配置的质量档位和编码偏好选择流
+        audio_stream = self.select_audio_stream(audio_streams)
+        video_stream = None if audio_only else self.select_video_stream(video_streams)
+        
+        if video_stream:
+            print(f"🎥 {label} 视频质量: {video_stream.get('height', 'Unknown')}p "
+                  f"({self.get_stream_codec(video_stream) or 'Unknown'})")
+        print(f"🎵 {label} 音频码率: {audio_stream.get('bandwidth', 'Unknown')} "
+              f"({audio_stream.get('codecs', 'Unknown')})")
+        
+        # 准备文件名
+        video_temp = self.temp_dir / f"{temp_prefix}_video.m4s"
+        audio_temp = self.temp_dir / f"{temp_prefix}_audio.m4s"
+        
+        # 播放地址过期时重新获取同一个流（相同的流id和编码）的地址，两个流共用一次请求
+        refresh_lock = asyncio.Lock()
+        refreshed = {'data': None, 'at': 0}
+        
+        def make_url_refresher(kind, stream):
+            async def refresh_urls():
+                async with refresh_lock:
+                    if not refreshed['data'] or time.monotonic() - refreshed['at'] > 30:
+                        refreshed['data'] = await self.get_play_url(bvid, cid, refresh=True)
+                        refreshed['at'] = time.monotonic()
+                dash = (refreshed['data'] or {}).get('dash') or {}
+                candidates = (dash.get('video') or []) if kind == 'video' else self.collect_audio_streams(dash)
+                for candidate in candidates:
+                    if (candidate.get('id') == stream.get('id')
+                            and (kind != 'video' or self.get_stream_codec(candidate) == self.get_stream_codec(stream))):
+                        return self.get_stream_urls(candidate)
+                logger.error(f"重新获取的播放地址中找不到原来的流: {label} {kind} id={stream.get('id')}")
+                return None
+            return refresh_urls
+        
+        # 主地址 + 备用镜像，下载前测速选择最快的镜像
+        streams = [(self.get_stream_urls(audio_stream), audio_temp, make_url_refresher('audio', audio_stream))]
+        if video_stream:
+            # 并行下载视频流和音频流（两者来自不同的CDN地址，互不依赖）
+            streams.insert(0, (self.get_stream_urls(video_stream), video_temp,
+                               make_url_refresher('video', video_stream)))
+            print(f"📥 并行下载视频流和音频流...")
+        else:
+            print(f"📥 下载音频流...")
+        desc = f"{label} {'音视频' if video_stream else '音频'}"
+        
+        streaming = self.use_streaming_mux(output_file)
+        
+        # 按 bandwidth * 时长 预留磁盘空间（拿到 content-length 后修正），空间不足时在这里排队
+        ticket = None
+        if self.disk_budget:
+            duration = expected_duration or dash.get('duration') or 0
+            margin = config.DISK_BUDGET_CONFIG.get('estimate_margin', 1.1)
+            estimates = {path: self.estimate_stream_size(stream, duration, margin)
+                         for stream, path in ((video_stream, video_temp), (audio_stream, audio_temp)) if stream}
+            # 临时流文件占用临时目录所在磁盘，合并输出占用输出目录所在磁盘；流式合并不写临时文件
+            ticket = await self.disk_budget.acquire(str(output_file), estimates, output_file, temp=not streaming)
+        
+        try:
+            if streaming:
+                # 边下载边合并，数据只写一次最终文件
+                print(f"🔧 流式合并到 {output_file.name}...")
+                merge_success = await self.stream_mux(streams, output_file, desc, job=bvid)
+                if on_streams_ready:
+                    on_streams_ready()
+            else:
+                results = await self.download_streams(streams, desc=desc, job=bvid)
+            
+                for (_, path, _), success in zip(streams, results):
+                    if not success:
+                        print(f"❌ {'视频' if path == video_temp else '音频'}下载失败: {label}")
+                        return False
+            
+                if on_streams_ready:
+                    on_streams_ready()
+            
+                # 合并前核对分段文件的字节数，避免截断的 .m4s 合并出看似正常的文件
+                if not self.check_segment_sizes([path for _, path, _ in streams]):
+                    print(f"❌ 分段文件大小校验失败: {label}")
+                    return False
+            
+                if video_stream:
+                    # 两个流都完成后立即合并
+                    print(f"🔧 合并视频和音频...")
+                    merge_success = await self.merge_video_audio(video_temp, audio_temp, output_file)
+                else:
+                    print(f"🔧 封装音频...")
+                    merge_success = await self.remux_audio(audio_temp, output_file)
+            if merge_success:
+                merge_success = await self.verify_and_quarantine(output_file, expected_duration)
+            
+            # 清理临时文件
+            try:
+                if video_temp.exists():
+                    video_temp.unlink()
+                if audio_temp.exists():
+                    audio_temp.unlink()
+            except:
+                pass
+        finally:
+            if ticket:
+                await self.disk_budget.release(ticket)
+        
+        if merge_success:
+            print(f"✅ 下载完成: {output_file.name}")
+            if output_file.parent != self.temp_dir:
+                self.completed_index.mark_page(self.get_index_key(bvid), cid, output_file)
+            return True
+        else:
+            print(f"❌ 合并失败: {label}")
             return False
     
-    def sanitize_filename(self, filename):
-        """清理文件名"""
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        filename = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', filename)
-        if len(filename) > 100:
-            filename = filename[:100]
-        return filename.strip()
+    def estimate_stream_size(self, stream, duration, margin=1.0):
+        """按DASH流的 bandwidth（比特/秒）和时长估算文件大小（字节）"""
+        bandwidth = stream.get('bandwidth') or 0
+        return int(bandwidth * duration / 8 * margin)
+    
+    def check_segment_sizes(self, paths):
+        """核对分段文件的实际大小与下载时 content-length 给出的字节数"""
+        for path in paths:
+            expected_size = self.segment_sizes.pop(str(path), None)
+            if expected_size is None:
+                logger.debug(f"没有记录 content-length，跳过大小核对: {path.name}")
+                continue
+            actual_size = path.stat().st_size if path.exists() else 0
+            if actual_size != expected_size:
+                logger.error(f"分段文件大小不符: {path.name} - {actual_size}/{expected_size} 字节")
+                return False
+        return True
+    
+    async def probe_media(self, ffprobe_path, media_path):
+        """用ffprobe读取文件的容器时长和各流信息，失败时返回 None"""
+        cmd = [
+            ffprobe_path, '-v', 'error',
+            '-show_entries', 'format=duration:stream=codec_type,duration',
+            '-of', 'json',
+            str(media_path)
+        ]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(), timeout=config.VERIFY_CONFIG.get('timeout', 60)
+                )
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"ffprobe执行失败: {media_path} - {e}")
+            return None
+        
+        if process.returncode != 0:
+            logger.debug(f"ffprobe无法解析: {media_path} - {stderr.decode('utf-8', errors='ignore').strip()}")
+            return None
+        try:
+            return json.loads(stdout.decode('utf-8', errors='ignore'))
+        except ValueError:
+            return None
+    
+    async def verify_output(self, output_path, expected_duration=None):
+        """校验合并后的文件：能被ffprobe解析、同时包含视频流和音频流（纯音频文件只要求音频流）、时长与预期一致
+        
+        返回 (是否通过, 原因)；找不到ffprobe时不做校验直接通过
+        """
+        ffprobe_path = self.find_ffprobe_path()
+        if not ffprobe_path:
+            return True, "未校验"
+        
+        async with self.verify_semaphore:
+            info = await self.probe_media(ffprobe_path, output_path)
+        if not info:
+            return False, "ffprobe无法解析文件"
+        
+        streams = info.get('streams', [])
+        stream_types = {stream.get('codec_type') for stream in streams}
+        required_types = {'audio'} if output_path.suffix.lower() in AUDIO_ONLY_SUFFIXES else {'video', 'audio'}
+        if not required_types <= stream_types:
+            return False, f"缺少音视频流: {sorted(t for t in stream_types if t)}"
+        
+        try:
+            duration = float(info.get('format', {}).get('duration'))
+        except (TypeError, ValueError):
+            return False, "无法读取文件时长"
+        
+        tolerance = config.VERIFY_CONFIG.get('duration_tolerance', 2.0)
+        if expected_duration and abs(duration - expected_duration) > tolerance:
+            return False, f"时长不符: {duration:.1f}s / 预期 {expected_duration}s"
+        
+        # 检查音视频流时长是否一致，截断的流会明显偏短（批量校验时没有预期时长，只能依靠这一项）
+        stream_durations = []
+        for stream in streams:
+            try:
+                stream_durations.append(float(stream.get('duration')))
+            except (TypeError, ValueError):
+                pass
+        if len(stream_durations) >= 2 and max(stream_durations) - min(stream_durations) > tolerance:
+            return False, (f"音视频流时长不一致: "
+                           f"{min(stream_durations):.1f}s / {max(stream_durations):.1f}s")
+        
+        return True, f"{duration:.1f}s"
+    
+    def quarantine_output(self, output_path, reason):
+        """将校验失败的文件移入隔离目录，下次运行时会重新下载"""
+        quarantine_dir = Path(config.VERIFY_CONFIG.get('quarantine_dir', 'quarantine_videos'))
+        quarantine_dir.mkdir(exist_ok=True)
+        target = quarantine_dir / f"{output_path.stem}.{time.strftime('%Y%m%d%H%M%S')}{output_path.suffix}"
+        try:
+            os.replace(output_path, target)
+        except OSError:
+            # 跨磁盘等无法移动时直接删除，保证不会被当作已完成而跳过
+            self.remove_incomplete_output(output_path)
+            target = None
+        logger.error(f"文件校验失败已隔离: {output_path.name} - {reason}")
+        print(f"🚫 校验失败: {output_path.name} - {reason}" + (f"，已移至 {target}" if target else "，已删除"))
+    
+    async def verify_and_quarantine(self, output_path, expected_duration=None):
+        """合并完成后的校验阶段，未通过时隔离输出文件并返回 False"""
+        if not config.VERIFY_CONFIG.get('enabled', True):
+            return True
+        ok, reason = await self.verify_output(output_path, expected_duration)
+        if not ok:
+            self.quarantine_output(output_path, reason)
+        else:
+            logger.debug(f"校验通过: {output_path.name} ({reason})")
+        return ok
+    
+    async def verify_directory(self, directory, quarantine=False):
+        """并行校验目录（含各用户子目录）中已有的视频文件（--verify 批量模式）
+        
+        返回 (通过的文件列表, [(失败的文件, 原因), ...])
+        """
+        directory = Path(directory)
+        files = sorted(
+            path for path in directory.rglob('*')
+            if path.is_file() and path.suffix.lower() in config.VERIFY_CONFIG.get('extensions', ['.mp4'])
+        ) if directory.is_dir() else []
+        
+        passed, failed = [], []
+        if not files:
+            print(f"⚠️ 目录中没有需要校验的文件: {directory}")
+            return passed, failed
+        
+        async def verify_file(path):
+            ok, reason = await self.verify_output(path)
+            return path, ok, reason
+        
+        tasks = [asyncio.ensure_future(verify_file(path)) for path in files]
+        try:
+            with tqdm(total=len(tasks), desc="校验文件", unit="个") as pbar:
+                for future in asyncio.as_completed(tasks):
+                    path, ok, reason = await future
+                    pbar.update(1)
+                    if ok:
+                        passed.append(path)
+                    else:
+                        failed.append((path, reason))
+                        if quarantine:
+                            self.quarantine_output(path, reason)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        return passed, failed
+    
+    def get_stream_codec(self, stream):
+        """识别DASH视频流的编码：'avc' / 'hevc' / 'av1'，无法识别时返回 None"""
+        codecid = stream.get('codecid')
+        if codecid in VIDEO_CODEC_IDS:
+            return VIDEO_CODEC_IDS[codecid]
+        
+        codecs = (stream.get('codecs') or '').lower()
+        for prefix, codec in VIDEO_CODEC_PREFIXES.items():
+            if codecs.startswith(prefix):
+                return codec
+        return None
+    
+    def select_video_stream(self, video_streams):
+        """按质量档位选择视频流
+        
+        VIDEO_DOWNLOAD_CONFIG['quality'] 对应 quality_profiles 中的分辨率上限，
+        在不超过上限的最高分辨率中，按 codec_preference 选择编码，
+        同编码下选择码率最小的流
+        """
+        quality = config.VIDEO_DOWNLOAD_CONFIG.get('quality', 'high')
+        max_height = config.VIDEO_DOWNLOAD_CONFIG.get('quality_profiles', {}).get(quality)
+        preference = config.VIDEO_DOWNLOAD_CONFIG.get('codec_preference', ['avc', 'hevc', 'av1'])
+        
+        candidates = [
+            stream for stream in video_streams
+            if not max_height or stream.get('height', 0) <= max_height
+        ]
+        if not candidates:
+            # 所有流都超过上限时退而选择最低分辨率
+            lowest = min(stream.get('height', 0) for stream in video_streams)
+            candidates = [stream for stream in video_streams if stream.get('height', 0) == lowest]
+        
+        target_height = max(stream.get('height', 0) for stream in candidates)
+        
+        def sort_key(stream):
+            codec = self.get_stream_codec(stream)
+            rank = preference.index(codec) if codec in preference else len(preference)
+            return rank, stream.get('bandwidth', 0)
+        
+        return min(
+            (stream for stream in candidates if stream.get('height', 0) == target_height),
+            key=sort_key
+        )
+    
+    def select_audio_stream(self, audio_streams):
+        """按质量档位选择音频流：不超过码率上限的最高码率，全部超过时选最低码率"""
+        quality = config.VIDEO_DOWNLOAD_CONFIG.get('quality', 'high')
+        max_bandwidth = config.VIDEO_DOWNLOAD_CONFIG.get('audio_bandwidth_caps', {}).get(quality)
+        
+        candidates = [
+            stream for stream in audio_streams
+            if not max_bandwidth or stream.get('bandwidth', 0) <= max_bandwidth
+        ]
+        if not candidates:
+            return min(audio_streams, key=lambda x: x.get('bandwidth', 0))
+        return max(candidates, key=lambda x: x.get('bandwidth', 0))
+    
+    def collect_audio_streams(self, dash):
+        """汇总DASH中的所有音频流：普通音频 + 杜比全景声（dash.dolby.audio）+ Hi-Res无损（dash.flac.audio）"""
+        audio_streams = list(dash.get('audio') or [])
+        audio_streams.extend((dash.get('dolby') or {}).get('audio') or [])
+        flac_audio = (dash.get('flac') or {}).get('audio')
+        if flac_audio:
+            audio_streams.append(flac_audio)
+        return audio_streams
+    
+    def get_stream_urls(self, stream):
+        """获取DASH流的所有候选地址：baseUrl 在前，backupUrl 镜像在后"""
+        urls = [stream.get('baseUrl') or stream.get('base_url')]
+        urls.extend(stream.get('backupUrl') or stream.get('backup_url') or [])
+        return [url for url in urls if url]
+    
+    async def concat_videos(self, input_files, output_path):
+        """使用FFmpeg concat分离器无损拼接多个视频文件"""
+        ffmpeg_path = self.find_ffmpeg_path()
+        if not ffmpeg_path:
+            self.show_ffmpeg_install_guide()
+            return False
+        
+        list_file = output_path.with_name(output_path.name + '.concat.txt')
+        try:
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for input_file in input_files:
+                    # concat列表中单引号需要转义
+                    escaped = str(Path(input_file).resolve()).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            
+            cmd = [
+                ffmpeg_path, '-y',
+                '-f', 'concat', '-safe', '0',
+                '-i', str(list_file),
+                '-c', 'copy',
+                str(output_path)
+            ]
+            logger.debug(f"FFmpeg拼接命令: {' '.join(cmd)}")
+            
+            timeout = config.FFMPEG_CONFIG.get('timeout', 300)
+            async with self.merge_semaphore:
+                returncode, stderr = await self.run_ffmpeg(cmd, timeout)
+            
+            if returncode != 0:
+                logger.error(f"FFmpeg拼接失败 (返回码: {returncode}): {stderr}")
+                self.remove_incomplete_output(output_path)
+                return False
+            return True
+        except asyncio.CancelledError:
+            self.remove_incomplete_output(output_path)
+            raise
+        except Exception as e:
+            logger.error(f"拼接视频异常: {e}")
+            self.remove_incomplete_output(output_path)
+            return False
+        finally:
+            try:
+                list_file.unlink()
+            except OSError:
+                pass
+
+
+# 页面内的视频卡片解析函数：按 TITLE_SELECTORS / IMAGE_SELECTORS 在卡片及其所在的父级卡片中
+# 查找视频链接、标题和封面，返回 {href, title, pic}；批量提取和增量观察脚本共用
+CARD_EXTRACTOR_JS = """
+    const makeCardExtractor = (titleSelectors, imageSelectors) => {
+        const CARD_SCOPE = '.bili-video-card, .bili-cover-card, .small-item, .video-item, .list-item';
+        const LINK = 'a[href*="/video/"]';
+        const IMAGE_ATTRS = ['src', 'data-src', 'data-original', 'lazy-src', 'data-lazy-src', 'srcset'];
+        
+        const findLink = (element, card) => {
+            if (element.matches(LINK)) return element;
+            if (card) return card.querySelector(LINK);
+            // 不在已知卡片结构中时，在自身、父元素和最多3层祖先中查找视频链接
+            let current = element;
+            for (let depth = 0; current && depth < 4; depth++) {
+                const link = current.querySelector(LINK);
+                if (link) return link;
+                current = current.parentElement;
+            }
+            return null;
+        };
+        
+        const findTitle = (scopes, link) => {
+            for (const scope of scopes) {
+                for (const selector of titleSelectors) {
+                    const node = scope.querySelector(selector);
+                    const text = node && ((node.getAttribute('title') || node.textContent || '').trim());
+                    if (text) return text;
+                }
+            }
+            return link ? (link.getAttribute('title') || link.textContent || '').trim() : '';
+        };
+        
+        const imageUrl = (node) => {
+            for (const attr of IMAGE_ATTRS) {
+                const value = node.getAttribute(attr);
+                if (value) return attr === 'srcset' ? value.split(',')[0].trim().split(' ')[0] : value;
+            }
+            const match = (node.getAttribute('style') || '').match(/background-image:\\s*url\\(["']?([^"')]+)/);
+            return match ? match[1] : '';
+        };
+        
+        const findImage = (scopes) => {
+            for (const scope of scopes) {
+                for (const selector of imageSelectors.concat(['picture source'])) {
+                    for (const node of scope.querySelectorAll(selector)) {
+                        const url = imageUrl(node);
+                        if (url) return url;
+                    }
+                }
+            }
+            return '';
+        };
+        
+        return (element) => {
+            // 只在元素所属的卡片内查找，避免从列表容器里取到相邻卡片的标题和封面
+            const card = element.closest(CARD_SCOPE);
+            const link = findLink(element, card);
+            const scopes = [element];
+            if (card && card !== element) scopes.push(card);
+            if (!card && element.parentElement) scopes.push(element.parentElement);
+            return {
+                href: link ? link.getAttribute('href') : '',
+                title: findTitle(scopes, link),
+                pic: findImage(scopes)
+            };
+        };
+    };
+"""
+
+# 一次性提取当前页面所有视频卡片：按 VIDEO_SELECTORS 中第一个有匹配的选择器找卡片
+BATCH_EXTRACT_SCRIPT = """
+({videoSelectors, titleSelectors, imageSelectors}) => {
+""" + CARD_EXTRACTOR_JS + """
+    const extract = makeCardExtractor(titleSelectors, imageSelectors);
+    for (const selector of videoSelectors) {
+        const elements = Array.from(document.querySelectorAll(selector));
+        if (elements.length) {
+            return {selector, records: elements.map(extract)};
+        }
+    }
+    return {selector: null, records: []};
+}
+"""
+
+# 安装 MutationObserver：记录新加入页面或被原地更新（链接、封面、标题变化）的卡片节点，
+# window.__biliCardObserver.take(超时毫秒) 只返回上次调用之后新出现的BV号，以及补全了封面的已有BV号；
+# 没有新增时最多等待到超时。按BV号去重而不是按节点去重，SPA复用卡片节点翻页时也能取到新页面的视频
+CARD_OBSERVER_SCRIPT = """
+({videoSelectors, titleSelectors, imageSelectors, maxRetries}) => {
+    if (window.__biliCardObserver) return window.__biliCardObserver.selector;
+""" + CARD_EXTRACTOR_JS + """
+    const extract = makeCardExtractor(titleSelectors, imageSelectors);
+    const WATCHED_ATTRS = ['href', 'src', 'data-src', 'data-original', 'lazy-src', 'data-lazy-src', 'srcset', 'style', 'title'];
+    const state = {
+        selector: null, pending: new Set(), retry: new Map(), emitted: new Map(), waiters: [], total: 0
+    };
+    
+    const enqueue = (node) => {
+        if (!state.retry.has(node)) state.pending.add(node);
+    };
+    
+    const scan = (root) => {
+        if (!state.selector) {
+            // 卡片还没渲染出来时，等到第一个选择器出现匹配再确定
+            state.selector = videoSelectors.find((selector) => document.querySelector(selector)) || null;
+            if (!state.selector) return;
+            root = document;
+        }
+        if (root !== document) {
+            // 新节点本身是卡片、位于卡片内部（卡片内容被替换），或者包含卡片
+            const card = root.closest(state.selector);
+            if (card) enqueue(card);
+        }
+        root.querySelectorAll(state.selector).forEach(enqueue);
+    };
+    
+    const observer = new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            if (mutation.type === 'childList') {
+                for (const node of mutation.addedNodes) {
+                    if (node.nodeType === Node.ELEMENT_NODE) scan(node);
+                    else if (node.parentElement) scan(node.parentElement);
+                }
+            } else if (state.selector) {
+                // 属性或文本变化：原地更新的卡片重新解析
+                const target = mutation.target.nodeType === Node.ELEMENT_NODE ? mutation.target : mutation.target.parentElement;
+                const card = target && target.closest(state.selector);
+                if (card) enqueue(card);
+            }
+        }
+        if (state.pending.size) state.waiters.splice(0).forEach((wake) => wake());
+    });
+    
+    scan(document);
+    observer.observe(document.body || document.documentElement, {
+        childList: true, subtree: true, characterData: true, attributes: true, attributeFilter: WATCHED_ATTRS
+    });
+    
+    state.take = (timeoutMs) => new Promise((resolve) => {
+        const finish = () => {
+            const nodes = new Set(state.retry.keys());
+            state.pending.forEach((node) => nodes.add(node));
+            state.pending.clear();
+            const records = [];
+            for (const node of nodes) {
+                if (!node.isConnected) {
+                    state.retry.delete(node);
+                    continue;
+                }
+                const record = extract(node);
+                const match = (record.href || '').match(/BV[A-Za-z0-9]+/);
+                const attempts = (state.retry.get(node) || 0) + 1;
+                // 刚插入或刚更新的卡片可能还没填好链接或封面，留到下次再解析
+                if ((!match || !record.pic) && attempts <= maxRetries) {
+                    state.retry.set(node, attempts);
+                    continue;
+                }
+                state.retry.delete(node);
+                if (!match) continue;
+                // 同一个BV号只在第一次出现或封面从无到有时交回
+                const bvid = match[0];
+                if (state.emitted.has(bvid) && (state.emitted.get(bvid) || !record.pic)) continue;
+                if (!state.emitted.has(bvid)) state.total += 1;
+                state.emitted.set(bvid, record.pic);
+                records.push(record);
+            }
+            const doc = document.documentElement;
+            resolve({
+                selector: state.selector,
+                records,
+                total: state.total,
+                atBottom: (window.pageYOffset || doc.scrollTop) + window.innerHeight >= doc.scrollHeight - 1000
+            });
+        };
+        if (state.pending.size || !timeoutMs) return finish();
+        const wake = () => {
+            clearTimeout(timer);
+            finish();
+        };
+        const timer = setTimeout(() => {
+            state.waiters = state.waiters.filter((waiter) => waiter !== wake);
+            finish();
+        }, timeoutMs);
+        state.waiters.push(wake);
+    });
+    
+    window.__biliCardObserver = state;
+    return state.selector;
+}
+"""
+
+
+def normalize_image_url(pic_url):
+    """规范化封面URL：补全协议和域名、统一使用https、去掉缩略图参数以获取原图
+    
+    页面卡片和投稿列表接口拿到的封面地址都经过这里处理，保证两条路径得到相同的URL
+    """
+    if not pic_url:
+        return ''
+    
+    logger.debug(f"处理图片URL: {pic_url}")
+    
+    # 处理相对路径和明文http地址
+    if pic_url.startswith('//'):
+        pic_url = 'https:' + pic_url
+    elif pic_url.startswith('/'):
+        pic_url = 'https://i0.hdslb.com' + pic_url
+    elif pic_url.startswith('http://'):
+        pic_url = 'https://' + pic_url[len('http://'):]
+    
+    # 移除URL参数，保留原图获取最高质量
+    if '@' in pic_url:
+        base_url = pic_url.split('@')[0]
+        logger.debug(f"移除URL参数，从 {pic_url} 变为 {base_url}")
+        pic_url = base_url
+    
+    # 处理缩略图参数，尝试获取高清版本
+    if '_' in pic_url and any(size in pic_url for size in ['_160x120', '_320x200', '_480x300']):
+        # 移除小尺寸后缀，获取原图
+        pic_url = re.sub(r'_\d+x\d+\.(jpg|jpeg|png|webp)', r'.\1', pic_url)
+        logger.debug(f"移除尺寸后缀，获取高清版本: {pic_url}")
+    
+    # 确保是有效的图片URL
+    if not any(pic_url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
+        # 如果没有扩展名，添加默认扩展名
+        if '?' not in pic_url and '#' not in pic_url:
+            pic_url += '.jpg'
+            logger.debug(f"添加默认扩展名: {pic_url}")
+    
+    logger.debug(f"最终处理后的图片URL: {pic_url}")
+    return pic_url
+
+
+class ArcSearchCapture:
+    """拦截用户投稿列表接口（arc/search）的响应，按页码保存解析后的 vlist
+    
+    空间页面自己会用带WBI签名的请求获取投稿列表，直接读取这些响应即可拿到
+    真实的发布时间、时长和播放量，不需要滚动页面再逐个解析视频卡片
+    """
+    
+    def __init__(self, url_patterns):
+        self.url_patterns = url_patterns
+        self.pages = {}             # 页码 -> [视频信息, ...]
+        self.page_size = None
+        self.total_count = None
+        self.responses = 0
+        self._updated = asyncio.Event()
     
-    async def download_video(self, bvid, title=None):
-        """下载单个视频"""
+    def matches(self, url):
+        return any(pattern in url for pattern in self.url_patterns)
+    
+    async def on_response(self, response):
+        """page.on('response') 回调：只处理投稿列表接口，其余响应直接忽略"""
+        if not self.matches(response.url):
+            return
         try:
-            print(f"\n📺 开始下载视频: {bvid}")
-            
-            # 首先检查FFmpeg是否可用
-            ffmpeg_path = self.find_ffmpeg_path()
-            if not ffmpeg_path:
-                self.show_ffmpeg_install_guide()
-                return False
-            
-            # 获取视频信息
-            video_info = await self.get_video_info(bvid)
-            if not video_info:
-                print(f"⚠️ 无法获取视频信息: {bvid}")
-                return False
-            
-            video_title = title or video_info.get('title', bvid)
-            cid = video_info['pages'][0]['cid']  # 取第一个P
-            
-            print(f"🎥 视频标题: {video_title}")
-            print(f"🆔 CID: {cid}")
-            
-            # 获取播放URL
-            play_data = await self.get_play_url(bvid, cid)
-            if not play_data:
-                print(f"⚠️ 无法获取播放URL: {bvid}")
-                return False
-            
-            # 选择最高质量的视频和音频
-            dash = play_data.get('dash')
-            if not dash:
-                print(f"⚠️ 不支持DASH格式: {bvid}")
-                return False
-            
-            video_streams = dash.get('video', [])
-            audio_streams = dash.get('audio', [])
-            
-            if not video_streams or not audio_streams:
-                print(f"⚠️ 缺少视频或音频流: {bvid}")
-                return False
-            
-            # 选择最高质量
-            video_stream = max(video_streams, key=lambda x: x.get('height', 0))
-            audio_stream = max(audio_streams, key=lambda x: x.get('bandwidth', 0))
-            
-            video_url = video_stream['baseUrl']
-            audio_url = audio_stream['baseUrl']
-            
-            print(f"🎥 视频质量: {video_stream.get('height', 'Unknown')}p")
-            print(f"🎵 音频码率: {audio_stream.get('bandwidth', 'Unknown')}")
-            
-            # 准备文件名
-            safe_title = self.sanitize_filename(video_title)
-            video_temp = self.temp_dir / f"{bvid}_video.m4s"
-            audio_temp = self.temp_dir / f"{bvid}_audio.m4s"
-            output_file = self.output_dir / f"{bvid}_{safe_title}.mp4"
-            
-            if output_file.exists():
-                print(f"✅ 文件已存在，跳过: {output_file.name}")
-                return True
-            
-            # 下载视频和音频
-            print(f"📥 下载视频流...")
-            video_success = await self.download_segment(video_url, video_temp)
-            
-            if video_success:
-                print(f"📥 下载音频流...")
-                audio_success = await self.download_segment(audio_url, audio_temp)
-                
-                if audio_success:
-                    print(f"🔧 合并视频和音频...")
-                    merge_success = await self.merge_video_audio(video_temp, audio_temp, output_file)
-                    
-                    # 清理临时文件
-                    try:
-                        if video_temp.exists():
-                            video_temp.unlink()
-                        if audio_temp.exists():
-                            audio_temp.unlink()
-                    except:
-                        pass
-                    
-                    if merge_success:
-                        print(f"✅ 下载完成: {output_file.name}")
-                        return True
-                    else:
-                        print(f"❌ 合并失败: {bvid}")
-                        return False
-                else:
-                    print(f"❌ 音频下载失败: {bvid}")
-                    return False
-            else:
-                print(f"❌ 视频下载失败: {bvid}")
-                return False
-                
+            data = await response.json()
         except Exception as e:
-            logger.error(f"下载视频异常: {e}")
-            print(f"❌ 下载异常: {bvid} - {e}")
+            logger.debug(f"投稿列表接口响应无法解析: {response.url} - {e}")
+            return
+        
+        if data.get('code') != 0:
+            logger.warning(f"投稿列表接口返回错误: {data.get('code')} {data.get('message')}")
+            return
+        
+        payload = data.get('data') or {}
+        page = payload.get('page') or {}
+        page_no = page.get('pn')
+        if not page_no:
+            page_no = int((parse_qs(urlparse(response.url).query).get('pn') or ['1'])[0])
+        
+        vlist = (payload.get('list') or {}).get('vlist') or []
+        self.pages[int(page_no)] = [self.parse_vlist_item(item) for item in vlist if item.get('bvid')]
+        self.page_size = page.get('ps') or self.page_size
+        self.total_count = page.get('count', self.total_count)
+        self.responses += 1
+        logger.debug(f"拦截到投稿列表第 {page_no} 页: {len(vlist)} 个视频（共 {self.total_count} 个）")
+        self._updated.set()
+    
+    def parse_vlist_item(self, item):
+        return {
+            'bvid': item['bvid'],
+            'title': (item.get('title') or f"{item['bvid']}的视频").strip(),
+            'pic': normalize_image_url(item.get('pic') or ''),
+            'created': item.get('created') or int(time.time()),
+            'duration': self.parse_length(item.get('length')),
+            'play': item.get('play') if isinstance(item.get('play'), int) else None
+        }
+    
+    @staticmethod
+    def parse_length(length):
+        """把 "mm:ss" 或 "hh:mm:ss" 形式的时长转换为秒数"""
+        try:
+            seconds = 0
+            for part in str(length).split(':'):
+                seconds = seconds * 60 + int(part)
+            return seconds
+        except (TypeError, ValueError):
+            return None
+    
+    @property
+    def total_pages(self):
+        if not self.page_size or self.total_count is None:
+            return None
+        return max(1, -(-self.total_count // self.page_size))
+    
+    async def wait_for_page(self, page_no, timeout):
+        """等待指定页码的响应，超时返回 None"""
+        deadline = time.monotonic() + timeout
+        while page_no not in self.pages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._updated.clear()
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+        return self.pages[page_no]
+
+
+class ListingRequestFilter:
+    """浏览器上下文的请求过滤器：获取视频列表期间中止列表用不到的资源请求
+    
+    只在获取视频列表期间注册到 context.route，结束后立即注销，
+    其余请求不经过回调，浏览器缓存也不受影响（注册路由期间 Playwright 会禁用HTTP缓存）。
+    列表只需要DOM和接口JSON，缩略图、头像、字体、预览视频和统计上报都可以跳过；
+    页面导航（包括用 page.goto 下载封面）和投稿列表接口始终放行。
+    被中止请求的字节数无法得知，按资源类型的估算大小累计节省的流量
+    """
+    
+    def __init__(self, policy, allow_patterns=()):
+        self.block_types = set(policy.get('block_resource_types') or ())
+        self.block_patterns = list(policy.get('block_url_patterns') or ())
+        self.allow_patterns = list(allow_patterns)
+        self.estimated_sizes = policy.get('estimated_bytes') or {}
+        self.allowed = 0
+        self.blocked = {}           # 资源类型 -> 中止次数
+        self.saved_bytes = 0
+    
+    def should_block(self, request):
+        url = request.url
+        if request.is_navigation_request() or any(pattern in url for pattern in self.allow_patterns):
             return False
+        return request.resource_type in self.block_types or any(pattern in url for pattern in self.block_patterns)
+    
+    async def handle(self, route):
+        """context.route 回调"""
+        request = route.request
+        if self.should_block(request):
+            resource_type = request.resource_type
+            self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+            self.saved_bytes += self.estimated_sizes.get(resource_type, self.estimated_sizes.get('other', 0))
+            await route.abort('blockedbyclient')
+            return
+        self.allowed += 1
+        await route.continue_()
+    
+    def snapshot(self):
+        return {
+            'allowed': self.allowed,
+            'blocked': sum(self.blocked.values()),
+            'blocked_by_type': dict(self.blocked),
+            'saved_bytes': self.saved_bytes
+        }
+    
+    def summary(self):
+        stats = self.snapshot()
+        by_type = '，'.join(f"{name} {count}" for name, count in sorted(stats['blocked_by_type'].items()))
+        return (f"请求过滤: 中止 {stats['blocked']} 个请求（{by_type or '无'}），放行 {stats['allowed']} 个，"
+                f"估计节省 {stats['saved_bytes'] / 1024 / 1024:.1f} MB")
 
 
 class PlaywrightBilibiliCrawler:
@@ -504,6 +3070,7 @@ class PlaywrightBilibiliCrawler:
         self.last_error_time = 0
         self.is_first_request = True
         self.video_downloader = None  # 视频下载器
+        self.request_filter = None    # 获取视频列表期间的请求过滤器
         
     async def init_video_downloader(self):
         """初始化视频下载器"""
@@ -561,15 +3128,13 @@ class PlaywrightBilibiliCrawler:
             'Upgrade-Insecure-Requests': '1'
         })
         
+        # 设置超时和反检测脚本（作用于上下文中的所有页面，包括并行分页的标签页）
+        self.context.set_default_timeout(config.PLAYWRIGHT_CONFIG['timeout'])
+        await self.add_stealth_scripts()
+        
         # 创建页面
         self.page = await self.context.new_page()
         
-        # 设置超时
-        self.page.set_default_timeout(config.PLAYWRIGHT_CONFIG['timeout'])
-        
-        # 添加反检测脚本
-        await self.add_stealth_scripts()
-        
         print("✅ 浏览器初始化完成")
         
         # 预热延迟
@@ -579,19 +3144,38 @@ class PlaywrightBilibiliCrawler:
                 await asyncio.sleep(1)
                 pbar.update(1)
     
+    async def install_request_filter(self):
+        """获取视频列表前在当前浏览器上下文上注册请求过滤器"""
+        policy = config.PLAYWRIGHT_CONFIG.get('request_filter') or {}
+        if not policy.get('enabled', False):
+            return
+        self.request_filter = ListingRequestFilter(policy, config.API_LISTING_CONFIG.get('url_patterns', ()))
+        await self.context.route('**/*', self.request_filter.handle)
+    
+    async def remove_request_filter(self):
+        """获取视频列表结束后注销请求过滤器并打印统计"""
+        request_filter, self.request_filter = self.request_filter, None
+        if request_filter is None:
+            return
+        try:
+            await self.context.unroute('**/*', request_filter.handle)
+        except Exception as e:
+            logger.debug(f"注销请求过滤器失败: {e}")
+        print(f"🚫 {request_filter.summary()}")
+    
     async def add_stealth_scripts(self):
-        """添加反检测脚本"""
+        """在浏览器上下文上添加反检测脚本，之后创建的每个页面都会先执行"""
         logger.debug("添加反检测脚本...")
         
         # 隐藏webdriver属性
-        await self.page.add_init_script("""
+        await self.context.add_init_script("""
         Object.defineProperty(navigator, 'webdriver', {
             get: () => undefined,
         });
         """)
         
         # 模拟真实用户的chrome属性
-        await self.page.add_init_script("""
+        await self.context.add_init_script("""
         window.chrome = {
             runtime: {},
             loadTimes: function() {},
@@ -601,14 +3185,14 @@ class PlaywrightBilibiliCrawler:
         """)
         
         # 模拟真实的插件信息
-        await self.page.add_init_script("""
+        await self.context.add_init_script("""
         Object.defineProperty(navigator, 'plugins', {
             get: () => [1, 2, 3, 4, 5],
         });
         """)
         
         # 模拟真实的语言设置
-        await self.page.add_init_script("""
+        await self.context.add_init_script("""
         Object.defineProperty(navigator, 'languages', {
             get: () => ['zh-CN', 'zh', 'en'],
         });
@@ -830,10 +3414,15 @@ class PlaywrightBilibiliCrawler:
             extra_headers['DNT'] = '1'
         
         await self.context.set_extra_http_headers(extra_headers)
+        # 获取视频列表期间重建上下文时，在新上下文上重新注册请求过滤器（计数保留）
+        if self.request_filter:
+            await self.context.route('**/*', self.request_filter.handle)
+        
+        self.context.set_default_timeout(config.PLAYWRIGHT_CONFIG['timeout'])
+        await self.add_stealth_scripts()
         
         # 创建新页面
         self.page = await self.context.new_page()
-        self.page.set_default_timeout(config.PLAYWRIGHT_CONFIG['timeout'])
     
     async def handle_request_error(self, error, attempt):
         """处理请求错误"""
@@ -949,8 +3538,12 @@ class PlaywrightBilibiliCrawler:
                     print(f"获取用户信息时发生错误: {e}")
                     return None
     
-    async def scroll_and_collect_videos(self):
-        """滚动页面并收集所有视频信息，支持分页点击"""
+    async def scroll_and_collect_videos(self, video_url=None):
+        """滚动页面并收集所有视频信息，支持分页
+        
+        传入 video_url 且第1页能读到总页数时，其余页面用 ?pn= 直接在多个标签页并行打开；
+        否则逐页点击"下一页"
+        """
         videos = []
         collected_bvids = set()  # 用于去重
         current_page = 1
@@ -984,6 +3577,24 @@ class PlaywrightBilibiliCrawler:
                     logger.info(f"智能停止：已收集到期望数量 {len(videos)}/{expected_count}")
                     break
             
+            # 已知总页数时直接按页码并行打开剩余页面，不再逐页点击
+            if current_page == 1 and video_url and config.PAGINATION_CONFIG.get('direct_navigation', True):
+                pagination_info = await self.get_pagination_info()
+                total_pages = (pagination_info or {}).get('total_pages', 1)
+                if total_pages > 1:
+                    max_pages = config.PAGINATION_CONFIG.get('max_pages', 50)
+                    if total_pages > max_pages:
+                        print(f"⚠️ 共 {total_pages} 页，超过 max_pages 限制，只获取前 {max_pages} 页")
+                        total_pages = max_pages
+                    page_results = await self.collect_pages_in_tabs(video_url, range(2, total_pages + 1))
+                    for page_no in sorted(page_results):
+                        for video in page_results[page_no]:
+                            if video['bvid'] not in collected_bvids:
+                                videos.append(video)
+                                collected_bvids.add(video['bvid'])
+                    current_page = total_pages
+                    break
+            
             # 检查是否有下一页
             has_next_page = await self.check_and_click_next_page()
             if not has_next_page:
@@ -1010,8 +3621,12 @@ class PlaywrightBilibiliCrawler:
         
         return videos
     
-    async def collect_videos_from_current_page(self):
-        """从当前页面滚动收集视频"""
+    async def collect_videos_from_current_page(self, page=None):
+        """从当前页面滚动收集视频，page 为空时使用主标签页"""
+        page = page or self.page
+        if config.BATCH_DOM_EXTRACTION and config.CARD_OBSERVER_CONFIG.get('enabled', True):
+            return await self.collect_videos_with_observer(page)
+        
         page_videos = []
         collected_bvids = set()
         scroll_count = 0
@@ -1021,20 +3636,12 @@ class PlaywrightBilibiliCrawler:
         
         while scroll_count < config.MAX_SCROLL_ATTEMPTS:
             try:
-                # 获取当前页面的视频封面元素（使用配置中的选择器）
-                video_elements = []
-                for selector in config.VIDEO_SELECTORS:
-                    elements = await self.page.query_selector_all(selector)
-                    if elements:
-                        video_elements = elements
-                        logger.debug(f"使用选择器 '{selector}' 找到 {len(elements)} 个元素")
-                        break
-                    else:
-                        logger.debug(f"选择器 '{selector}' 未找到元素")
+                # 获取当前页面的视频信息（使用配置中的选择器）
+                extracted = await self.extract_current_page_videos(page)
                 
-                if not video_elements:
+                if extracted is None:
                     print(f"⚠️ 未找到视频元素，尝试继续滚动...")
-                    await self.page.evaluate(f"window.scrollBy(0, {config.SCROLL_STEP})")
+                    await page.evaluate(f"window.scrollBy(0, {config.SCROLL_STEP})")
                     await asyncio.sleep(2)
                     scroll_count += 1
                     continue
@@ -1042,16 +3649,10 @@ class PlaywrightBilibiliCrawler:
                 # 记录当前视频数量
                 current_videos_count = len(page_videos)
                 
-                # 提取视频信息
-                for element in video_elements:
-                    try:
-                        video_info = await self.extract_video_info(element)
-                        if video_info and video_info['bvid'] not in collected_bvids:
-                            page_videos.append(video_info)
-                            collected_bvids.add(video_info['bvid'])
-                    except Exception as e:
-                        # 忽略单个视频的解析错误
-                        continue
+                for video_info in extracted:
+                    if video_info['bvid'] not in collected_bvids:
+                        page_videos.append(video_info)
+                        collected_bvids.add(video_info['bvid'])
                 
                 new_videos_count = len(page_videos) - current_videos_count
                 
@@ -1068,7 +3669,7 @@ class PlaywrightBilibiliCrawler:
                         print(f"📺 本次滚动获取到 {new_videos_count} 个新视频，当前页总计 {len(page_videos)} 个")
                 
                 # 检查是否已到达页面底部
-                is_at_bottom = await self.page.evaluate("""
+                is_at_bottom = await page.evaluate("""
                     () => {
                         const scrollTop = window.pageYOffset || document.documentElement.scrollTop;
                         const windowHeight = window.innerHeight;
@@ -1083,7 +3684,7 @@ class PlaywrightBilibiliCrawler:
                 
                 # 模拟真实用户滚动行为
                 scroll_distance = random.randint(600, 1200)  # 随机滚动距离
-                await self.page.evaluate(f"window.scrollBy(0, {scroll_distance})")
+                await page.evaluate(f"window.scrollBy(0, {scroll_distance})")
                 scroll_count += 1
                 
                 # 随机等待时间，模拟真实用户
@@ -1097,6 +3698,126 @@ class PlaywrightBilibiliCrawler:
         print(f"✅ 当前页滚动完成，收集到 {len(page_videos)} 个视频")
         return page_videos
     
+    async def collect_videos_with_observer(self, page=None):
+        """滚动当前页面，由页面内的 MutationObserver 增量交回新出现的卡片
+        
+        每次滚动后只解析新增或被原地更新的卡片，按BV号去重，封面后来才加载出来的会补上；
+        滚动后在 idle_timeout 内没有新增卡片（到达底部时一次，否则连续 idle_rounds 次）即停止。
+        结束时若没有取到视频或仍有视频缺少封面，再用批量提取补一次
+        """
+        page = page or self.page
+        page_videos = []
+        videos_by_bvid = {}
+        
+        def add_video(video_info):
+            """加入新视频或补全已有视频的封面，返回是否为新视频"""
+            existing = videos_by_bvid.get(video_info['bvid'])
+            if existing is None:
+                videos_by_bvid[video_info['bvid']] = video_info
+                page_videos.append(video_info)
+                return True
+            if not existing['pic'] and video_info['pic']:
+                existing['pic'] = video_info['pic']
+            return False
+        
+        idle_rounds = 0
+        max_idle_rounds = max(1, int(config.CARD_OBSERVER_CONFIG.get('idle_rounds', 2)))
+        idle_timeout_ms = int(config.CARD_OBSERVER_CONFIG.get('idle_timeout', 3.0) * 1000)
+        observer_args = {
+            'videoSelectors': config.VIDEO_SELECTORS,
+            'titleSelectors': config.TITLE_SELECTORS,
+            'imageSelectors': config.IMAGE_SELECTORS,
+            'maxRetries': config.CARD_OBSERVER_CONFIG.get('max_retries', 2)
+        }
+        
+        print(f"🔄 开始滚动收集当前页视频（增量模式）...")
+        
+        for scroll_count in range(config.MAX_SCROLL_ATTEMPTS + 1):
+            try:
+                # 第一次立即取回已渲染的卡片，之后每次滚动后等待新卡片出现
+                timeout_ms = idle_timeout_ms if scroll_count else 0
+                delta = await page.evaluate(
+                    "(timeout) => window.__biliCardObserver ? window.__biliCardObserver.take(timeout) : null",
+                    timeout_ms
+                )
+                if delta is None:
+                    # 首次调用或页面刷新后观察器不存在，安装后立即取回现有卡片
+                    await page.evaluate(CARD_OBSERVER_SCRIPT, observer_args)
+                    delta = await page.evaluate("() => window.__biliCardObserver.take(0)")
+                
+                new_videos_count = 0
+                for record in delta.get('records') or []:
+                    video_info = self.video_from_card_record(record)
+                    if video_info and add_video(video_info):
+                        new_videos_count += 1
+                
+                if new_videos_count:
+                    idle_rounds = 0
+                    print(f"📺 本次滚动获取到 {new_videos_count} 个新视频，当前页总计 {len(page_videos)} 个")
+                elif scroll_count:
+                    idle_rounds += 1
+                    if delta.get('atBottom') or idle_rounds >= max_idle_rounds:
+                        print(f"🏁 滚动后没有新的视频卡片出现，当前页滚动完成")
+                        break
+                
+                if not delta.get('selector'):
+                    logger.debug("页面上还没有匹配 VIDEO_SELECTORS 的元素")
+                
+                # 模拟真实用户滚动行为；等待新卡片的时间由观察器的超时控制
+                scroll_distance = random.randint(600, 1200)
+                await page.evaluate(f"window.scrollBy(0, {scroll_distance})")
+                await asyncio.sleep(random.uniform(0.3, 0.8))
+                
+            except Exception as e:
+                print(f"⚠️ 滚动过程中发生错误: {e}")
+                break
+        
+        if not page_videos or any(not video['pic'] for video in page_videos):
+            try:
+                extracted = await self.extract_videos_batch(page) or []
+            except Exception as e:
+                logger.debug(f"批量提取补充失败: {e}")
+                extracted = []
+            added = sum(1 for video_info in extracted if add_video(video_info))
+            if added:
+                print(f"📺 批量提取补充了 {added} 个视频")
+        
+        print(f"✅ 当前页滚动完成，收集到 {len(page_videos)} 个视频")
+        return page_videos
+    
+    async def extract_current_page_videos(self, page=None):
+        """提取当前页面上的所有视频卡片，没有匹配的元素时返回 None
+        
+        BATCH_DOM_EXTRACTION 开启时在页面内一次性提取，否则逐个元素调用 extract_video_info
+        """
+        page = page or self.page
+        if config.BATCH_DOM_EXTRACTION:
+            return await self.extract_videos_batch(page)
+        
+        video_elements = []
+        for selector in config.VIDEO_SELECTORS:
+            elements = await page.query_selector_all(selector)
+            if elements:
+                video_elements = elements
+                logger.debug(f"使用选择器 '{selector}' 找到 {len(elements)} 个元素")
+                break
+            else:
+                logger.debug(f"选择器 '{selector}' 未找到元素")
+        
+        if not video_elements:
+            return None
+        
+        videos = []
+        for element in video_elements:
+            try:
+                video_info = await self.extract_video_info(element)
+                if video_info:
+                    videos.append(video_info)
+            except Exception as e:
+                # 忽略单个视频的解析错误
+                continue
+        return videos
+    
     async def get_expected_video_count(self):
         """获取页面显示的期望视频总数"""
         try:
@@ -1331,6 +4052,37 @@ class PlaywrightBilibiliCrawler:
             print(f"⚠️ 视频数量验证出错: {e}")
             return True  # 出错时不影响主流程
     
+    async def extract_videos_batch(self, page=None):
+        """用一次 page.evaluate 提取当前页面所有视频卡片的 BV号、标题和封面
+        
+        返回视频信息列表；页面上没有匹配 VIDEO_SELECTORS 的元素时返回 None
+        """
+        result = await (page or self.page).evaluate(BATCH_EXTRACT_SCRIPT, {
+            'videoSelectors': config.VIDEO_SELECTORS,
+            'titleSelectors': config.TITLE_SELECTORS,
+            'imageSelectors': config.IMAGE_SELECTORS
+        })
+        if not result or not result.get('selector'):
+            return None
+        
+        records = result.get('records') or []
+        logger.debug(f"批量提取: 选择器 '{result['selector']}' 匹配 {len(records)} 个元素")
+        
+        return [video for video in map(self.video_from_card_record, records) if video]
+    
+    def video_from_card_record(self, record):
+        """把页面脚本返回的卡片记录 {href, title, pic} 转换为视频信息，链接中没有BV号时返回 None"""
+        bv_match = re.search(r'(BV[A-Za-z0-9]+)', record.get('href') or '')
+        if not bv_match:
+            return None
+        bvid = bv_match.group(1)
+        return {
+            'bvid': bvid,
+            'title': (record.get('title') or f'BV{bvid}的视频').strip(),
+            'pic': self.process_image_url(record.get('pic') or ''),
+            'created': int(time.time())
+        }
+    
     async def extract_video_info(self, element):
         """从视频封面元素中提取信息"""
         try:
@@ -1621,39 +4373,7 @@ class PlaywrightBilibiliCrawler:
     
     def process_image_url(self, pic_url):
         """处理图片URL，确保获取最佳质量的封面"""
-        if not pic_url:
-            return ''
-        
-        logger.debug(f"处理图片URL: {pic_url}")
-        
-        # 处理相对路径
-        if pic_url.startswith('//'):
-            pic_url = 'https:' + pic_url
-        elif pic_url.startswith('/'):
-            pic_url = 'https://i0.hdslb.com' + pic_url
-        
-        # 移除URL参数，保留原图获取最高质量
-        if '@' in pic_url:
-            base_url = pic_url.split('@')[0]
-            logger.debug(f"移除URL参数，从 {pic_url} 变为 {base_url}")
-            pic_url = base_url
-        
-        # 处理缩略图参数，尝试获取高清版本
-        if '_' in pic_url and any(size in pic_url for size in ['_160x120', '_320x200', '_480x300']):
-            # 移除小尺寸后缀，获取原图
-            import re
-            pic_url = re.sub(r'_\d+x\d+\.(jpg|jpeg|png|webp)', r'.\1', pic_url)
-            logger.debug(f"移除尺寸后缀，获取高清版本: {pic_url}")
-        
-        # 确保是有效的图片URL
-        if not any(pic_url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
-            # 如果没有扩展名，添加默认扩展名
-            if '?' not in pic_url and '#' not in pic_url:
-                pic_url += '.jpg'
-                logger.debug(f"添加默认扩展名: {pic_url}")
-        
-        logger.debug(f"最终处理后的图片URL: {pic_url}")
-        return pic_url
+        return normalize_image_url(pic_url)
     
     async def extract_generic_video_info(self, element):
         """通用视频信息提取方法（兼容旧版本）"""
@@ -1789,11 +4509,23 @@ class PlaywrightBilibiliCrawler:
     
     async def get_user_videos(self, uid):
         """从用户视频页面获取所有视频信息"""
-        videos = []
-        
         print(f"📺 开始从用户空间页面获取视频列表...")
         
+        await self.install_request_filter()
+        try:
+            return await self.load_user_videos(uid)
+        finally:
+            await self.remove_request_filter()
+    
+    async def load_user_videos(self, uid):
+        """打开用户视频页面并收集视频列表，失败时按配置重试"""
+        videos = []
         for attempt in range(config.MAX_RETRIES):
+            # 在打开页面之前订阅响应，页面首次请求的投稿列表也能拦截到
+            capture = None
+            if config.API_LISTING_CONFIG.get('enabled', True):
+                capture = ArcSearchCapture(config.API_LISTING_CONFIG['url_patterns'])
+                self.page.on('response', capture.on_response)
             try:
                 await self.smart_delay(is_api_request=True)
                 
@@ -1830,8 +4562,12 @@ class PlaywrightBilibiliCrawler:
                     print(f"😕 用户 {uid} 没有公开视频")
                     return []
                 
-                # 开始滚动加载更多视频
-                videos = await self.scroll_and_collect_videos()
+                # 优先使用拦截到的接口数据翻页，没有拦截到时才滚动页面解析DOM
+                videos = None
+                if capture:
+                    videos = await self.collect_videos_from_api(capture, video_url)
+                if videos is None:
+                    videos = await self.scroll_and_collect_videos(video_url)
                 
                 if videos:
                     self.failure_count = 0  # 成功后重置失败计数
@@ -1851,6 +4587,110 @@ class PlaywrightBilibiliCrawler:
                 else:
                     print(f"获取视频列表时发生错误: {e}")
                     return []
+            finally:
+                if capture:
+                    self.page.remove_listener('response', capture.on_response)
+    
+    async def collect_videos_from_api(self, capture, video_url):
+        """根据拦截到的投稿列表接口响应收集所有视频，用 ?pn= 直接打开后续页面触发接口请求
+        
+        第一页没有拦截到接口响应时返回 None，由调用方退回DOM滚动解析；
+        后续某一页没有拦截到时，用DOM解析当前已打开的该页
+        """
+        timeout = config.API_LISTING_CONFIG.get('response_timeout', 15)
+        first_page = await capture.wait_for_page(1, timeout)
+        if first_page is None:
+            print(f"ℹ️ 未拦截到投稿列表接口响应，改为滚动页面解析")
+            logger.info("未拦截到投稿列表接口响应，退回DOM解析")
+            return None
+        
+        total_pages = capture.total_pages or 1
+        max_pages = config.PAGINATION_CONFIG.get('max_pages', 50)
+        if total_pages > max_pages:
+            print(f"⚠️ 共 {total_pages} 页，超过 max_pages 限制，只获取前 {max_pages} 页")
+            total_pages = max_pages
+        print(f"📡 从接口响应获取视频列表：共 {capture.total_count} 个视频，{total_pages} 页")
+        
+        videos = []
+        collected_bvids = set()
+        
+        def add_videos(page_videos):
+            for video in page_videos:
+                if video['bvid'] not in collected_bvids:
+                    collected_bvids.add(video['bvid'])
+                    videos.append(video)
+        
+        add_videos(first_page)
+        if total_pages > 1:
+            page_results = await self.collect_pages_in_tabs(video_url, range(2, total_pages + 1), capture)
+            for page_no in sorted(page_results):
+                add_videos(page_results[page_no])
+        
+        if capture.total_count is not None and len(videos) < min(capture.total_count, total_pages * (capture.page_size or 0)):
+            print(f"⚠️ 数量不足：收集到 {len(videos)} 个，接口显示 {capture.total_count} 个")
+        return videos
+    
+    async def collect_pages_in_tabs(self, video_url, page_numbers, capture=None):
+        """用 ?pn= 直接打开指定页码，由最多 parallel_tabs 个标签页并行处理，返回 {页码: 视频列表}
+        
+        传入 capture 时每个标签页都挂上同一个接口拦截器，优先使用拦截到的接口数据；
+        没有拦截到时等待视频卡片出现后解析该标签页的DOM。某一页加载失败时记为空列表
+        """
+        page_numbers = list(page_numbers)
+        results = {}
+        if not page_numbers:
+            return results
+        
+        queue = asyncio.Queue()
+        for page_no in page_numbers:
+            queue.put_nowait(page_no)
+        
+        tab_count = max(1, min(int(config.PAGINATION_CONFIG.get('parallel_tabs', 3)), len(page_numbers)))
+        timeout = config.API_LISTING_CONFIG.get('response_timeout', 15)
+        delay_min, delay_max = config.API_LISTING_CONFIG.get('page_delay', (1.0, 2.0))
+        last_page = max(page_numbers)
+        print(f"🗂️ 用 {tab_count} 个标签页并行打开第 {min(page_numbers)}-{last_page} 页...")
+        
+        async def load_page(tab, page_no):
+            page_videos = capture.pages.get(page_no) if capture else None
+            if page_videos is not None:
+                return page_videos
+            await tab.goto(f"{video_url}?pn={page_no}", wait_until="domcontentloaded")
+            if capture:
+                page_videos = await capture.wait_for_page(page_no, timeout)
+                if page_videos is not None:
+                    return page_videos
+                logger.warning(f"第 {page_no} 页没有拦截到接口响应，解析页面DOM")
+            try:
+                await tab.wait_for_selector(', '.join(config.VIDEO_SELECTORS), timeout=timeout * 1000)
+            except Exception as e:
+                logger.debug(f"第 {page_no} 页等待视频卡片超时: {e}")
+            return await self.collect_videos_from_current_page(tab)
+        
+        async def worker(tab_index):
+            tab = await self.context.new_page()
+            if capture:
+                tab.on('response', capture.on_response)
+            try:
+                while not queue.empty():
+                    page_no = queue.get_nowait()
+                    # 各标签页之间错开请求，避免同一时刻集中访问
+                    await asyncio.sleep(random.uniform(delay_min, delay_max))
+                    try:
+                        results[page_no] = await load_page(tab, page_no)
+                    except Exception as e:
+                        logger.warning(f"第 {page_no} 页加载失败: {e}")
+                        print(f"⚠️ 第 {page_no} 页加载失败: {e}")
+                        results[page_no] = []
+                        continue
+                    print(f"📺 第 {page_no}/{last_page} 页获取到 {len(results[page_no])} 个视频（标签页 {tab_index + 1}）")
+            finally:
+                if capture:
+                    tab.remove_listener('response', capture.on_response)
+                await tab.close()
+        
+        await asyncio.gather(*(worker(index) for index in range(tab_count)))
+        return results
     
     async def download_user_videos(self, uid, download_covers=True):
         """下载用户所有视频"""
@@ -1897,25 +4737,7 @@ class PlaywrightBilibiliCrawler:
             
             # 下载视频
             print(f"\n📺 开始下载视频...")
-            success_count = 0
-            failed_videos = []
-            
-            with tqdm(total=len(videos), desc="下载视频") as pbar:
-                for video in videos:
-                    bvid = video['bvid']
-                    title = video['title']
-                    
-                    success = await self.video_downloader.download_video(bvid, title)
-                    if success:
-                        success_count += 1
-                    else:
-                        failed_videos.append(video)
-                    
-                    pbar.update(1)
-                    pbar.set_postfix({"成功": success_count, "失败": len(failed_videos)})
-                    
-                    # 防止请求过于频繁
-                    await asyncio.sleep(random.uniform(2, 5))
+            success_count, failed_videos = await self.schedule_video_downloads(videos)
             
             # 输出结果统计
             print(f"\n🎉 下载完成!")
@@ -1941,6 +4763,79 @@ class PlaywrightBilibiliCrawler:
         finally:
             await self.close_browser()
     
+    async def schedule_video_downloads(self, videos):
+        """并发调度视频下载，返回 (成功数量, 失败视频列表)
+        
+        最多 VIDEO_DOWNLOAD_CONFIG['max_concurrent'] 个视频同时处于下载阶段；
+        视频进入合并阶段后即释放名额，合并由FFmpeg进程池在后台完成
+        """
+        max_concurrent = max(1, int(config.VIDEO_DOWNLOAD_CONFIG.get('max_concurrent', 1)))
+        download_slots = asyncio.Semaphore(max_concurrent)
+        success_count = 0
+        failed_videos = []
+        video_tasks = []
+        
+        print(f"⚙️ 并发下载数: {max_concurrent}")
+        
+        async def run_video(video):
+            released = False
+            
+            def release_slot():
+                nonlocal released
+                if not released:
+                    released = True
+                    download_slots.release()
+            
+            try:
+                return await self.video_downloader.download_video(
+                    video['bvid'], video['title'], on_streams_ready=release_slot
+                )
+            finally:
+                release_slot()
+        
+        with tqdm(total=len(videos), desc="下载视频") as pbar:
+            
+            def record_result(video, task):
+                nonlocal success_count
+                if not task.cancelled() and task.exception() is None and task.result():
+                    success_count += 1
+                else:
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.error(f"下载视频异常: {video['bvid']} - {task.exception()}")
+                    failed_videos.append(video)
+                pbar.update(1)
+                pbar.set_postfix({"成功": success_count, "失败": len(failed_videos)})
+            
+            try:
+                for video in videos:
+                    # 已下载的视频直接计为成功，不占用名额也不做启动间隔
+                    if self.video_downloader.find_completed_video(video['bvid']):
+                        success_count += 1
+                        pbar.update(1)
+                        pbar.set_postfix({"成功": success_count, "失败": len(failed_videos)})
+                        continue
+                    
+                    # 等待空闲的下载名额
+                    await download_slots.acquire()
+                    
+                    task = asyncio.ensure_future(run_video(video))
+                    task.add_done_callback(lambda t, v=video: record_result(v, t))
+                    video_tasks.append(task)
+                    
+                    # 错开各视频的启动时间，防止请求过于频繁
+                    await asyncio.sleep(random.uniform(2, 5))
+                
+                # 等待仍在下载或合并中的视频
+                await asyncio.gather(*video_tasks, return_exceptions=True)
+            finally:
+                for task in video_tasks:
+                    if not task.done():
+                        task.cancel()
+                if video_tasks:
+                    await asyncio.gather(*video_tasks, return_exceptions=True)
+        
+        return success_count, failed_videos
+    
     async def download_single_video(self, bvid):
         """下载单个BV号视频"""
         try:
@@ -2016,6 +4911,8 @@ class PlaywrightBilibiliCrawler:
                 
                 # 获取图片数据
                 image_data = await response.body()
+                # 图片由浏览器整体取回，传输后按实际字节数计入限速，控制后续请求的节奏
+                await bandwidth_limiter.consume(len(image_data), 'covers')
                 
                 # 创建目录
                 os.makedirs(os.path.dirname(save_path), exist_ok=True)
@@ -2149,6 +5046,16 @@ class PlaywrightBilibiliCrawler:
             await self.close_browser()
 
 
+def parse_byte_rate(value):
+    """解析速率参数：纯数字为字节/秒，支持 K/M/G 后缀（如 500K、2M）"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*', value, re.IGNORECASE)
+    if not match:
+        import argparse
+        raise argparse.ArgumentTypeError(f"无效的速率: {value}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmg'.index(unit.lower() or ' '))
+
+
 async def main():
     """主函数"""
     print("🎭 哔哩哔哩视频爬虫 (Playwright版本 - 支持封面和视频下载)")
@@ -2199,6 +5106,15 @@ async def main():
   # 下载单个BV号视频
   python %(prog)s --bv BV1234567890
   
+  # 只下载用户所有视频的音频（播客/音乐频道）
+  python %(prog)s 123456 --download-videos --audio-only
+  
+  # 限制总下载速率为 2MB/s
+  python %(prog)s 123456 --download-videos --rate-limit 2M
+  
+  # 校验已下载的视频（默认校验输出目录），失败的文件移入隔离目录
+  python %(prog)s --verify
+  
   # 交互模式
   python %(prog)s
         '''
@@ -2210,9 +5126,38 @@ async def main():
     parser.add_argument('--covers-only', action='store_true', help='仅下载封面（默认行为）')
     parser.add_argument('--no-covers', action='store_true', help='不下载封面（与--download-videos配合使用）')
     parser.add_argument('--enable-video-download', action='store_true', help='启用视频下载功能')
+    parser.add_argument('--verify', nargs='?', metavar='DIR',
+                        const=config.VIDEO_DOWNLOAD_CONFIG['output_dir'],
+                        help='并行校验目录中已下载的视频（默认为输出目录），失败的文件移入隔离目录')
+    
+    parser.add_argument('--audio-only', action='store_true',
+                        help='只下载音频（含杜比/Hi-Res音轨），不重新编码封装为 audio_format（默认m4a）')
+    parser.add_argument('--rate-limit', type=parse_byte_rate, metavar='RATE',
+                        help='所有下载共享的总速率上限，如 500K、2M（覆盖 BANDWIDTH_CONFIG 的 global_limit）')
     
     args = parser.parse_args()
     
+    if args.audio_only:
+        config.VIDEO_DOWNLOAD_CONFIG['audio_only'] = True
+        print(f"🎵 纯音频模式: 输出 {config.VIDEO_DOWNLOAD_CONFIG.get('audio_format', 'm4a')}")
+    
+    if args.rate_limit is not None:
+        bandwidth_limiter.set_global_limit(args.rate_limit)
+        print(f"🚦 总下载速率上限: {args.rate_limit / 1024:.0f} KB/s" if args.rate_limit else "🚦 不限制下载速率")
+    
+    # 批量校验已下载的文件
+    if args.verify:
+        print(f"🔍 校验目录: {args.verify}")
+        downloader = BilibiliVideoDownloader()
+        passed, failed = await downloader.verify_directory(args.verify, quarantine=True)
+        print(f"\n📊 校验结果: 通过 {len(passed)} 个，失败 {len(failed)} 个")
+        for path, reason in failed:
+            print(f"  ❌ {path.name}: {reason}")
+        if failed:
+            print(f"💡 失败的文件已移至 {config.VERIFY_CONFIG.get('quarantine_dir', 'quarantine_videos')}，"
+                  f"重新运行下载即可重新获取")
+        return
+    
     # 处理BV号下载
     if args.bv:
         bvid = args.bv
@@ -31,7 +31,25 @@ PLAYWRIGHT_CONFIG = {
     'viewport': {'width': 1920, 'height': 1080},  # 视窗大小
     'user_agent': None,  # 将动态设置
     'ignore_https_errors': True,
-    'java_script_enabled': True
+    'java_script_enabled': True,
+    # 获取视频列表期间的请求过滤：中止列表用不到的资源，页面导航和投稿列表接口始终放行
+    'request_filter': {
+        'enabled': True,
+        'block_resource_types': ['image', 'media', 'font'],
+        'block_url_patterns': [        # 统计上报和广告
+            'data.bilibili.com',
+            'cm.bilibili.com',
+            'hm.baidu.com',
+            'google-analytics.com',
+            'googletagmanager.com'
+        ],
+        'estimated_bytes': {           # 估算被中止请求的平均大小，用于统计节省的流量
+            'image': 30 * 1024,
+            'media': 512 * 1024,
+            'font': 60 * 1024,
+            'other': 2 * 1024
+        }
+    }
 }
 
 # 浏览器启动参数 - 更真实的浏览器环境
@@ -151,6 +169,13 @@ SCROLL_DELAY = 1500  # 滚动延迟(毫秒) - 增加以模拟真实用户
 CLICK_DELAY = 800   # 点击延迟(毫秒)
 SCROLL_STEP = 800   # 每次滚动距离(像素)
 MAX_SCROLL_ATTEMPTS = 100  # 最大滚动次数 - 增加以获取更多视频
+BATCH_DOM_EXTRACTION = True  # 用一次 page.evaluate 批量提取所有视频卡片（关闭则逐个元素调用Playwright接口）
+CARD_OBSERVER_CONFIG = {       # 增量提取：页面内的 MutationObserver 只交回新加入的卡片（需要开启 BATCH_DOM_EXTRACTION）
+    'enabled': True,
+    'idle_timeout': 3.0,         # 每次滚动后等待新卡片出现的最长时间（秒）
+    'idle_rounds': 2,            # 连续多少次滚动没有新卡片时停止（已到达底部时一次即停止）
+    'max_retries': 2             # 卡片插入时链接或封面还没填好，最多延后解析的次数
+}
 
 # JavaScript完全加载等待配置
 WAIT_FOR_LOAD_STATES = [
@@ -191,6 +216,8 @@ PAGINATION_CONFIG = {
     'max_pages': 50,               # 最大处理页数限制
     'page_wait_time': 5,           # 页面切换后等待时间（秒）
     'click_delay': 1000,           # 点击延迟（毫秒）
+    'direct_navigation': True,     # 已知总页数时用 ?pn= 直接打开剩余页面，不再逐页点击
+    'parallel_tabs': 3,            # 并行打开分页的标签页数量
     'next_page_selectors': [       # 下一页按钮选择器
         '.vui_pagenation--btn-side:has-text("下一页")',  # "下一页"按钮
         '.vui_button:has-text("下一页")',
@@ -204,6 +231,17 @@ PAGINATION_CONFIG = {
     ]
 }
 
+# 投稿列表接口拦截配置 - 直接解析页面自身请求的 arc/search 接口响应（vlist），不再滚动解析卡片
+API_LISTING_CONFIG = {
+    'enabled': True,               # 未拦截到接口响应时自动退回DOM滚动解析
+    'url_patterns': [              # 投稿列表接口地址特征
+        '/x/space/wbi/arc/search',
+        '/x/space/arc/search'
+    ],
+    'response_timeout': 15,        # 打开页面后等待接口响应的时间（秒）
+    'page_delay': (1.0, 2.0)       # 翻页之间的随机间隔（秒）
+}
+
 # 视频元素选择器（按优先级排序）
 VIDEO_SELECTORS = [
     '.bili-video-card',             # B站新版视频卡片
@@ -262,14 +300,41 @@ NO_MORE_DATA_SELECTOR = '.no-more'  # 没有更多数据的选择器
 # 视频下载配置
 VIDEO_DOWNLOAD_CONFIG = {
     'enabled': False,              # 默认关闭视频下载功能
-    'quality': 'high',            # 视频质量：'high', 'medium', 'low'
+    'quality': 'high',            # 视频质量：'high', 'medium', 'low'（对应 quality_profiles）
+    'quality_profiles': {         # 各质量档位的视频分辨率上限（高度，像素），None表示不限制
+        'high': None,
+        'medium': 720,
+        'low': 480
+    },
+    'audio_bandwidth_caps': {     # 各质量档位的音频码率上限（bps），None表示不限制
+        'high': None,
+        'medium': 140000,
+        'low': 80000
+    },
+    'codec_preference': ['avc', 'hevc', 'av1'],  # 同分辨率下的编码优先顺序（hevc/av1体积更小，但兼容性略差）
     'format': 'mp4',              # 输出格式
+    'audio_only': False,          # 纯音频模式：只下载音频流（含杜比/Hi-Res无损音轨），不下载视频流
+    'audio_format': 'm4a',        # 纯音频模式的输出容器：m4a, mka, flac 等（编码兼容时不重新编码）
     'max_concurrent': 2,          # 最大并发下载数（降低以防止被检测）
+    'max_concurrent_pages': 2,    # 多P视频同时下载的分P数
+    'concat_pages': False,        # 是否用FFmpeg concat将多P视频拼接为单个文件（否则每个分P单独保存）
     'segment_timeout': 600,       # 分段下载超时（秒）- 增加超时时间
+    'connections': 4,             # 单个流的并行连接数（HTTP Range分段下载，1表示单连接）
+    'chunk_size': 4 * 1024 * 1024,  # 每个Range分段的大小（字节）
+    'write_buffer_size': 4 * 1024 * 1024,  # 写盘缓冲区大小（字节，1-8MB），攒满后整块写入
+    'read_bufsize': 1024 * 1024,  # HTTP响应读取缓冲区大小（字节）
+    'streaming_mux': False,       # 流式合并：音视频流边下载边经管道送入内置fMP4合并器，不写临时 .m4s（仅mp4/m4a输出，Windows不支持；中断后需重新下载）
+    'stream_pipe_size': 1024 * 1024,  # 流式合并的管道缓冲区大小（字节，仅Linux生效）
+    'mirror_probe_size': 256 * 1024,  # 镜像测速时每个镜像下载的字节数（baseUrl + backupUrl）
+    'mirror_probe_timeout': 10,   # 镜像测速超时（秒）
+    'min_speed': 200 * 1024,      # 整个流（所有连接合计）的最低速度（字节/秒），低于该值时切换镜像，最多轮换一遍，0表示不检测
+    'speed_check_interval': 5,    # 速度检测的时间窗口（秒）
     'retry_times': 5,             # 下载重试次数 - 增加重试
     'retry_delay': [3, 8, 15],    # 重试延迟阶段（秒）
+    'max_url_refresh': 3,         # 播放地址过期（deadline已过或CDN返回403）时重新获取地址的最大次数
     'temp_dir': 'temp_videos',    # 临时文件目录
     'output_dir': 'downloaded_videos',  # 输出目录
+    'completed_index': 'downloaded_videos/completed_index.json',  # 已完成下载的索引（按BV号记录，重新运行时跳过）
     
     # 反爬虫配置 - 使用更通用的浏览器标识和行为模拟
     'user_agents': [
@@ -340,24 +405,86 @@ VIDEO_DOWNLOAD_CONFIG = {
 
 # 视频API配置
 VIDEO_API_CONFIG = {
+    'timeout': 30,                # 接口请求超时（秒）
     'play_url_api': 'https://api.bilibili.com/x/player/playurl',
     'video_info_api': 'https://api.bilibili.com/x/web-interface/view',
     'required_params': {
-        'fnval': 16,    # 获取MP4格式
+        'fnval': 2448,  # DASH格式(16) + 4K(128) + 杜比音频(256) + AV1编码(2048)
         'fnver': 0,
         'fourk': 1      # 支持4K
     }
 }
 
+# HTTP连接池配置 - API接口和视频CDN分别调优，并发下载复用已建立的连接和DNS解析结果
+CONNECTION_POOL_CONFIG = {
+    'api': {                      # api.bilibili.com
+        'limit': 8,               # 连接池总连接数
+        'limit_per_host': 4,      # 每个主机的最大连接数
+        'ttl_dns_cache': 300,     # DNS缓存时间（秒）
+        'keepalive_timeout': 30   # 空闲连接保活时间（秒）
+    },
+    'cdn': {                      # upos-*.bilivideo.com / hdslb 等视频CDN
+        'limit': 64,
+        'limit_per_host': None,   # None 表示按 max_concurrent × max_concurrent_pages × 2个流 × connections 自动计算（默认 32）
+        'ttl_dns_cache': 600,
+        'keepalive_timeout': 60
+    }
+}
+
+# 接口响应缓存配置 - 视频信息和播放地址缓存在磁盘上，重新运行时直接复用
+API_CACHE_CONFIG = {
+    'enabled': True,
+    'cache_dir': '.api_cache',        # 缓存目录
+    'video_info_ttl': 7 * 24 * 3600,  # 视频信息（view接口）缓存时间（秒）
+    'playurl_margin': 300,            # 播放地址在URL的deadline之前多少秒失效
+    'playurl_default_ttl': 1800       # 播放地址中没有deadline参数时的缓存时间（秒）
+}
+
+# 带宽限制配置 - 进程内所有视频流和封面下载共享（字节/秒，0表示不限速）
+BANDWIDTH_CONFIG = {
+    'global_limit': 0,            # 全局总速率上限，例如 5 * 1024 * 1024 表示 5 MB/s
+    'job_limit': 0,               # 单个任务（一个视频的所有流，或全部封面下载）的速率上限
+    'burst_seconds': 1.0          # 令牌桶容量，允许短时突发的秒数
+}
+
+# 磁盘空间预算配置 - 按预计大小为每个下载预留临时文件和合并输出的空间，不足时排队
+DISK_BUDGET_CONFIG = {
+    'enabled': True,
+    'quota': 0,                       # 同时预留的最大字节数（例如 20 * 1024 ** 3 表示 20 GB），0表示只按剩余空间限制
+    'min_free_space': 1024 ** 3,      # 临时目录和输出目录所在的每个磁盘至少保留的剩余空间（字节）
+    'estimate_margin': 1.1,           # 用 bandwidth * 时长 估算流大小时的放大系数（拿到 content-length 后改用实际大小）
+    'cleanup_orphans': True,          # 启动时清理上次崩溃残留的临时文件（保留可续传的 .part 及其进度记录）
+    'orphan_max_age': 24 * 3600       # 超过该时间（秒）未合并的 .m4s 视为残留
+}
+
 # FFmpeg配置 - 跨平台路径支持
 FFMPEG_CONFIG = {
     'enabled': True,                    # 是否启用FFmpeg功能
     'custom_path': '',                  # 自定义FFmpeg路径（优先级最高）
     'timeout': 300,                     # FFmpeg执行超时时间（秒）
+    'max_workers': 2,                   # 同时运行的FFmpeg合并进程数（合并期间下载继续进行）
+    'merge_backend': 'auto',            # 合并方式：auto（mp4/m4a优先用内置fMP4合并器，失败时回退FFmpeg）、python（只用内置合并器）、ffmpeg
     'quality_preset': 'fast',          # 编码预设：ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow
-    'video_codec': 'copy',              # 视频编解码器：copy（不重编码），libx264, libx265等
-    'audio_codec': 'aac',               # 音频编解码器：aac, mp3, copy等
+    'video_codec': 'copy',              # 视频编解码器（仅在无法流复制时使用）：copy, libx264, libx265等
+    'audio_codec': 'aac',               # 音频编解码器（仅在无法流复制时使用）：aac, mp3, copy等
     'extra_args': ['-strict', 'experimental'],  # 额外的FFmpeg参数
+    'ffprobe_path': '',                 # 自定义ffprobe路径（留空则依次在PATH和FFmpeg同目录中查找，不依赖FFmpeg）
+    'stream_copy': True,                # 输入编码与输出容器兼容时直接流复制（-c copy），不重新编码
+    'copy_codecs': {                    # 各输出容器可直接容纳的编码（ffprobe codec_name）
+        'mp4': {
+            'video': ['h264', 'hevc', 'av1'],
+            'audio': ['aac', 'mp3', 'alac', 'flac', 'opus', 'ac3', 'eac3']
+        },
+        'm4a': {
+            'audio': ['aac', 'alac', 'flac', 'opus', 'ac3', 'eac3', 'mp3']
+        },
+        'mka': {
+            'audio': ['aac', 'alac', 'flac', 'opus', 'ac3', 'eac3', 'mp3']
+        },
+        'flac': {
+            'audio': ['flac']
+        }
+    },
     
     # 跨平台路径检测顺序
     'search_paths': {
@@ -397,4 +524,14 @@ FFMPEG_CONFIG = {
         'linux': 'https://ffmpeg.org/download.html#build-linux', 
         'darwin': 'https://ffmpeg.org/download.html#build-mac'
     }
-}
\ No newline at end of file
+}
+
+# 下载完整性校验配置
+VERIFY_CONFIG = {
+    'enabled': True,                    # 合并后用ffprobe校验输出文件
+    'max_workers': 4,                   # 同时运行的ffprobe校验进程数
+    'timeout': 60,                      # 单个文件的ffprobe超时时间（秒）
+    'duration_tolerance': 2.0,          # 允许的时长误差（秒）
+    'quarantine_dir': 'quarantine_videos',  # 校验失败文件的隔离目录（移走后下次会重新下载）
+    'extensions': ['.mp4', '.m4a'],     # --verify 批量模式校验的文件类型
+}
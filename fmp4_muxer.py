@@ -0,0 +1,566 @@
+# -*- coding: utf-8 -*-
+"""
+DASH 分片MP4（fMP4）合并器 - 不依赖FFmpeg
+
+B站的 DASH .m4s 文件是只含一条轨道的分片MP4：ftyp + moov + sidx + 若干 moof/mdat。
+本模块把多条这样的轨道（通常是一条视频和一条音频）合并成一个可播放的MP4：
+只重写盒子结构（轨道ID、分片序号、数据偏移），样本数据原样流式复制，内存占用与文件大小无关。
+
+输入只需要支持顺序 read()，因此既可以是文件，也可以是管道。
+"""
+
+import struct
+
+# 复制 mdat 等大盒子时每次读取的字节数
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# moov/moof 等需要整体读入内存解析的盒子的大小上限，防止损坏的文件耗尽内存
+MAX_HEADER_BOX_SIZE = 64 * 1024 * 1024
+
+# 只有子盒子、没有自身字段的容器盒子
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'moof', b'traf', b'edts', b'dinf'}
+
+# tfhd 标志位
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION = 0x000008
+
+# trun 标志位
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_SAMPLE_DURATION = 0x000100
+TRUN_SAMPLE_SIZE = 0x000200
+TRUN_SAMPLE_FLAGS = 0x000400
+TRUN_SAMPLE_CTS = 0x000800
+
+
+class Fmp4MuxError(Exception):
+    """输入不是可合并的单轨道分片MP4，或合并过程中数据不完整"""
+
+
+class MuxCancelled(Exception):
+    """合并被调用方取消"""
+
+
+def make_box(box_type, payload):
+    """序列化一个盒子，超过4GB时使用64位大小"""
+    size = 8 + len(payload)
+    if size > 0xFFFFFFFF:
+        return struct.pack('>I4sQ', 1, box_type, size + 8) + payload
+    return struct.pack('>I4s', size, box_type) + payload
+
+
+def iter_boxes(data, offset=0, end=None):
+    """遍历内存中的盒子序列，产出 (类型, 盒子起始位置, 负载起始位置, 盒子结束位置)"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise Fmp4MuxError(f"盒子大小无效: {box_type!r} @ {offset}")
+        yield box_type, offset, offset + header_size, offset + size
+        offset += size
+
+
+def find_box(data, path, offset=0, end=None):
+    """按路径（如 [b'mdia', b'mdhd']）查找第一个匹配的盒子，返回 (负载起始, 盒子结束) 或 None"""
+    for box_type, _, payload_start, box_end in iter_boxes(data, offset, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, box_end
+            return find_box(data, path[1:], payload_start, box_end)
+    return None
+
+
+def find_boxes(data, box_type, offset=0, end=None):
+    """查找同一层级中所有指定类型的盒子，返回 [(负载起始, 盒子结束), ...]"""
+    return [
+        (payload_start, box_end)
+        for found_type, _, payload_start, box_end in iter_boxes(data, offset, end)
+        if found_type == box_type
+    ]
+
+
+def read_exactly(stream, size):
+    """从流中读取恰好 size 个字节，到达末尾时返回已读到的部分"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+class TrackInput:
+    """一条单轨道fMP4输入：顺序读取盒子，不需要随机访问"""
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+        self.position = 0          # 已从输入读取的字节数
+        self.ftyp = None
+        self.moov = None
+        self.movie_timescale = 1000
+        self.media_timescale = 1000
+        self.duration = None       # 秒，来自 sidx
+        self.default_sample_duration = 0
+        self.pending_moof = None   # (moof字节, 在输入中的起始位置)
+        self.decode_time = 0       # 下一个分片的解码时间（媒体时间刻度）
+
+    def read_box_header(self):
+        """读取盒子头，返回 (类型, 头部字节, 负载大小或 None 表示到文件末尾)；输入结束时返回 None"""
+        start = self.position
+        header = read_exactly(self.stream, 8)
+        self.position += len(header)
+        if not header:
+            return None
+        if len(header) < 8:
+            raise Fmp4MuxError(f"{self.name}: 盒子头不完整 @ {start}")
+
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            large = read_exactly(self.stream, 8)
+            self.position += len(large)
+            if len(large) < 8:
+                raise Fmp4MuxError(f"{self.name}: 盒子头不完整 @ {start}")
+            header += large
+            size = struct.unpack('>Q', large)[0]
+        elif size == 0:
+            return box_type, header, None, start
+        if size < len(header):
+            raise Fmp4MuxError(f"{self.name}: 盒子大小无效 {box_type!r} @ {start}")
+        return box_type, header, size - len(header), start
+
+    def read_payload(self, box_type, payload_size):
+        if payload_size is None or payload_size > MAX_HEADER_BOX_SIZE:
+            raise Fmp4MuxError(f"{self.name}: {box_type.decode('latin-1')} 盒子过大")
+        payload = read_exactly(self.stream, payload_size)
+        self.position += len(payload)
+        if len(payload) < payload_size:
+            raise Fmp4MuxError(f"{self.name}: {box_type.decode('latin-1')} 数据不完整")
+        return payload
+
+    def skip_payload(self, payload_size):
+        while payload_size is None or payload_size > 0:
+            chunk = self.stream.read(COPY_CHUNK_SIZE if payload_size is None else min(COPY_CHUNK_SIZE, payload_size))
+            if not chunk:
+                if payload_size:
+                    raise Fmp4MuxError(f"{self.name}: 数据不完整")
+                return
+            self.position += len(chunk)
+            if payload_size is not None:
+                payload_size -= len(chunk)
+
+    def read_init(self):
+        """读取初始化部分（ftyp、moov、sidx），停在第一个 moof 处"""
+        while True:
+            box = self.read_box_header()
+            if box is None:
+                raise Fmp4MuxError(f"{self.name}: 没有找到媒体分片")
+            box_type, header, payload_size, start = box
+
+            if box_type == b'moof':
+                self.pending_moof = (header + self.read_payload(box_type, payload_size), start)
+                break
+            if box_type == b'mdat':
+                raise Fmp4MuxError(f"{self.name}: 不是分片MP4（mdat 出现在 moof 之前）")
+
+            if box_type == b'ftyp':
+                self.ftyp = self.read_payload(box_type, payload_size)
+            elif box_type == b'moov':
+                self.moov = header + self.read_payload(box_type, payload_size)
+            elif box_type == b'sidx':
+                self.parse_sidx(self.read_payload(box_type, payload_size))
+            else:
+                # styp、free 等对合并结果没有意义
+                self.skip_payload(payload_size)
+
+        if self.moov is None:
+            raise Fmp4MuxError(f"{self.name}: 缺少 moov")
+        self.parse_moov()
+        self.decode_time = self.get_fragment_decode_time(self.pending_moof[0])
+
+    def parse_moov(self):
+        moov = self.moov
+        traks = find_boxes(moov, b'trak', 8)
+        if len(traks) != 1:
+            raise Fmp4MuxError(f"{self.name}: 只支持单轨道输入（实际 {len(traks)} 条轨道）")
+        if not find_box(moov, [b'mvex'], 8):
+            raise Fmp4MuxError(f"{self.name}: 不是分片MP4（缺少 mvex）")
+
+        mvhd = find_box(moov, [b'mvhd'], 8)
+        if mvhd:
+            version = moov[mvhd[0]]
+            self.movie_timescale = struct.unpack_from('>I', moov, mvhd[0] + (20 if version == 1 else 12))[0] or 1000
+
+        trak_start, trak_end = traks[0]
+        mdhd = find_box(moov, [b'mdia', b'mdhd'], trak_start, trak_end)
+        if mdhd:
+            version = moov[mdhd[0]]
+            self.media_timescale = struct.unpack_from('>I', moov, mdhd[0] + (20 if version == 1 else 12))[0] or 1000
+
+        trex = find_box(moov, [b'mvex', b'trex'], 8)
+        if trex:
+            self.default_sample_duration = struct.unpack_from('>I', moov, trex[0] + 12)[0]
+
+    def parse_sidx(self, payload):
+        """从 sidx 累加各子段时长，得到轨道总时长（秒）"""
+        version = payload[0]
+        timescale = struct.unpack_from('>I', payload, 8)[0]
+        offset = 12 + (16 if version == 1 else 8) + 2
+        reference_count = struct.unpack_from('>H', payload, offset)[0]
+        offset += 2
+        total = 0
+        for _ in range(reference_count):
+            total += struct.unpack_from('>I', payload, offset + 4)[0]
+            offset += 12
+        if timescale:
+            self.duration = (self.duration or 0) + total / timescale
+
+    def get_fragment_decode_time(self, moof):
+        """分片的解码时间：优先读取 tfdt，没有时沿用累计值"""
+        traf = find_box(moof, [b'traf'], 8)
+        if traf:
+            tfdt = find_box(moof, [b'tfdt'], traf[0], traf[1])
+            if tfdt:
+                version = moof[tfdt[0]]
+                if version == 1:
+                    return struct.unpack_from('>Q', moof, tfdt[0] + 4)[0]
+                return struct.unpack_from('>I', moof, tfdt[0] + 4)[0]
+        return self.decode_time
+
+    def get_fragment_duration(self, moof):
+        """根据 trun 的样本时长计算分片时长（媒体时间刻度）"""
+        total = 0
+        for traf_start, traf_end in find_boxes(moof, b'traf', 8):
+            default_duration = self.default_sample_duration
+            tfhd = find_box(moof, [b'tfhd'], traf_start, traf_end)
+            if tfhd:
+                flags = struct.unpack_from('>I', moof, tfhd[0])[0] & 0xFFFFFF
+                offset = tfhd[0] + 8
+                if flags & TFHD_BASE_DATA_OFFSET:
+                    offset += 8
+                if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+                    offset += 4
+                if flags & TFHD_DEFAULT_SAMPLE_DURATION:
+                    default_duration = struct.unpack_from('>I', moof, offset)[0]
+
+            for trun_start, _ in find_boxes(moof, b'trun', traf_start, traf_end):
+                flags = struct.unpack_from('>I', moof, trun_start)[0] & 0xFFFFFF
+                sample_count = struct.unpack_from('>I', moof, trun_start + 4)[0]
+                if not flags & TRUN_SAMPLE_DURATION:
+                    total += sample_count * default_duration
+                    continue
+                offset = trun_start + 8
+                if flags & TRUN_DATA_OFFSET:
+                    offset += 4
+                if flags & TRUN_FIRST_SAMPLE_FLAGS:
+                    offset += 4
+                entry_size = 4 * sum(1 for flag in (TRUN_SAMPLE_DURATION, TRUN_SAMPLE_SIZE,
+                                                    TRUN_SAMPLE_FLAGS, TRUN_SAMPLE_CTS) if flags & flag)
+                for index in range(sample_count):
+                    total += struct.unpack_from('>I', moof, offset + index * entry_size)[0]
+        return total
+
+    @property
+    def next_time(self):
+        """下一个分片的解码时间（秒），用于按时间交错两条轨道的分片"""
+        return self.decode_time / self.media_timescale
+
+    def copy_fragment_body(self, output, cancel_event=None):
+        """复制当前 moof 之后、下一个 moof 之前的盒子（mdat 等），读到下一个 moof 时停下
+
+        返回写入的字节数
+        """
+        written = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise MuxCancelled()
+
+            box = self.read_box_header()
+            if box is None:
+                self.pending_moof = None
+                return written
+            box_type, header, payload_size, start = box
+
+            if box_type == b'moof':
+                moof = header + self.read_payload(box_type, payload_size)
+                previous_moof = self.pending_moof[0]
+                self.pending_moof = (moof, start)
+                tfdt_time = self.get_fragment_decode_time(moof)
+                if tfdt_time == self.decode_time:
+                    # 没有 tfdt 时按上一个分片的时长累加
+                    tfdt_time = self.decode_time + self.get_fragment_duration(previous_moof)
+                self.decode_time = tfdt_time
+                return written
+
+            if box_type in (b'sidx', b'mfra', b'styp', b'free', b'skip'):
+                # 索引和随机访问表记录的是原文件的字节偏移，合并后已失效
+                self.skip_payload(payload_size)
+                continue
+
+            if payload_size is None:
+                # 大小为0表示延伸到文件末尾，改写成明确的大小需要先知道长度，这里只能按原样写出
+                output.write(header)
+                written += len(header)
+                written += self.copy_payload(output, None, cancel_event)
+                self.pending_moof = None
+                return written
+
+            output.write(header)
+            written += len(header)
+            written += self.copy_payload(output, payload_size, cancel_event)
+
+    def copy_payload(self, output, payload_size, cancel_event=None):
+        """流式复制负载数据，内存占用固定为一个缓冲块"""
+        copied = 0
+        while payload_size is None or copied < payload_size:
+            if cancel_event is not None and cancel_event.is_set():
+                raise MuxCancelled()
+            want = COPY_CHUNK_SIZE if payload_size is None else min(COPY_CHUNK_SIZE, payload_size - copied)
+            chunk = self.stream.read(want)
+            if not chunk:
+                if payload_size is None:
+                    break
+                raise Fmp4MuxError(f"{self.name}: 媒体数据不完整（{copied}/{payload_size} 字节）")
+            output.write(chunk)
+            copied += len(chunk)
+            self.position += len(chunk)
+        return copied
+
+
+def rewrite_tkhd(payload, track_id, duration):
+    """改写 tkhd 的轨道ID和时长（电影时间刻度，None 表示保持不变）"""
+    payload = bytearray(payload)
+    version = payload[0]
+    if version == 1:
+        struct.pack_into('>I', payload, 20, track_id)
+        if duration is not None:
+            struct.pack_into('>Q', payload, 28, duration)
+    else:
+        struct.pack_into('>I', payload, 12, track_id)
+        if duration is not None:
+            struct.pack_into('>I', payload, 20, min(duration, 0xFFFFFFFF))
+    return bytes(payload)
+
+
+def rewrite_elst(payload, source_timescale, target_timescale):
+    """按新的电影时间刻度换算编辑列表中的 segment_duration（media_time 使用媒体刻度，不变）"""
+    if source_timescale == target_timescale:
+        return payload
+    payload = bytearray(payload)
+    version = payload[0]
+    entry_count = struct.unpack_from('>I', payload, 4)[0]
+    offset = 8
+    for _ in range(entry_count):
+        if version == 1:
+            duration = struct.unpack_from('>Q', payload, offset)[0]
+            struct.pack_into('>Q', payload, offset, duration * target_timescale // source_timescale)
+            offset += 20
+        else:
+            duration = struct.unpack_from('>I', payload, offset)[0]
+            struct.pack_into('>I', payload, offset,
+                             min(duration * target_timescale // source_timescale, 0xFFFFFFFF))
+            offset += 12
+    return bytes(payload)
+
+
+def rebuild_container(data, start, end, rewrite):
+    """重建容器盒子的子盒子列表；rewrite(类型, 负载) 返回新负载，返回 None 表示删除该子盒子"""
+    parts = []
+    for box_type, _, payload_start, box_end in iter_boxes(data, start, end):
+        payload = data[payload_start:box_end]
+        if box_type in CONTAINER_BOXES:
+            payload = rebuild_container(data, payload_start, box_end, rewrite)
+        payload = rewrite(box_type, payload)
+        if payload is not None:
+            parts.append(make_box(box_type, payload))
+    return b''.join(parts)
+
+
+def build_trak(track, track_id, movie_timescale, duration):
+    moov = track.moov
+    trak_start, trak_end = find_boxes(moov, b'trak', 8)[0]
+
+    def rewrite(box_type, payload):
+        if box_type == b'tkhd':
+            return rewrite_tkhd(payload, track_id, duration)
+        if box_type == b'elst':
+            return rewrite_elst(payload, track.movie_timescale, movie_timescale)
+        return payload
+
+    return make_box(b'trak', rebuild_container(moov, trak_start, trak_end, rewrite))
+
+
+def build_trex(track, track_id):
+    trex = find_box(track.moov, [b'mvex', b'trex'], 8)
+    if trex:
+        payload = bytearray(track.moov[trex[0]:trex[1]])
+    else:
+        # 缺少 trex 时使用默认值：第一个样本描述，其余默认值为0
+        payload = bytearray(struct.pack('>IIIIII', 0, 0, 1, 0, 0, 0))
+    struct.pack_into('>I', payload, 4, track_id)
+    return make_box(b'trex', bytes(payload))
+
+
+def build_ftyp(tracks, major_brand):
+    """生成输出的 ftyp：保留输入的兼容品牌，去掉DASH分片专用的品牌"""
+    brands = []
+    for brand in (major_brand, b'isom', b'iso6', b'mp41'):
+        if brand not in brands:
+            brands.append(brand)
+    for track in tracks:
+        if track.ftyp and len(track.ftyp) >= 8:
+            for index in range(8, len(track.ftyp) - 3, 4):
+                brand = track.ftyp[index:index + 4]
+                if brand not in brands and brand not in (b'dash', b'msdh', b'msix'):
+                    brands.append(brand)
+    return make_box(b'ftyp', major_brand + struct.pack('>I', 512) + b''.join(brands))
+
+
+def build_moov(tracks):
+    """合并各输入的 moov：第一条轨道的 mvhd 和其他元数据为准，轨道ID依次为 1..N"""
+    base = tracks[0]
+    movie_timescale = base.movie_timescale
+
+    durations = [
+        int(round(track.duration * movie_timescale)) if track.duration else None
+        for track in tracks
+    ]
+    known_durations = [duration for duration in durations if duration]
+    movie_duration = max(known_durations) if known_durations else None
+
+    moov = base.moov
+    parts = []
+    for box_type, box_start, payload_start, box_end in iter_boxes(moov, 8):
+        if box_type == b'mvhd':
+            payload = bytearray(moov[payload_start:box_end])
+            version = payload[0]
+            if movie_duration is not None:
+                if version == 1:
+                    struct.pack_into('>Q', payload, 24, movie_duration)
+                else:
+                    struct.pack_into('>I', payload, 16, min(movie_duration, 0xFFFFFFFF))
+            struct.pack_into('>I', payload, len(payload) - 4, len(tracks) + 1)
+            parts.append(make_box(b'mvhd', bytes(payload)))
+
+            # 轨道紧跟在 mvhd 之后
+            for index, track in enumerate(tracks):
+                parts.append(build_trak(track, index + 1, movie_timescale, durations[index]))
+        elif box_type in (b'trak', b'mvex'):
+            continue
+        else:
+            # udta 等其他元数据原样保留
+            parts.append(moov[box_start:box_end])
+
+    mvex = []
+    if movie_duration is not None:
+        # mehd 给出整个分片电影的时长，播放器无需扫描所有分片即可显示总时长
+        mvex.append(make_box(b'mehd', struct.pack('>IQ', 1 << 24, movie_duration)))
+    for index, track in enumerate(tracks):
+        mvex.append(build_trex(track, index + 1))
+    parts.append(make_box(b'mvex', b''.join(mvex)))
+
+    return make_box(b'moov', b''.join(parts))
+
+
+def rewrite_moof(moof, sequence_number, track_id, old_position, new_position):
+    """改写分片头：重新编号 mfhd、替换 tfhd 中的轨道ID，并修正绝对的 base_data_offset
+
+    只修改定长字段，moof 大小不变，因此相对 moof 的 trun data_offset 仍然有效
+    """
+    moof = bytearray(moof)
+    mfhd = find_box(moof, [b'mfhd'], 8)
+    if mfhd:
+        struct.pack_into('>I', moof, mfhd[0] + 4, sequence_number)
+
+    for traf_start, traf_end in find_boxes(moof, b'traf', 8):
+        tfhd = find_box(moof, [b'tfhd'], traf_start, traf_end)
+        if not tfhd:
+            raise Fmp4MuxError("分片缺少 tfhd")
+        flags = struct.unpack_from('>I', moof, tfhd[0])[0] & 0xFFFFFF
+        struct.pack_into('>I', moof, tfhd[0] + 4, track_id)
+        if flags & TFHD_BASE_DATA_OFFSET:
+            base_offset = struct.unpack_from('>Q', moof, tfhd[0] + 8)[0]
+            struct.pack_into('>Q', moof, tfhd[0] + 8, base_offset - old_position + new_position)
+    return bytes(moof)
+
+
+def mux_fmp4(inputs, output, major_brand=b'isom', cancel_event=None):
+    """把多条单轨道fMP4合并写入 output
+
+    inputs: [(可读流, 名称), ...]，第一条通常是视频；只需要顺序读取
+    output: 可写流，只需要顺序写入
+    cancel_event: 可选的 threading.Event，置位后在下一个数据块处停止并抛出 MuxCancelled
+    返回统计信息 {'fragments', 'bytes', 'duration'}
+    """
+    tracks = [TrackInput(stream, name) for stream, name in inputs]
+    if not tracks:
+        raise Fmp4MuxError("没有输入轨道")
+    for track in tracks:
+        track.read_init()
+
+    written = 0
+    for box in (build_ftyp(tracks, major_brand), build_moov(tracks)):
+        output.write(box)
+        written += len(box)
+
+    # 按解码时间交错写出各轨道的分片，播放时音视频数据在文件中相邻
+    sequence_number = 0
+    while True:
+        active = [(index, track) for index, track in enumerate(tracks) if track.pending_moof]
+        if not active:
+            break
+        index, track = min(active, key=lambda item: (item[1].next_time, item[0]))
+
+        moof, old_position = track.pending_moof
+        sequence_number += 1
+        moof = rewrite_moof(moof, sequence_number, index + 1, old_position, written)
+        output.write(moof)
+        written += len(moof)
+        written += track.copy_fragment_body(output, cancel_event)
+
+    durations = [track.duration for track in tracks if track.duration]
+    return {
+        'fragments': sequence_number,
+        'bytes': written,
+        'duration': max(durations) if durations else None
+    }
+
+
+def mux_fmp4_files(inputs, output_path, major_brand=b'isom', cancel_event=None):
+    """把fMP4轨道合并写入 output_path；失败或取消时删除不完整的输出文件
+
+    inputs 中的元素可以是文件路径，也可以是 (已打开的可读流, 名称)（如管道），后者由调用方负责关闭
+    """
+    import os
+
+    streams = []
+    opened = []
+    try:
+        for item in inputs:
+            if isinstance(item, tuple):
+                streams.append(item)
+            else:
+                stream = open(item, 'rb')
+                opened.append(stream)
+                streams.append((stream, os.path.basename(str(item))))
+        with open(output_path, 'wb') as output:
+            return mux_fmp4(streams, output, major_brand, cancel_event)
+    except BaseException:
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        for stream in opened:
+            stream.close()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""构造测试用的单轨道DASH分片MP4（ftyp + moov + sidx + moof/mdat），以及解析合并结果的工具"""
+
+import struct
+
+import fmp4_muxer
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, version, flags, payload):
+    return box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def build_track(handler, timescale, fragment_duration, fragments, samples, sample_size,
+                with_tfdt=True, absolute_base=False, seed=0):
+    """生成一条单轨道fMP4，返回 (文件内容, 每个分片的样本数据列表)
+
+    absolute_base 为 True 时 tfhd 带绝对的 base_data_offset（指向 moof 在源文件中的位置），
+    否则使用 default-base-is-moof，trun data_offset 相对 moof 起点
+    """
+    ftyp = box(b'ftyp', b'iso5' + struct.pack('>I', 1) + b'iso5dashiso6mp41')
+    mvhd = full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, 0) + b'\0' * 80 + struct.pack('>I', 2))
+    tkhd = full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0) + b'\0' * 60)
+    mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, 0) + b'\0' * 4)
+    hdlr = full_box(b'hdlr', 0, 0, b'\0' * 4 + handler + b'\0' * 12 + b'x\0')
+    minf = box(b'minf', box(b'stbl', full_box(b'stsd', 0, 0, struct.pack('>I', 0))))
+    elst = full_box(b'elst', 0, 0, struct.pack('>IIIHH', 1, 5000, 0, 1, 0))
+    trak = box(b'trak', tkhd + box(b'edts', elst) + box(b'mdia', mdhd + hdlr + minf))
+    trex = full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, fragment_duration // samples, 0, 0))
+    moov = box(b'moov', mvhd + trak + box(b'mvex', trex))
+    references = b''.join(struct.pack('>III', 100, fragment_duration, 0x90000000) for _ in range(fragments))
+    sidx = full_box(b'sidx', 0, 0, struct.pack('>IIIIHH', 1, timescale, 0, 0, 0, fragments) + references)
+
+    data = bytearray(ftyp + moov + sidx)
+    payloads = []
+    for index in range(fragments):
+        payload = bytes([(seed * 16 + index) & 0xFF]) * (sample_size * samples)
+        payloads.append(payload)
+        moof_position = len(data)
+
+        mfhd = full_box(b'mfhd', 0, 0, struct.pack('>I', index + 1))
+        if absolute_base:
+            tfhd = full_box(b'tfhd', 0, 0x000001, struct.pack('>IQ', 1, moof_position))
+        else:
+            tfhd = full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1))
+        tfdt = full_box(b'tfdt', 1, 0, struct.pack('>Q', index * fragment_duration)) if with_tfdt else b''
+        entries = b''.join(struct.pack('>II', fragment_duration // samples, sample_size) for _ in range(samples))
+        trun = full_box(b'trun', 0, 0x000301, struct.pack('>Ii', samples, 0) + entries)
+        moof = bytearray(box(b'moof', mfhd + box(b'traf', tfhd + tfdt + trun)))
+
+        # 两种方式的基准位置都是 moof 起点，样本数据紧跟在 mdat 头之后
+        trun_position = moof.find(b'trun') - 4
+        struct.pack_into('>i', moof, trun_position + 16, len(moof) + 8)
+        data += moof + box(b'mdat', payload)
+    return bytes(data), payloads
+
+
+def parse_fragments(data):
+    """解析合并后的文件，按出现顺序返回每个分片的字段和按 trun 取出的样本数据"""
+    fragments = []
+    boxes = list(fmp4_muxer.iter_boxes(data))
+    for position, (box_type, box_start, payload_start, box_end) in enumerate(boxes):
+        if box_type != b'moof':
+            continue
+        mfhd = fmp4_muxer.find_box(data, [b'mfhd'], payload_start, box_end)
+        traf = fmp4_muxer.find_box(data, [b'traf'], payload_start, box_end)
+        tfhd = fmp4_muxer.find_box(data, [b'tfhd'], *traf)
+        trun = fmp4_muxer.find_box(data, [b'trun'], *traf)
+        tfdt = fmp4_muxer.find_box(data, [b'tfdt'], *traf)
+
+        flags = struct.unpack_from('>I', data, tfhd[0])[0] & 0xFFFFFF
+        base = struct.unpack_from('>Q', data, tfhd[0] + 8)[0] if flags & 0x000001 else box_start
+        sample_count, data_offset = struct.unpack_from('>Ii', data, trun[0] + 4)
+        size = sum(struct.unpack_from('>I', data, trun[0] + 12 + i * 8 + 4)[0] for i in range(sample_count))
+
+        mdat_type, _, mdat_payload, _ = boxes[position + 1]
+        fragments.append({
+            'sequence': struct.unpack_from('>I', data, mfhd[0] + 4)[0],
+            'track_id': struct.unpack_from('>I', data, tfhd[0] + 4)[0],
+            'absolute_base': bool(flags & 0x000001),
+            'moof_start': box_start,
+            'base': base,
+            'data_start': base + data_offset,
+            'mdat_type': mdat_type,
+            'mdat_payload': mdat_payload,
+            'decode_time': struct.unpack_from('>Q', data, tfdt[0] + 4)[0] if tfdt else None,
+            'payload': data[base + data_offset:base + data_offset + size]
+        })
+    return fragments
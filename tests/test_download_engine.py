@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""下载引擎的测试：多连接Range下载、.part/.part.json 断点续传和镜像切换，使用本地aiohttp服务"""
+
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+
+import config
+import bilibili_cover_crawler_playwright as crawler
+
+
+DATA = os.urandom(300 * 1024 + 123)
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeServer:
+    """支持Range的本地文件服务，记录每次请求的起始位置；可让指定路径返回错误或错误的范围"""
+
+    def __init__(self):
+        self.requests = []          # [(路径, 起始字节), ...]
+        self.failing = set()        # 返回500的路径
+        self.shifted = set()        # 续传时返回错误起始位置的路径
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        path = request.path
+        start, end = 0, len(DATA) - 1
+        range_header = request.headers.get('Range')
+        if range_header:
+            first, _, last = range_header.split('=', 1)[1].partition('-')
+            start = int(first)
+            end = min(int(last), len(DATA) - 1) if last else len(DATA) - 1
+        self.requests.append((path, start))
+
+        if path in self.failing:
+            return web.Response(status=500)
+        if path in self.shifted and start > 0:
+            start //= 2
+        return web.Response(status=206, body=DATA[start:end + 1], headers={
+            'Content-Range': f'bytes {start}-{end}/{len(DATA)}'
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{name}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def url(self, name):
+        return f'http://127.0.0.1:{self.port}/{name}'
+
+    def starts(self, name):
+        return sorted(start for path, start in self.requests if path == f'/{name}')
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'temp_dir', str(tmp_path / 'temp'))
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'output_dir', str(tmp_path / 'output'))
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'retry_delay', [0])
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'min_speed', 0)
+    return crawler.BilibiliVideoDownloader()
+
+
+def run_with_server(downloader, scenario):
+    """启动本地服务和下载器会话后执行 scenario(server)，结束后清理"""
+    async def main():
+        server = RangeServer()
+        await server.start()
+        await downloader.init_session()
+        try:
+            return await scenario(server)
+        finally:
+            await downloader.close_session()
+            await server.runner.cleanup()
+    return asyncio.run(main())
+
+
+def write_partial(downloader, output_path, url, progress):
+    """模拟中断的多连接下载：预分配 .part 文件，写入每个分段已完成的部分并保存进度记录"""
+    part_path, meta_path = downloader.get_part_paths(output_path)
+    with open(part_path, 'wb') as f:
+        f.truncate(len(DATA))
+        for start, written in progress.items():
+            f.seek(start)
+            f.write(DATA[start:start + written])
+    downloader.save_part_meta(meta_path, {
+        'url': url,
+        'url_path': crawler.urlparse(url).path,
+        'mode': 'ranges',
+        'total_size': len(DATA),
+        'chunk_size': CHUNK_SIZE,
+        'progress': {str(start): written for start, written in progress.items()}
+    })
+    return part_path, meta_path
+
+
+def test_ranges_download_splits_file(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+
+    async def scenario(server):
+        ok = await downloader.download_ranges([server.url('video.m4s')], {}, output_path,
+                                              len(DATA), 4, CHUNK_SIZE)
+        return ok, server.starts('video.m4s')
+
+    ok, starts = run_with_server(downloader, scenario)
+    assert ok
+    assert output_path.read_bytes() == DATA
+    assert starts == list(range(0, len(DATA), CHUNK_SIZE))
+    part_path, meta_path = downloader.get_part_paths(output_path)
+    assert not part_path.exists() and not meta_path.exists()
+
+
+def test_ranges_resume_from_part_sidecar(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+    # 第1段完成，第2段写了一半，其余未开始
+    progress = {0: CHUNK_SIZE, CHUNK_SIZE: 1000}
+
+    async def scenario(server):
+        write_partial(downloader, output_path, server.url('video.m4s'), progress)
+        ok = await downloader.download_ranges([server.url('video.m4s')], {}, output_path,
+                                              len(DATA), 2, CHUNK_SIZE)
+        return ok, server.starts('video.m4s')
+
+    ok, starts = run_with_server(downloader, scenario)
+    assert ok
+    assert output_path.read_bytes() == DATA
+    # 已完成的分段不再请求，写了一半的分段从断点继续
+    assert starts == [CHUNK_SIZE + 1000] + list(range(2 * CHUNK_SIZE, len(DATA), CHUNK_SIZE))
+
+
+def test_ranges_ignore_sidecar_from_other_source(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+
+    async def scenario(server):
+        write_partial(downloader, output_path, server.url('other.m4s'), {0: CHUNK_SIZE})
+        ok = await downloader.download_ranges([server.url('video.m4s')], {}, output_path,
+                                              len(DATA), 2, CHUNK_SIZE)
+        return ok, server.starts('video.m4s')
+
+    ok, starts = run_with_server(downloader, scenario)
+    assert ok
+    assert output_path.read_bytes() == DATA
+    assert starts[0] == 0
+
+
+def test_ranges_switch_to_next_mirror(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+
+    async def scenario(server):
+        server.failing.add('/primary.m4s')
+        ok = await downloader.download_ranges([server.url('primary.m4s'), server.url('backup.m4s')], {},
+                                              output_path, len(DATA), 2, CHUNK_SIZE)
+        return ok, server.starts('backup.m4s')
+
+    ok, backup_starts = run_with_server(downloader, scenario)
+    assert ok
+    assert output_path.read_bytes() == DATA
+    assert backup_starts
+
+
+def test_download_from_mirrors_skips_broken_mirror(downloader, monkeypatch):
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'connections', 2)
+    monkeypatch.setitem(config.VIDEO_DOWNLOAD_CONFIG, 'chunk_size', CHUNK_SIZE)
+    output_path = downloader.temp_dir / 'audio.m4s'
+
+    async def scenario(server):
+        server.failing.add('/broken.m4s')
+        return await downloader.download_from_mirrors([server.url('broken.m4s'), server.url('audio.m4s')],
+                                                      {}, output_path)
+
+    assert run_with_server(downloader, scenario)
+    assert output_path.read_bytes() == DATA
+
+
+def write_stream_part(downloader, output_path, url, size):
+    part_path, meta_path = downloader.get_part_paths(output_path)
+    part_path.write_bytes(DATA[:size])
+    downloader.save_part_meta(meta_path, {
+        'url': url,
+        'url_path': crawler.urlparse(url).path,
+        'mode': 'stream',
+        'total_size': None
+    })
+
+
+def test_single_connection_resume(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+
+    async def scenario(server):
+        write_stream_part(downloader, output_path, server.url('video.m4s'), 50000)
+        ok = await downloader.download_single_connection(server.url('video.m4s'), {}, output_path)
+        return ok, server.starts('video.m4s')
+
+    ok, starts = run_with_server(downloader, scenario)
+    assert ok
+    assert starts == [50000]
+    assert output_path.read_bytes() == DATA
+
+
+def test_single_connection_restarts_on_content_range_mismatch(downloader):
+    output_path = downloader.temp_dir / 'video.m4s'
+
+    async def scenario(server):
+        server.shifted.add('/video.m4s')
+        write_stream_part(downloader, output_path, server.url('video.m4s'), 50000)
+        ok = await downloader.download_single_connection(server.url('video.m4s'), {}, output_path)
+        return ok, server.starts('video.m4s')
+
+    ok, starts = run_with_server(downloader, scenario)
+    assert ok
+    assert starts == [0, 50000]
+    assert output_path.read_bytes() == DATA
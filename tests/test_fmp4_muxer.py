@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""fmp4_muxer 的测试：用构造的单轨道DASH分片检查合并后的盒子结构和数据偏移"""
+
+import io
+import struct
+import threading
+
+import pytest
+
+import fmp4_muxer
+from fmp4_samples import build_track, parse_fragments
+
+
+VIDEO_TIMESCALE = 16000
+AUDIO_TIMESCALE = 48000
+
+
+@pytest.fixture
+def video_track():
+    # 视频：default-base-is-moof，data_offset 相对 moof
+    return build_track(b'vide', VIDEO_TIMESCALE, VIDEO_TIMESCALE, 5, 25, 1000, seed=1)
+
+
+@pytest.fixture
+def audio_track():
+    # 音频：tfhd 中带绝对 base_data_offset
+    return build_track(b'soun', AUDIO_TIMESCALE, AUDIO_TIMESCALE, 5, 47, 200, absolute_base=True, seed=2)
+
+
+def mux(*tracks):
+    output = io.BytesIO()
+    inputs = [(io.BytesIO(data), f'track{index}') for index, (data, _) in enumerate(tracks)]
+    stats = fmp4_muxer.mux_fmp4(inputs, output)
+    return output.getvalue(), stats
+
+
+def get_track_ids(data):
+    moov = fmp4_muxer.find_box(data, [b'moov'])
+    track_ids = []
+    for trak_start, trak_end in fmp4_muxer.find_boxes(data, b'trak', *moov):
+        tkhd = fmp4_muxer.find_box(data, [b'tkhd'], trak_start, trak_end)
+        track_ids.append(struct.unpack_from('>I', data, tkhd[0] + 12)[0])
+    mvhd = fmp4_muxer.find_box(data, [b'mvhd'], *moov)
+    next_track_id = struct.unpack_from('>I', data, mvhd[1] - 4)[0]
+    return track_ids, next_track_id
+
+
+def test_output_layout(video_track, audio_track):
+    data, stats = mux(video_track, audio_track)
+
+    top_level = [box_type for box_type, *_ in fmp4_muxer.iter_boxes(data)]
+    assert top_level[:2] == [b'ftyp', b'moov']
+    assert b'sidx' not in top_level
+    assert top_level[2:] == [b'moof', b'mdat'] * 10
+    assert stats['fragments'] == 10
+    assert stats['bytes'] == len(data)
+
+    assert get_track_ids(data) == ([1, 2], 3)
+
+
+def test_sequence_numbers_and_track_ids(video_track, audio_track):
+    data, _ = mux(video_track, audio_track)
+    fragments = parse_fragments(data)
+
+    assert [fragment['sequence'] for fragment in fragments] == list(range(1, 11))
+    assert sorted({fragment['track_id'] for fragment in fragments}) == [1, 2]
+
+
+def test_sample_data_follows_trun_offsets(video_track, audio_track):
+    data, _ = mux(video_track, audio_track)
+    fragments = parse_fragments(data)
+
+    for fragment in fragments:
+        assert fragment['mdat_type'] == b'mdat'
+        # trun data_offset 加上基准位置必须正好指向紧随其后的 mdat 数据
+        assert fragment['data_start'] == fragment['mdat_payload']
+
+    payloads = {1: [], 2: []}
+    for fragment in fragments:
+        payloads[fragment['track_id']].append(fragment['payload'])
+    assert payloads[1] == video_track[1]
+    assert payloads[2] == audio_track[1]
+
+
+def test_moof_relative_and_absolute_base_offsets(video_track, audio_track):
+    data, _ = mux(video_track, audio_track)
+    fragments = parse_fragments(data)
+
+    video = [fragment for fragment in fragments if fragment['track_id'] == 1]
+    audio = [fragment for fragment in fragments if fragment['track_id'] == 2]
+    assert not any(fragment['absolute_base'] for fragment in video)
+    assert all(fragment['absolute_base'] for fragment in audio)
+    # 绝对 base_data_offset 被改写为 moof 在输出文件中的新位置
+    assert all(fragment['base'] == fragment['moof_start'] for fragment in audio)
+
+
+def test_fragments_interleaved_by_decode_time(video_track, audio_track):
+    data, _ = mux(video_track, audio_track)
+    timescales = {1: VIDEO_TIMESCALE, 2: AUDIO_TIMESCALE}
+    times = [fragment['decode_time'] / timescales[fragment['track_id']] for fragment in parse_fragments(data)]
+    assert times == sorted(times)
+
+
+def test_fragments_without_tfdt(audio_track):
+    video_track = build_track(b'vide', VIDEO_TIMESCALE, VIDEO_TIMESCALE, 4, 25, 1000, with_tfdt=False, seed=3)
+    data, stats = mux(video_track, audio_track)
+    fragments = parse_fragments(data)
+
+    assert stats['fragments'] == 9
+    assert [fragment['payload'] for fragment in fragments if fragment['track_id'] == 1] == video_track[1]
+    assert [fragment['payload'] for fragment in fragments if fragment['track_id'] == 2] == audio_track[1]
+
+
+def test_truncated_input_raises(video_track, audio_track):
+    truncated = (video_track[0][:-100], video_track[1])
+    with pytest.raises(fmp4_muxer.Fmp4MuxError):
+        mux(truncated, audio_track)
+
+
+def test_non_fragmented_input_raises(video_track):
+    data = video_track[0]
+    first_moof = data.find(b'moof') - 4
+    plain = data[:first_moof] + struct.pack('>I4s', 12, b'mdat') + b'abcd'
+    with pytest.raises(fmp4_muxer.Fmp4MuxError):
+        mux((plain, []))
+
+
+def test_cancel_event_stops_muxing(video_track):
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(fmp4_muxer.MuxCancelled):
+        fmp4_muxer.mux_fmp4([(io.BytesIO(video_track[0]), 'video')], io.BytesIO(), cancel_event=cancel_event)
+
+
+def test_mux_files_removes_output_on_failure(tmp_path, video_track, audio_track):
+    video_path = tmp_path / 'video.m4s'
+    audio_path = tmp_path / 'audio.m4s'
+    output_path = tmp_path / 'output.mp4'
+    video_path.write_bytes(video_track[0][:-100])
+    audio_path.write_bytes(audio_track[0])
+
+    with pytest.raises(fmp4_muxer.Fmp4MuxError):
+        fmp4_muxer.mux_fmp4_files([video_path, audio_path], output_path)
+    assert not output_path.exists()
+
+    video_path.write_bytes(video_track[0])
+    stats = fmp4_muxer.mux_fmp4_files([video_path, audio_path], output_path)
+    assert output_path.stat().st_size == stats['bytes']